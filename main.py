@@ -1,7 +1,19 @@
+import argparse
 import walabot_data_acquisition
+from walabot_capture import add_backend_arguments, create_walabot
+from walabot_metrics import add_metrics_arguments, start_metrics, finish_metrics
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Acquire and save data from a Walabot.')
+    add_backend_arguments(parser)
+    add_metrics_arguments(parser)
+    return parser.parse_args()
 
 def main():
-    walabot_data_acquisition.MainApp()
+    args = parse_args()
+    start_metrics(args)
+    walabot_data_acquisition.MainApp(create_walabot(args))
+    finish_metrics(args)
 
 if __name__ == '__main__':
     main()
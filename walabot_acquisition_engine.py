@@ -0,0 +1,214 @@
+from queue import Queue, Empty, Full
+import threading
+import time
+from walabot_metrics import metrics
+
+# Capture types (raw signals, 2D image, 3D image). These match the capture type
+# names used by the main application so frames can be saved without translation.
+SIGNALS = 'signals'
+IMAGE_SLICE = 'im_2d'
+IMAGE = 'im_3d'
+
+class Frame():
+    '''A single trigger's worth of data produced by the acquisition engine.'''
+
+    def __init__(self, seq, timestamp):
+        '''
+        Inputs:
+            seq: int, trigger sequence number (starts at 0 for each run of the engine)
+            timestamp: float, time.perf_counter() value taken straight after the trigger
+        '''
+
+        self.seq = seq
+        self.timestamp = timestamp
+        self.data = {}          # Capture type -> signals DataFrame or image Numpy array
+        self.walabot_error = None
+
+    def get(self, capture_type):
+        '''Returns the data captured for 'capture_type' or None if it was not acquired.'''
+
+        return self.data.get(capture_type)
+
+class AcquisitionEngine():
+    '''
+    Free-running acquisition loop. A worker thread repeatedly triggers the Walabot,
+    fetches the selected data types and pushes the resulting frames into bounded queues.
+
+    Each consumer (GUI preview, writers, etc.) subscribes to get its own queue so that
+    a slow consumer never steals frames from another one. When a consumer's queue is
+    full the oldest frame in it is dropped, keeping the latency of the live data low.
+    Consumers that must not lose frames (e.g. headless recording) can subscribe with
+    drop_oldest=False instead, in which case the engine waits for them.
+    '''
+
+    def __init__(self, walabot, data_types, max_frames=0):
+        '''
+        Inputs:
+            walabot: walabot_hardware.Walabot instance that is connected and started
+            data_types: iterable of capture types (SIGNALS, IMAGE_SLICE, IMAGE) to fetch per trigger
+            max_frames: int, stop after this many triggers. 0 runs until stop() is called.
+        '''
+
+        self.walabot = walabot
+        self.data_types = frozenset(data_types)
+        self.max_frames = max_frames
+
+        self.subscribers = []   # (queue, drop_oldest) pairs
+        self.subscribers_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # Statistics
+        self.frame_count = 0
+        self.dropped_frames = 0
+
+    def subscribe(self, maxsize=4, drop_oldest=True):
+        '''
+        Registers a new consumer.
+
+        Inputs:
+            maxsize: int, number of frames to buffer for this consumer
+            drop_oldest: bool, drop the oldest frame when the queue is full. If False, triggering
+                         pauses until the consumer has made room, so no frame is lost.
+
+        Output:
+            frame_queue: Queue from which the consumer reads Frame objects
+        '''
+
+        frame_queue = Queue(maxsize=maxsize)
+        with self.subscribers_lock:
+            self.subscribers.append((frame_queue, drop_oldest))
+
+        return frame_queue
+
+    def unsubscribe(self, frame_queue):
+        '''Removes a consumer's queue. Frames already queued are left as they are.'''
+
+        with self.subscribers_lock:
+            self.subscribers = [subscriber for subscriber in self.subscribers if subscriber[0] is not frame_queue]
+
+    def set_data_types(self, data_types):
+        '''Changes the data types fetched per trigger. Takes effect from the next trigger.'''
+
+        self.data_types = frozenset(data_types)
+
+    def is_running(self):
+        '''Returns True if the acquisition thread is running.'''
+
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        '''Starts the acquisition thread.'''
+
+        if self.is_running():
+            return
+
+        self.stop_event.clear()
+        self.frame_count = 0
+        self.dropped_frames = 0
+        self.thread = threading.Thread(target=self.run, name='walabot-acquisition', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        '''
+        Stops the acquisition thread and waits for the current trigger to finish.
+
+        Input:
+            timeout: float, seconds to wait for the thread to exit (None waits indefinitely)
+        '''
+
+        self.stop_event.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+        self.thread = None
+
+    def publish(self, frame):
+        '''
+        Pushes a frame to every subscriber. Full queues either have their oldest frame dropped or,
+        for subscribers that asked not to lose frames, are waited on until stop() is called.
+        '''
+
+        with self.subscribers_lock:
+            subscribers = list(self.subscribers)
+
+        for frame_queue, drop_oldest in subscribers:
+            if drop_oldest:
+                while True:
+                    try:
+                        frame_queue.put_nowait(frame)
+                        break
+                    except Full:
+                        try:
+                            frame_queue.get_nowait()
+                            self.dropped_frames += 1
+                        except Empty:
+                            pass
+            else:
+                # Wake up now and then so that stop() is not held up by a consumer that has gone away
+                while True:
+                    try:
+                        frame_queue.put(frame, timeout=0.1)
+                        break
+                    except Full:
+                        if self.stop_event.is_set():
+                            self.dropped_frames += 1
+                            break
+
+    def acquire_frame(self, seq):
+        '''
+        Triggers the Walabot once and fetches the selected data types.
+
+        Input:
+            seq: int, sequence number to give the frame
+
+        Output:
+            frame: Frame with the requested data, or with walabot_error set if the API failed.
+        '''
+
+        with metrics.timer('acquisition.frame'):
+            return self.acquire_data(seq)
+
+    def acquire_data(self, seq):
+        '''Triggers and fetches the data of one frame (see acquire_frame()).'''
+
+        walabot_error = self.walabot.trigger()
+        frame = Frame(seq, time.perf_counter())
+        if walabot_error:
+            frame.walabot_error = walabot_error
+            return frame
+
+        data_types = self.data_types
+        getters = [
+            (SIGNALS, self.walabot.get_raw_signals),
+            (IMAGE_SLICE, self.walabot.get_raw_image_slice),
+            (IMAGE, self.walabot.get_raw_image)
+        ]
+        for capture_type, getter in getters:
+            if capture_type not in data_types:
+                continue
+            data, walabot_error = getter()
+            if walabot_error:
+                frame.walabot_error = walabot_error
+                break
+            frame.data[capture_type] = data
+
+        return frame
+
+    def run(self):
+        '''Acquisition loop executed by the worker thread.'''
+
+        seq = 0
+        while not self.stop_event.is_set():
+            frame = self.acquire_frame(seq)
+            self.publish(frame)
+            seq += 1
+            self.frame_count = seq
+
+            # A device error is unlikely to go away by itself, so stop and let the consumers report it.
+            if frame.walabot_error:
+                break
+
+            if self.max_frames and seq >= self.max_frames:
+                break
+
+        self.stop_event.set()
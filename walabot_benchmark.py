@@ -0,0 +1,257 @@
+'''
+Benchmarks the acquisition pipeline against the simulated Walabot: trigger, data fetch,
+preview rendering and saving, across profiles, arena sizes and save formats.
+
+Usage:
+    python walabot_benchmark.py --frames 50 --output benchmark_results.json
+'''
+
+from os.path import join, getsize
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import numpy as np
+from walabot_hardware import Walabot
+from walabot_simulator import SimulatedWalabotAPI
+from walabot_preview import PreviewRenderer
+from walabot_capture import CaptureController, FORMAT_SESSION, FORMAT_COMPRESSED_SESSION, FORMAT_CSV
+from walabot_storage import SIGNALS, IMAGE_SLICE, IMAGE
+
+# Arena (param_1, param_2, param_3) per profile and size. The 'default' arenas are the
+# application's defaults, see MainApp.init_walabot_settings().
+ARENAS = {
+    'SHORT_RANGE_IMAGING': {
+        'small': ((-2, 2, 0.5), (-3, 2, 0.5), (3, 6, 0.5)),
+        'default': ((-4, 4, 0.25), (-6, 4, 0.25), (3, 8, 0.25)),
+        'large': ((-8, 8, 0.25), (-10, 8, 0.25), (3, 12, 0.25))
+    },
+    'SENSOR_NARROW': {
+        'small': ((10, 50, 2), (40, 50, 2), (40, 50, 2)),
+        'default': ((10, 100, 1), (40, 50, 1), (40, 50, 1)),
+        'large': ((10, 200, 1), (-20, 20, 1), (-45, 45, 1))
+    }
+}
+SAVE_FORMATS = ['session', 'compressed', 'csv']
+CONTROLLER_SAVE_FORMATS = {
+    'session': FORMAT_SESSION,
+    'compressed': FORMAT_COMPRESSED_SESSION,
+    'csv': FORMAT_CSV
+}
+DATA_TYPES = [SIGNALS, IMAGE_SLICE, IMAGE]
+
+# Same canvas size and number of colours as the application's preview
+CANVAS_WIDTH = 413
+CANVAS_HEIGHT = 510
+NUM_COLOURS = 256
+
+# Number of frames used to measure peak memory
+MEMORY_FRAMES = 3
+
+def summarise(durations):
+    '''Returns the mean, p50, p99 and max of a list of durations in milliseconds.'''
+
+    durations_ms = np.array(durations) * 1e3
+    return {
+        'count': len(durations),
+        'mean_ms': float(durations_ms.mean()),
+        'p50_ms': float(np.percentile(durations_ms, 50)),
+        'p99_ms': float(np.percentile(durations_ms, 99)),
+        'max_ms': float(durations_ms.max())
+    }
+
+def directory_size(directory):
+    '''Returns the total size in bytes of the files in 'directory'.'''
+
+    return sum(getsize(join(directory, file_name)) for file_name in os.listdir(directory))
+
+def create_controller(profile_name, arena, save_format, trigger_latency, prefix):
+    '''Returns a CaptureController set up on the simulated backend with the given profile, arena and save format.'''
+
+    walabot = Walabot(SimulatedWalabotAPI(latency={'Trigger': trigger_latency}))
+    controller = CaptureController(walabot)
+    controller.set_profile(profile_name)
+    controller.set_walabot_settings(*arena, threshold=35.0, filter_type=0)
+    controller.prefix = prefix
+    controller.save_format = CONTROLLER_SAVE_FORMATS[save_format]
+
+    stage, walabot_error = controller.connect_and_setup()
+    if walabot_error:
+        raise RuntimeError('{}: {}'.format(stage, walabot_error))
+
+    return controller
+
+def run_frames(profile_name, arena, save_format, data_types, num_frames, trigger_latency, output_dir):
+    '''
+    For every frame: trigger, fetch the data types, render the preview and save the frame through the
+    CaptureController and its writer pool. This is the same sequence as a trigger (F1) followed by a
+    save (F2) in the application.
+
+    Outputs:
+        stages: dict of stage name -> list of durations in seconds
+        trigger_to_disk: list of the durations from the trigger to every capture of the frame having been
+                         written to its file. Compressed frames only are once their chunk has been.
+        elapsed: float, total duration in seconds, until every frame has been written
+        image_dimensions: (width, height) of the 2D image slice
+    '''
+
+    controller = create_controller(profile_name, arena, save_format, trigger_latency, join(output_dir, 'bench'))
+    walabot = controller.walabot
+    getters = {
+        SIGNALS: walabot.get_raw_signals,
+        IMAGE_SLICE: walabot.get_raw_image_slice,
+        IMAGE: walabot.get_raw_image
+    }
+    renderer = PreviewRenderer(['000000'] * NUM_COLOURS, CANVAS_WIDTH, CANVAS_HEIGHT)
+    width, height = controller.get_geometry().image_slice_dimensions
+    renderer.set_image_dimensions(width, height)
+
+    # Number of captures each frame is saved as, and the time each frame was triggered
+    captures_per_frame = sum(len(controller.get_signals_capture_types()) if capture_type == SIGNALS else 1
+                             for capture_type in data_types)
+    trigger_starts = {}
+    remaining = {}
+    trigger_to_disk = []
+    written_lock = threading.Lock()
+
+    def capture_written(capture_no, capture_type, device):
+        # Called on the writer threads once a capture is in its file
+        with written_lock:
+            remaining[capture_no] -= 1
+            if remaining[capture_no] == 0:
+                trigger_to_disk.append(time.perf_counter() - trigger_starts.pop(capture_no))
+    controller.on_capture_written = capture_written
+
+    stages = {name: [] for name in ['trigger', 'preview', 'save'] + list(data_types)}
+
+    start = time.perf_counter()
+    for capture_no in range(num_frames):
+        trigger_start = time.perf_counter()
+        walabot_error = walabot.trigger()
+        if walabot_error:
+            raise RuntimeError('Trigger: {}'.format(walabot_error))
+        stages['trigger'].append(time.perf_counter() - trigger_start)
+
+        captures = {}
+        for capture_type in data_types:
+            stage_start = time.perf_counter()
+            captures[capture_type], walabot_error = getters[capture_type]()
+            if walabot_error:
+                raise RuntimeError('Getting {}: {}'.format(capture_type, walabot_error))
+            stages[capture_type].append(time.perf_counter() - stage_start)
+
+        if IMAGE_SLICE in captures:
+            stage_start = time.perf_counter()
+            renderer.render_ppm(captures[IMAGE_SLICE])
+            stages['preview'].append(time.perf_counter() - stage_start)
+
+        with written_lock:
+            trigger_starts[controller.capture_no] = trigger_start
+            remaining[controller.capture_no] = captures_per_frame
+        stage_start = time.perf_counter()
+        controller.save_captures(captures)
+        stages['save'].append(time.perf_counter() - stage_start)
+
+    # Compressed frames still waiting for their chunk are written on closing
+    walabot.disconnect()
+    controller.shutdown()
+    elapsed = time.perf_counter() - start
+
+    errors = [error for _, error in controller.writer_pool.get_results() if error]
+    if errors:
+        raise RuntimeError('Saving failed: {}'.format(errors[0]))
+
+    return stages, trigger_to_disk, elapsed, (width, height)
+
+def run_scenario(profile_name, arena_name, save_format, data_types, num_frames, trigger_latency, output_dir):
+    '''
+    Runs one benchmark scenario. The timings come from a run without memory tracing, since
+    tracemalloc slows down allocation-heavy code considerably. Peak memory is measured
+    in a separate, shorter run.
+
+    Output:
+        result: dict of the scenario settings and measurements
+    '''
+
+    arena = ARENAS[profile_name][arena_name]
+    timing_dir = join(output_dir, 'timing')
+    memory_dir = join(output_dir, 'memory')
+    os.makedirs(timing_dir)
+    os.makedirs(memory_dir)
+
+    stages, trigger_to_disk, elapsed, (width, height) = run_frames(profile_name, arena, save_format, data_types,
+                                                                   num_frames, trigger_latency, timing_dir)
+
+    tracemalloc.start()
+    run_frames(profile_name, arena, save_format, data_types, min(num_frames, MEMORY_FRAMES), 0.0, memory_dir)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latency = summarise(trigger_to_disk)
+    return {
+        'profile': profile_name,
+        'arena': arena_name,
+        'arena_parameters': [list(param) for param in arena],
+        'image_dimensions': [width, height],
+        'save_format': save_format,
+        'data_types': list(data_types),
+        'frames': num_frames,
+        'frames_per_second': num_frames / elapsed,
+        'trigger_to_disk_p50_ms': latency['p50_ms'],
+        'trigger_to_disk_p99_ms': latency['p99_ms'],
+        'bytes_written': directory_size(timing_dir),
+        'peak_memory_bytes': peak_memory,
+        'stages': {name: summarise(durations) for name, durations in stages.items() if durations}
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the Walabot acquisition pipeline with a simulated device.')
+    parser.add_argument('--frames', type=int, default=20, help='frames per scenario')
+    parser.add_argument('--profiles', nargs='+', choices=list(ARENAS), default=list(ARENAS))
+    parser.add_argument('--arenas', nargs='+', choices=['small', 'default', 'large'], default=['small', 'default', 'large'])
+    parser.add_argument('--formats', nargs='+', choices=SAVE_FORMATS, default=SAVE_FORMATS)
+    parser.add_argument('--data-types', nargs='+', choices=DATA_TYPES, default=DATA_TYPES)
+    parser.add_argument('--trigger-latency', type=float, default=0.0, metavar='SECONDS',
+                        help='simulated Trigger() latency')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file to write the results to')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    results = []
+    for profile_name in args.profiles:
+        for arena_name in args.arenas:
+            for save_format in args.formats:
+                output_dir = tempfile.mkdtemp(prefix='walabot_benchmark_')
+                try:
+                    result = run_scenario(profile_name, arena_name, save_format, args.data_types,
+                                          args.frames, args.trigger_latency, output_dir)
+                finally:
+                    shutil.rmtree(output_dir, ignore_errors=True)
+                results.append(result)
+                print('{:<20} {:<8} {:<8} {:>8.1f} fps  p50 {:>8.1f} ms  p99 {:>8.1f} ms  {:>12} bytes  {:>12} peak bytes'.format(
+                    profile_name, arena_name, save_format, result['frames_per_second'],
+                    result['trigger_to_disk_p50_ms'], result['trigger_to_disk_p99_ms'],
+                    result['bytes_written'], result['peak_memory_bytes']))
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'frames_per_scenario': args.frames,
+        'trigger_latency_s': args.trigger_latency,
+        'results': results
+    }
+    with open(args.output, 'w') as outfile:
+        json.dump(report, outfile, indent=2)
+    print('Results written to {}'.format(args.output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1003 @@
+'''
+Device and save logic shared by the GUI (walabot_data_acquisition.MainApp) and the headless
+command-line front end (walabot_headless.py). Nothing in here depends on Tkinter.
+'''
+
+from collections import OrderedDict
+from functools import partial
+from os.path import dirname, exists, isdir
+import sqlite3
+import sys
+import threading
+import time
+import numpy as np
+from walabot_storage import SessionWriter, write_csv_capture, write_csv_axes, session_file_name, SIGNALS, SIGNALS_FILTERED, \
+    RANGE_PROFILES, IMAGE_SLICE, IMAGE
+from walabot_image_store import ImageStoreWriter, find_image_store
+from walabot_catalog import CaptureCatalog, catalog_file_name, catalog_entry
+from walabot_writer_pool import WriterPool
+from walabot_metrics import metrics
+from walabot_signal_filters import create_signal_filter, SIGNAL_FILTER_NONE, DEFAULT_BACKGROUND_ALPHA, DEFAULT_MTI_WINDOW
+from walabot_range_profiles import RangeProfiler, SIGNALS_OUTPUT_SAMPLES, SIGNALS_OUTPUT_RANGE_PROFILES, DEFAULT_DECIMATION
+
+# Integer values of the profiles taken from WalabotAPI.py
+# There is PROF_WIDE, but it is not supported for the Developer edition.
+# Likewise PROF_TRACKER does not support raw signals.
+PROF_SHORT_RANGE_IMAGING = 'SHORT_RANGE_IMAGING'
+PROF_SENSOR_NARROW = 'SENSOR_NARROW'
+PROF_TRACKER = 'TRACKER'
+PROFILES = {
+    PROF_SHORT_RANGE_IMAGING: 0x00010000,
+    PROF_SENSOR_NARROW: 0x00020000 + 1,
+    PROF_TRACKER: 0x00030000
+}
+
+# Filter constants taken from WalabotAPI.py
+FILTER_TYPES = {
+    'None': 0,
+    'Derivative': 1,
+    'MTI': 2
+}
+
+# Save formats. Binary sessions hold every capture with the same prefix in one file.
+# Compressed sessions store chunks of COMPRESSION_CHUNK_SIZE frames, delta-coded and compressed.
+FORMAT_SESSION = 'Binary session'
+FORMAT_COMPRESSED_SESSION = 'Compressed session'
+FORMAT_CSV = 'CSV'
+SAVE_FORMATS = [FORMAT_SESSION, FORMAT_COMPRESSED_SESSION, FORMAT_CSV]
+COMPRESSION_CHUNK_SIZE = 16
+
+# Names of the arena axes in the Walabot API (SetArenaX, ...), in param_1, param_2, param_3 order
+IMAGING_ARENA_AXES = ['X', 'Y', 'Z']
+SENSOR_ARENA_AXES = ['R', 'Theta', 'Phi']
+
+# Number of recently used arena configurations whose ArenaGeometry is kept
+GEOMETRY_CACHE_SIZE = 8
+
+def default_walabot_settings(profile):
+    '''
+    Returns the default arena, threshold, and filter type values for a profile.
+    These values were obtained from the Walabot API tutorial software.
+
+    Outputs:
+        param_1, param_2, param_3: (min, max, resolution) tuples, (X, Y, Z) or (R, theta, phi)
+        threshold: double, between 0.1 and 100
+        filter_type: integer, refer to Walabot API for filter constants
+    '''
+
+    if profile == PROF_SHORT_RANGE_IMAGING: # Short range imaging profile
+        param_1 = (-4, 4, 0.25)
+        param_2 = (-6, 4, 0.25)
+        param_3 = (3, 8, 0.25)
+        threshold = 35.0
+        filter_type = FILTER_TYPES['None']
+    else:
+        # Sensor or sensor narrow profiles
+        param_1 = (10, 100, 1)
+        param_2 = (40, 50, 1)
+        param_3 = (40, 50, 1)
+        threshold = 35.0
+        filter_type = FILTER_TYPES['None']
+
+    return param_1, param_2, param_3, threshold, filter_type
+
+def axis_vector(param):
+    '''
+    Returns the points along one arena axis.
+
+    Input:
+        param: (min, max, resolution) tuple
+
+    Output:
+        axis: 1D Numpy array of float64, from min up to max in steps of resolution
+    '''
+
+    axis_min, axis_max, axis_res = param
+    num_steps = int((axis_max - axis_min) / axis_res)
+    return axis_min + np.arange(num_steps + 1) * float(axis_res)
+
+def parse_antenna_pair(text):
+    '''
+    Parses one antenna pair written as 'TX-RX' (e.g. '1-2').
+
+    Output:
+        antenna_pair: (tx, rx) tuple of ints. Raises ValueError if 'text' is not a pair.
+    '''
+
+    tx, separator, rx = text.strip().partition('-')
+    if not separator:
+        raise ValueError('Invalid antenna pair: {}'.format(text))
+
+    return int(tx), int(rx)
+
+def parse_antenna_pairs(text):
+    '''
+    Parses a list of antenna pairs separated by spaces or commas (e.g. '1-2 1-3').
+
+    Output:
+        antenna_pairs: list of (tx, rx) tuples, or None (every pair) if 'text' is blank.
+                       Raises ValueError if a pair is invalid.
+    '''
+
+    tokens = text.replace(',', ' ').split()
+    if not tokens:
+        return None
+
+    return [parse_antenna_pair(token) for token in tokens]
+
+def format_antenna_pairs(antenna_pairs):
+    '''Writes antenna pairs the way parse_antenna_pairs() reads them (blank for every pair).'''
+
+    if antenna_pairs is None:
+        return ''
+
+    return ' '.join('{}-{}'.format(tx, rx) for tx, rx in antenna_pairs)
+
+class ArenaGeometry():
+    '''
+    Axes and image sizes of one arena configuration (profile plus param_1..3). Everything is
+    computed once when the configuration is set, rather than per capture or from the device.
+    '''
+
+    def __init__(self, profile, param_1, param_2, param_3):
+        '''
+        Inputs:
+            profile: str, profile name (e.g. PROF_SHORT_RANGE_IMAGING)
+            param_1, param_2, param_3: (min, max, resolution) tuples, (X, Y, Z) or (R, theta, phi)
+        '''
+
+        self.key = (profile, tuple(param_1), tuple(param_2), tuple(param_3))
+        self.axes = [axis_vector(param_1), axis_vector(param_2), axis_vector(param_3)]
+        self.axis_sizes = [len(axis) for axis in self.axes]
+
+        # The 2D slice is (X, Y) in Cartesian coordinates and (phi, R) in spherical coordinates,
+        # shown transposed, so its width is the number of X (or phi) points.
+        if profile == PROF_SHORT_RANGE_IMAGING:
+            self.names = ['X', 'Y', 'Z']
+            self.image_slice_dimensions = (self.axis_sizes[0], self.axis_sizes[1])
+        else:
+            self.names = ['R', 'theta', 'phi']
+            self.image_slice_dimensions = (self.axis_sizes[2], self.axis_sizes[0])
+
+class CalibrationWorker():
+    '''
+    Runs Walabot.calibrate() on a background thread so that the caller (e.g. the GUI event loop)
+    stays responsive. The progress and the outcome are read from the worker's attributes.
+    '''
+
+    def __init__(self, walabot, timeout=None):
+        '''
+        Inputs:
+            walabot: connected and started Walabot
+            timeout: float, seconds after which calibration is abandoned. None waits until it is done.
+        '''
+
+        self.walabot = walabot
+        self.timeout = timeout
+        self.progress = 0             # Calibration progress, 0 to 100
+        self.walabot_error = None     # Outcome, set once the worker has finished
+        self.cancel_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='walabot-calibration', daemon=True)
+
+    def start(self):
+        '''Starts calibrating.'''
+
+        self.thread.start()
+
+    def run(self):
+        '''Calibration executed by the worker thread.'''
+
+        self.walabot_error = self.walabot.calibrate(progress_callback=self.set_progress,
+                                                    cancel_event=self.cancel_event, timeout=self.timeout)
+        if not self.walabot_error:
+            self.progress = 100
+
+    def set_progress(self, progress):
+        '''Progress callback passed to Walabot.calibrate().'''
+
+        self.progress = progress
+
+    def is_running(self):
+        '''Returns True while calibrating.'''
+
+        return self.thread.is_alive()
+
+    def cancel(self, timeout=None):
+        '''
+        Stops calibrating after the current trigger and waits for the worker to finish.
+
+        Input:
+            timeout: float, seconds to wait for the worker (None waits indefinitely)
+        '''
+
+        self.cancel_event.set()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+def add_backend_arguments(parser):
+    '''Adds the options choosing the Walabot backend (device, simulator or replay) to an argparse parser.'''
+
+    parser.add_argument('--simulate', action='store_true',
+                        help='use a simulated Walabot instead of the device (no WalabotAPI required)')
+    parser.add_argument('--sim-latency', type=float, default=0.0, metavar='SECONDS',
+                        help='simulated latency added to every Trigger() call')
+    parser.add_argument('--sim-error-rate', type=float, default=0.0, metavar='P',
+                        help='probability that a simulated API call fails')
+    parser.add_argument('--replay', metavar='PATH',
+                        help='replay a recording (binary session .wbs file or CSV file prefix) instead of using the device')
+    parser.add_argument('--replay-speed', type=float, default=1.0, metavar='X',
+                        help='replay speed relative to real time, 0 replays as fast as possible')
+    parser.add_argument('--replay-loop', action='store_true', help='restart the replay after the last capture')
+    parser.add_argument('--replay-device', metavar='NAME',
+                        help='device to replay from a multi-device session (e.g. dev0)')
+
+def create_walabot(args, seed=0):
+    '''
+    Creates the Walabot selected by the options from add_backend_arguments().
+
+    Inputs:
+        args: parsed arguments
+        seed: int, seed of the simulated Walabot's data (give each simulated device its own)
+
+    Output:
+        walabot: ReplayWalabot, a Walabot using the simulated API, or None for the device
+    '''
+
+    if args.replay:
+        from walabot_replay import ReplayWalabot
+        try:
+            return ReplayWalabot(args.replay, speed=args.replay_speed, loop=args.replay_loop, device=args.replay_device)
+        except ValueError as error:
+            print('Cannot replay: {}'.format(error))
+            sys.exit(1)
+
+    if args.simulate:
+        from walabot_hardware import Walabot
+        from walabot_simulator import SimulatedWalabotAPI
+        return Walabot(SimulatedWalabotAPI(latency={'Trigger': args.sim_latency},
+                                           error_rate={'*': args.sim_error_rate}, seed=seed))
+
+    return None
+
+class CaptureController():
+    '''
+    Holds the Walabot configuration (profile, arena, threshold, filter) and the save settings
+    (file prefix, capture number, format), connects and sets up the Walabot, and hands captures
+    over to the writer pool.
+    '''
+
+    def __init__(self, walabot, writer_pool=None):
+        '''
+        Inputs:
+            walabot: connected or disconnected Walabot (or a stand-in with the same interface)
+            writer_pool: WriterPool doing the writing. A new one is created if None.
+        '''
+
+        self.walabot = walabot
+        self.writer_pool = writer_pool if writer_pool is not None else WriterPool()
+        self.device_uid = None         # Walabot to connect to when several are attached, None for any
+
+        self.profile = PROF_SHORT_RANGE_IMAGING
+        self.param_1, self.param_2, self.param_3, self.threshold, self.filter_type = default_walabot_settings(self.profile)
+        self.geometry = None           # ArenaGeometry of the current settings, computed on first use
+        self.geometry_cache = OrderedDict()  # Geometry key -> ArenaGeometry of recently used configurations
+        self.applied_settings = None   # Settings last applied to the connected Walabot, see get_settings_key()
+        self.saved_axes = {}           # Session or axes file prefix -> key of the geometry last saved to it
+
+        self.signal_filter_name = SIGNAL_FILTER_NONE
+        self.signal_filter = None           # SignalFilter applied to the raw signals before saving them
+        self.signal_filter_settings = (SIGNAL_FILTER_NONE, DEFAULT_BACKGROUND_ALPHA, DEFAULT_MTI_WINDOW)
+        self.save_unfiltered_signals = False  # With a signal filter, save the unfiltered signals as well
+        self.signals_output = SIGNALS_OUTPUT_SAMPLES  # Save the signal samples, their range profiles, or both
+        self.range_profiler = RangeProfiler()
+        self.antenna_pairs = None      # (tx, rx) pairs whose raw signals are read, None for all of them
+
+        self.prefix = 'capture'
+        self.capture_no = 0
+        self.save_format = FORMAT_SESSION
+        self.session_writer = None     # Binary session for the current save file prefix
+        self.image_store_writer = None # Memory-mappable 3D image store for the current save file prefix
+        self.image_store_files = {}    # (prefix, geometry key) -> image store holding that arena's images
+        self.save_lock = threading.RLock()  # Held while saving, so that captures can be saved from several threads
+        self.catalogs = {}             # Catalog file name -> CaptureCatalog, for every save directory used so far
+        self.catalog_ready = {}        # Prefix -> threading.Event set once its catalog has been opened and indexed
+        self.catalog_lock = threading.Lock()
+        self.pending_captures = {}     # (prefix, capture_no, capture_type, device) -> catalog entries being written
+        self.pending_lock = threading.Lock()
+        self.on_capture_written = None # Called with (capture_no, capture_type, device) once a capture has been written
+
+    # ----- Walabot configuration ----- #
+    def set_profile(self, profile):
+        '''Selects a profile and resets the arena settings to the profile's defaults.'''
+
+        self.profile = profile
+        self.param_1, self.param_2, self.param_3, self.threshold, self.filter_type = default_walabot_settings(profile)
+        self.geometry = None
+        self.reset_signal_filter()
+
+    def get_walabot_settings(self):
+        '''Returns the current arena (param_1, param_2, param_3), threshold, and filter type values.'''
+
+        return self.param_1, self.param_2, self.param_3, self.threshold, self.filter_type
+
+    def set_walabot_settings(self, param_1, param_2, param_3, threshold, filter_type):
+        '''
+        Sets the arena parameters, threshold, and filter values. They are applied the next time
+        the Walabot is connected, or by reconfigure().
+
+        Input:
+            filter_type: integer, refer to Walabot API for filter constants
+        '''
+
+        self.param_1 = param_1
+        self.param_2 = param_2
+        self.param_3 = param_3
+        self.threshold = threshold
+        self.filter_type = filter_type
+        self.geometry = None
+        self.reset_signal_filter()
+
+    def set_signal_filter(self, name, save_unfiltered=False, alpha=DEFAULT_BACKGROUND_ALPHA, window=DEFAULT_MTI_WINDOW):
+        '''
+        Selects the software filter applied to the raw signals as they are saved (see walabot_signal_filters).
+        A filter whose name and parameters are unchanged keeps its state (background, frame history).
+
+        Inputs:
+            name: str, one of walabot_signal_filters.SIGNAL_FILTERS
+            save_unfiltered: bool, save the unfiltered signals as well as the filtered ones
+            alpha: float, background weight of new frames (background subtraction only)
+            window: int, number of frames averaged (moving average MTI only)
+        '''
+
+        # Captures being saved on other threads use the filter
+        with self.save_lock:
+            self.save_unfiltered_signals = save_unfiltered
+            if (name, alpha, window) == self.signal_filter_settings:
+                return
+
+            self.signal_filter_name = name
+            self.signal_filter = create_signal_filter(name, alpha, window)
+            self.signal_filter_settings = (name, alpha, window)
+
+    def reset_signal_filter(self):
+        '''Restarts the signal filter from the next frame, e.g. because the scene or arena has changed.'''
+
+        if self.signal_filter is not None:
+            self.signal_filter.reset()
+
+    def set_signals_output(self, signals_output, max_range=None, decimation=DEFAULT_DECIMATION):
+        '''
+        Selects whether the raw signals are saved as samples, as range profiles (see walabot_range_profiles)
+        or both. Range profiles are computed from the filtered signals if a signal filter is selected.
+
+        Inputs:
+            signals_output: str, one of walabot_range_profiles.SIGNALS_OUTPUTS
+            max_range: float, largest range kept in the range profiles [m]. None keeps the whole signal.
+            decimation: int, number of samples per range bin
+        '''
+
+        self.signals_output = signals_output
+        if max_range != self.range_profiler.max_range or decimation != self.range_profiler.decimation:
+            self.range_profiler = RangeProfiler(max_range, decimation)
+
+    def set_antenna_pairs(self, antenna_pairs):
+        '''
+        Selects the antenna pairs whose raw signals are read and saved. Only the selected pairs are
+        requested from the Walabot on each trigger.
+
+        Input:
+            antenna_pairs: list of (tx, rx) antenna numbers, or None for every pair of the profile
+        '''
+
+        self.antenna_pairs = list(antenna_pairs) if antenna_pairs is not None else None
+        if self.walabot is not None:
+            self.walabot.set_antenna_pair_selection(self.antenna_pairs)
+        self.reset_signal_filter()
+
+    def get_signals_capture_types(self):
+        '''Returns the capture types the raw signals of a trigger are saved as.'''
+
+        capture_types = []
+        if self.signals_output != SIGNALS_OUTPUT_RANGE_PROFILES:
+            if self.signal_filter is None or self.save_unfiltered_signals:
+                capture_types.append(SIGNALS)
+            if self.signal_filter is not None:
+                capture_types.append(SIGNALS_FILTERED)
+        if self.signals_output != SIGNALS_OUTPUT_SAMPLES:
+            capture_types.append(RANGE_PROFILES)
+
+        return capture_types
+
+    def process_signals(self, signals, signal_filter):
+        '''
+        Turns one trigger's raw signals into the captures they are saved as. The filter is run on
+        every trigger, even if the filtered samples are not saved, so that its state stays current.
+
+        Inputs:
+            signals: raw signals DataFrame
+            signal_filter: SignalFilter to apply (the controller's own, or one per device), or None
+
+        Output:
+            captures: dict of capture type -> DataFrame, for the types from get_signals_capture_types()
+        '''
+
+        capture_types = self.get_signals_capture_types()
+        filtered = None
+        if signal_filter is not None:
+            with metrics.timer('signals.filter'):
+                filtered = signal_filter.filter_signals(signals)
+
+        captures = {}
+        if SIGNALS in capture_types:
+            captures[SIGNALS] = signals
+        if SIGNALS_FILTERED in capture_types:
+            captures[SIGNALS_FILTERED] = filtered
+        if RANGE_PROFILES in capture_types:
+            with metrics.timer('signals.range_profiles'):
+                captures[RANGE_PROFILES] = self.range_profiler.compute_signals(filtered if filtered is not None else signals)
+
+        return captures
+
+    def connect_and_setup(self):
+        '''
+        Connects to the Walabot, sets the profile and arena, and starts it. If the profile or
+        arena cannot be set, the Walabot is disconnected again.
+
+        Outputs:
+            stage: str, what failed ('Connect error', 'Error setting profile' or 'Error setting arena')
+            walabot_error: None if no error occurred. Otherwise returns the error message.
+        '''
+
+        connect_error = self.walabot.connect(self.device_uid)
+        if connect_error:
+            return 'Connect error', connect_error
+        self.reset_signal_filter()
+
+        profile_error = self.walabot.set_profile(PROFILES[self.profile])
+        if profile_error:
+            self.walabot.disconnect()
+            return 'Error setting profile', profile_error
+
+        if self.profile == PROF_SHORT_RANGE_IMAGING:
+            arena_error = self.walabot.set_arena_imaging(self.param_1, self.param_2, self.param_3,
+                                                         self.threshold, self.filter_type)
+        else:
+            arena_error = self.walabot.set_arena_sensor(self.param_1, self.param_2, self.param_3,
+                                                        self.threshold, self.filter_type)
+        if arena_error:
+            self.walabot.disconnect()
+            return 'Error setting arena', arena_error
+
+        self.walabot.start()
+        self.applied_settings = self.get_settings_key()
+        return None, None
+
+    def get_settings_key(self):
+        '''Returns the profile, arena, threshold and filter type as one comparable tuple.'''
+
+        return (self.profile, tuple(self.param_1), tuple(self.param_2), tuple(self.param_3),
+                self.threshold, self.filter_type)
+
+    def reconfigure(self):
+        '''
+        Applies the current settings to the connected Walabot without disconnecting it. Only what
+        differs from the settings last applied is sent: a new profile or arena axis needs the
+        Walabot to be stopped and started again, while the threshold and filter are changed as it runs.
+        If the Walabot is not connected, or the new settings cannot be applied, this falls back
+        to connect_and_setup().
+
+        Outputs:
+            stage: str, what failed (see connect_and_setup())
+            walabot_error: None if no error occurred. Otherwise returns the error message.
+        '''
+
+        if not self.walabot.is_connected or self.applied_settings is None:
+            return self.connect_and_setup()
+
+        settings = self.get_settings_key()
+        applied = self.applied_settings
+        if settings == applied:
+            return None, None
+
+        profile, param_1, param_2, param_3, threshold, filter_type = settings
+        profile_changed = profile != applied[0]
+        axis_names = IMAGING_ARENA_AXES if profile == PROF_SHORT_RANGE_IMAGING else SENSOR_ARENA_AXES
+        # A new profile resets the arena, so every axis is set again
+        changed_axes = [(axis, param) for axis, param, applied_param in zip(axis_names, settings[1:4], applied[1:4])
+                        if profile_changed or param != applied_param]
+
+        walabot_error = None
+        if changed_axes:
+            stage, walabot_error = 'Error stopping the Walabot', self.walabot.stop()
+            if not walabot_error and profile_changed:
+                stage, walabot_error = 'Error setting profile', self.walabot.set_profile(PROFILES[profile])
+            if not walabot_error:
+                stage, walabot_error = 'Error setting arena', self.walabot.set_arena_axes(changed_axes)
+        if not walabot_error and (profile_changed or threshold != applied[4]):
+            stage, walabot_error = 'Error setting arena', self.walabot.set_threshold(threshold)
+        if not walabot_error and (profile_changed or filter_type != applied[5]):
+            stage, walabot_error = 'Error setting arena', self.walabot.set_filter_type(filter_type)
+        if not walabot_error and changed_axes:
+            stage, walabot_error = 'Error starting the Walabot', self.walabot.start()
+
+        if walabot_error:
+            print('{}: {}. Reconnecting to the Walabot'.format(stage, walabot_error))
+            self.walabot.disconnect()
+            self.applied_settings = None
+            return self.connect_and_setup()
+
+        self.applied_settings = settings
+        return None, None
+
+    def get_geometry(self):
+        '''
+        Returns the ArenaGeometry of the current profile and arena. Geometries of the last
+        GEOMETRY_CACHE_SIZE configurations are kept, so switching back and forth between a few
+        arenas does not compute them again.
+        '''
+
+        if self.geometry is None:
+            key = (self.profile, tuple(self.param_1), tuple(self.param_2), tuple(self.param_3))
+            geometry = self.geometry_cache.pop(key, None)
+            if geometry is None:
+                geometry = ArenaGeometry(self.profile, self.param_1, self.param_2, self.param_3)
+            self.geometry_cache[key] = geometry
+            if len(self.geometry_cache) > GEOMETRY_CACHE_SIZE:
+                self.geometry_cache.popitem(last=False)
+            self.geometry = geometry
+
+        return self.geometry
+
+    def generate_axes(self):
+        '''
+        Returns the axis vectors of the current arena.
+
+        Outputs:
+            names: list of axis names, (X, Y, Z) or (R, theta, phi) depending on the profile
+            axes: list of the three axis vectors
+        '''
+
+        geometry = self.get_geometry()
+        return geometry.names, geometry.axes
+
+    def get_frame_metadata(self):
+        '''Returns the per-frame metadata stored alongside each capture in a binary session.'''
+
+        metadata = {
+            'timestamp': time.time(),
+            'profile': self.profile,
+            'arena': [list(self.param_1), list(self.param_2), list(self.param_3)],
+            'threshold': self.threshold,
+            'filter_type': self.filter_type
+        }
+        if self.signal_filter is not None:
+            metadata['signal_filter'] = self.signal_filter_name
+        if self.signals_output != SIGNALS_OUTPUT_SAMPLES:
+            metadata['range_decimation'] = self.range_profiler.decimation
+
+        return metadata
+
+    # ----- Saving ----- #
+    def generate_file_name(self, capture_type):
+        '''
+        Generates the file name for the capture and appends a counter and file type in the filename.
+
+        Input:
+            capture_type: str, capture type for reference purposes (e.g. capture_0_signals.csv, capture_0_im_2d.csv)
+
+        Outputs:
+            file_name: string, generated file name.
+        '''
+
+        return '{}_{}_{}.csv'.format(self.prefix, str(self.capture_no), str(capture_type))
+
+    def is_saving_session(self):
+        '''Returns True if captures are saved to a binary session, False if they are saved as CSV files.'''
+
+        return self.save_format in (FORMAT_SESSION, FORMAT_COMPRESSED_SESSION)
+
+    def is_compressing(self):
+        '''Returns True if captures are saved to a compressed binary session.'''
+
+        return self.save_format == FORMAT_COMPRESSED_SESSION
+
+    def is_using_image_store(self, capture_type):
+        '''
+        Returns True if 'capture_type' is saved to the 3D image store. Compressed sessions keep
+        3D images in the session itself, since the image store is an uncompressed memory-mapped file.
+        '''
+
+        return capture_type == IMAGE and self.save_format == FORMAT_SESSION
+
+    def get_session_writer(self):
+        '''
+        Returns the binary session writer for the current file prefix. If the prefix or the
+        compression setting has changed since the last save, the previous session is closed and
+        the new one is opened (or continued).
+        '''
+
+        file_name = session_file_name(self.prefix)
+        chunk_size = COMPRESSION_CHUNK_SIZE if self.is_compressing() else 0
+        if self.session_writer is None or self.session_writer.file_name != file_name or \
+           self.session_writer.chunk_size != chunk_size:
+            self.close_session()
+            # The session may have been written to by queued jobs, so let them finish before opening it
+            self.writer_pool.flush()
+            self.session_writer = SessionWriter(file_name, chunk_size=chunk_size)
+            self.session_writer.on_frame_written = partial(self.capture_written, self.prefix)
+
+        return self.session_writer
+
+    def get_image_store_writer(self):
+        '''
+        Returns the 3D image store writer for the current file prefix and arena. In session mode, 3D
+        images are kept in their own fixed-record file so that they can be memory-mapped frame by frame.
+        Every arena configuration gets its own store, since the image shape and axes are fixed per file.
+        '''
+
+        geometry = self.get_geometry()
+        store_key = (self.prefix, geometry.key)
+        file_name = self.image_store_files.get(store_key)
+        if file_name is None:
+            # Queued images may still be creating a store, so let them finish before looking at the files
+            self.writer_pool.flush()
+            file_name = find_image_store(self.prefix, geometry.names, geometry.axes)
+            self.image_store_files[store_key] = file_name
+
+        if self.image_store_writer is None or self.image_store_writer.file_name != file_name:
+            if self.image_store_writer is not None:
+                self.submit_write(self.image_store_writer.file_name, 'image store close', self.image_store_writer.close)
+                self.writer_pool.flush()
+            self.image_store_writer = ImageStoreWriter(file_name)
+            prefix = self.prefix
+            self.image_store_writer.on_frame_written = \
+                lambda capture_no, offset: self.capture_written(prefix, capture_no, IMAGE, None, offset)
+
+        return self.image_store_writer
+
+    def flush_session(self):
+        '''Queues a flush of the binary session and image store after the writes already queued.'''
+
+        if self.session_writer is not None:
+            self.submit_write(self.session_writer.file_name, 'session flush', self.session_writer.flush)
+        if self.image_store_writer is not None:
+            self.submit_write(self.image_store_writer.file_name, 'image store flush', self.image_store_writer.flush)
+
+    def close_session(self):
+        '''Queues closing the binary session and image store files, if they are open.'''
+
+        if self.session_writer is not None:
+            self.submit_write(self.session_writer.file_name, 'session close', self.session_writer.close)
+            self.session_writer = None
+        if self.image_store_writer is not None:
+            self.submit_write(self.image_store_writer.file_name, 'image store close', self.image_store_writer.close)
+            self.image_store_writer = None
+
+    def submit_write(self, key, description, function, *args):
+        '''
+        Hands a save job over to the writer pool.
+
+        Inputs:
+            key: str, jobs with the same key (file) are written in order
+            description: str, reported with the job's result
+            function: callable doing the writing
+            *args: arguments passed to 'function'
+        '''
+
+        self.writer_pool.submit(key, description, function, *args)
+
+    def prepare_catalog(self, prefix=None, create=True):
+        '''
+        Opens the capture catalog of the directory a file prefix saves to, and adds the captures
+        saved under the prefix before the catalog was kept, on a background thread. This reads
+        every file of the prefix once, so it is done once per prefix. Returns straight away.
+
+        Inputs:
+            prefix: str, save file prefix. Defaults to the current one.
+            create: bool, create the catalog if the directory does not have one yet
+
+        Output:
+            ready: threading.Event set once the catalog can be used, or None if there is no catalog
+                   (the directory does not exist, or has no catalog and 'create' is False)
+        '''
+
+        prefix = prefix if prefix is not None else self.prefix
+        file_name = catalog_file_name(prefix)
+        with self.catalog_lock:
+            ready = self.catalog_ready.get(prefix)
+            if ready is None:
+                if not isdir(dirname(file_name) or '.') or not (create or exists(file_name)):
+                    return None
+                ready = self.catalog_ready[prefix] = threading.Event()
+                threading.Thread(target=self.open_catalog, args=(prefix, ready), name='walabot-catalog',
+                                 daemon=True).start()
+
+        return ready
+
+    def open_catalog(self, prefix, ready):
+        '''Worker thread of prepare_catalog(): opens the catalog of 'prefix' and indexes its earlier captures.'''
+
+        file_name = catalog_file_name(prefix)
+        try:
+            with self.catalog_lock:
+                catalog = self.catalogs.get(file_name)
+                if catalog is None:
+                    catalog = self.catalogs[file_name] = CaptureCatalog(file_name)
+            num_captures = catalog.index_prefix(prefix)
+            if num_captures:
+                print('Added {} earlier capture(s) of {} to {}'.format(num_captures, prefix, file_name))
+        except (sqlite3.Error, OSError, ValueError) as error:
+            print('Cannot use the capture catalog {}: {}'.format(file_name, error))
+            with self.catalog_lock:
+                # Try again the next time the prefix is used
+                self.catalog_ready.pop(prefix, None)
+                self.catalogs.pop(file_name, None)
+        finally:
+            ready.set()
+
+    def get_catalog(self, prefix=None, create=True, wait=False):
+        '''
+        Returns the capture catalog of the directory 'prefix' saves to, starting to open it if needed
+        (see prepare_catalog()).
+
+        Inputs:
+            prefix: str, save file prefix. Defaults to the current one.
+            create: bool, create the catalog if the directory does not have one yet
+            wait: bool, wait for the catalog to be opened and indexed. Otherwise None is returned
+                  until it has been.
+
+        Output:
+            catalog: CaptureCatalog, or None if there is none (or it cannot be used yet)
+        '''
+
+        prefix = prefix if prefix is not None else self.prefix
+        ready = self.prepare_catalog(prefix, create)
+        if ready is None:
+            return None
+        if wait:
+            ready.wait()
+        elif not ready.is_set():
+            return None
+
+        with self.catalog_lock:
+            return self.catalogs.get(catalog_file_name(prefix))
+
+    def resume_capture_no(self, create=True, wait=True):
+        '''
+        Moves on to the capture number after the last one saved (or being saved) under the current
+        prefix, if any have been.
+
+        Inputs:
+            create: bool, create the catalog if the directory does not have one yet
+            wait: bool, wait for the catalog to be opened. Otherwise the capture number is left as it
+                  is until it has been.
+
+        Output:
+            capture_no: int, the capture number to save under next
+        '''
+
+        with self.save_lock:
+            catalog = self.get_catalog(create=create, wait=wait)
+            if catalog is None:
+                return self.capture_no
+
+            last_capture_no = catalog.get_last_capture_no(self.prefix)
+            with self.pending_lock:
+                pending_capture_nos = [key[1] for key in self.pending_captures if key[0] == self.prefix]
+            if pending_capture_nos:
+                last_capture_no = max(pending_capture_nos + ([last_capture_no] if last_capture_no is not None else []))
+            if last_capture_no is not None:
+                self.capture_no = last_capture_no + 1
+
+            return self.capture_no
+
+    def add_pending_capture(self, prefix, capture_no, capture_type, file_name, metadata):
+        '''
+        Notes a capture handed over to be written, so that it is added to the catalog once it has been
+        (see capture_written()) and counts as saved in the meantime.
+
+        Output:
+            entry: dict, the capture's catalog entry
+        '''
+
+        entry = catalog_entry(prefix, capture_no, capture_type, file_name, metadata)
+        key = (prefix, capture_no, capture_type, entry['device'])
+        with self.pending_lock:
+            self.pending_captures.setdefault(key, []).append(entry)
+        # Have the catalog ready by the time the capture has been written
+        self.prepare_catalog(prefix)
+
+        return entry
+
+    def discard_pending_capture(self, prefix, entry):
+        '''Forgets a pending capture whose write has failed.'''
+
+        key = (prefix, entry['capture_no'], entry['capture_type'], entry['device'])
+        with self.pending_lock:
+            entries = self.pending_captures.get(key, [])
+            if entry in entries:
+                entries.remove(entry)
+            if not entries:
+                self.pending_captures.pop(key, None)
+
+    def capture_written(self, prefix, capture_no, capture_type, device, offset):
+        '''
+        Called from the writers once a capture is in its file: adds it to the catalog, with its offset
+        within the file (None for CSV files). Runs on the writer threads.
+        '''
+
+        key = (prefix, capture_no, capture_type, device or '')
+        with self.pending_lock:
+            entries = self.pending_captures.get(key)
+            entry = entries.pop(0) if entries else None
+            if not entries:
+                self.pending_captures.pop(key, None)
+
+        if entry is not None:
+            entry['file_offset'] = offset
+            catalog = self.get_catalog(prefix, wait=True)
+            if catalog is not None:
+                try:
+                    catalog.add_captures([entry])
+                except sqlite3.Error as error:
+                    print('Cannot add capture {} ({}) to the capture catalog: {}'.format(capture_no, capture_type, error))
+
+        if self.on_capture_written is not None:
+            self.on_capture_written(capture_no, capture_type, device)
+
+    def write_capture(self, prefix, entry, function, *args):
+        '''
+        Writer job saving one capture with 'function'. If the write fails, the capture is forgotten
+        rather than left counting as saved.
+        '''
+
+        try:
+            return function(*args)
+        except Exception:
+            self.discard_pending_capture(prefix, entry)
+            raise
+
+    def write_csv(self, prefix, capture_no, file_name, capture, capture_type):
+        '''Writer job saving one capture to a CSV file and reporting it as written.'''
+
+        write_csv_capture(file_name, capture, capture_type)
+        self.capture_written(prefix, capture_no, capture_type, None, None)
+
+    def captures_exist(self, capture_types):
+        '''
+        Checks if a capture of one of 'capture_types' has already been saved (or is being saved) with the
+        current file prefix and capture no. The catalog is looked up once it is ready, otherwise the
+        files are checked.
+        '''
+
+        with self.save_lock:
+            with self.pending_lock:
+                if any((self.prefix, self.capture_no, capture_type, '') in self.pending_captures
+                       for capture_type in capture_types):
+                    return True
+
+            catalog = self.get_catalog()
+            if catalog is not None:
+                return catalog.has_capture(self.prefix, self.capture_no, list(capture_types))
+
+            for capture_type in capture_types:
+                if self.is_saving_session():
+                    if self.is_using_image_store(capture_type):
+                        if self.get_image_store_writer().has_capture(self.capture_no):
+                            return True
+                    elif self.get_session_writer().has_capture(self.capture_no, capture_type):
+                        return True
+                elif exists(self.generate_file_name(capture_type)):
+                    return True
+
+            return False
+
+    def capture_exists(self, capture_type):
+        '''Checks if a file (or session capture) with the current file prefix, capture no., and capture type exists.'''
+
+        return self.captures_exist([capture_type])
+
+    def save_capture(self, capture, capture_type, metadata=None):
+        '''
+        Saves the provided capture matrix to the binary session or to a .csv file using the current prefix
+        and capture number.
+
+        Input:
+            capture: Pandas DataFrame or Numpy array containing the raw signals or image
+            capture_type: signals, filtered signals, raw image slice, or raw image
+            metadata: dict of extra per-frame metadata stored in sessions. A 'timestamp' replaces the current time.
+        '''
+
+        description = 'capture {} ({})'.format(self.capture_no, capture_type)
+        frame_metadata = self.get_frame_metadata()
+        if metadata:
+            frame_metadata.update(metadata)
+        # The capture is added to the catalog by the writers once it has been written (see capture_written())
+        if self.is_saving_session() and self.is_using_image_store(capture_type):
+            writer = self.get_image_store_writer()
+            entry = self.add_pending_capture(self.prefix, self.capture_no, capture_type, writer.file_name, frame_metadata)
+            self.submit_write(writer.file_name, description, self.write_capture, self.prefix, entry, writer.append,
+                              self.capture_no, capture, frame_metadata['timestamp'], self.generate_axes())
+        elif self.is_saving_session():
+            writer = self.get_session_writer()
+            entry = self.add_pending_capture(self.prefix, self.capture_no, capture_type, writer.file_name, frame_metadata)
+            self.submit_write(writer.file_name, description, self.write_capture, self.prefix, entry, writer.write_frame,
+                              self.capture_no, capture_type, capture, frame_metadata)
+        else:
+            # Generate file name with appropriate suffix based on capture type (e.g. capture_0_signals.csv, capture_0_2d_image.csv)
+            file_name = self.generate_file_name(capture_type)
+            entry = self.add_pending_capture(self.prefix, self.capture_no, capture_type, file_name, frame_metadata)
+            self.submit_write(file_name, description, self.write_capture, self.prefix, entry, self.write_csv,
+                              self.prefix, self.capture_no, file_name, capture, capture_type)
+
+    def save_axes(self, image_dim):
+        '''
+        Saves the axes for plotting, once per arena configuration. In session mode they are
+        stored in the session. In CSV mode they go to a separate CSV file named after the first
+        capture saved with the configuration ([prefix]_[capture_number]_[image_dim].csv), which
+        applies to the following captures until the next axes file.
+        Note that although the 2D images only have two axes (X, Y) or (Phi, R),
+        all three axes are saved for reference purposes.
+
+        Input:
+            image_dim: str, 2D or 3D for file name generation
+        '''
+
+        geometry = self.get_geometry()
+        if self.is_saving_session():
+            writer = self.get_session_writer()
+            destination = writer.file_name
+        else:
+            destination = (self.prefix, image_dim)
+        if self.saved_axes.get(destination) == geometry.key:
+            return
+
+        if self.is_saving_session():
+            self.submit_write(writer.file_name, 'session axes', writer.write_axes, geometry.names, geometry.axes)
+        else:
+            # Save the axis vectors to a CSV file with each axis corresponding to a column
+            file_name = self.generate_file_name(image_dim)
+            self.submit_write(file_name, file_name, write_csv_axes, file_name, geometry.names, geometry.axes)
+        self.saved_axes[destination] = geometry.key
+
+    def save_captures(self, captures, metadata=None):
+        '''
+        Saves one trigger's captures (and the image axes) under the current capture number, queues
+        a flush and moves on to the next capture number. The raw signals are filtered and turned
+        into range profiles here (see process_signals()), so the filter sees the frames in the
+        order they are saved. Can be called from any thread.
+
+        Input:
+            captures: dict of capture type -> signals DataFrame or image Numpy array
+            metadata: dict of extra per-frame metadata stored in sessions (see save_capture())
+        '''
+
+        with self.save_lock, metrics.timer('save.submit'):
+            if SIGNALS in captures:
+                for capture_type, capture in self.process_signals(captures[SIGNALS], self.signal_filter).items():
+                    self.save_capture(capture, capture_type, metadata)
+            # The axes go first, since the session applies them to the frames that follow
+            if IMAGE_SLICE in captures:
+                self.save_axes('im_2d_axes')
+                self.save_capture(captures[IMAGE_SLICE], IMAGE_SLICE, metadata)
+            if IMAGE in captures:
+                self.save_axes('im_3d_axes')
+                self.save_capture(captures[IMAGE], IMAGE, metadata)
+
+            self.flush_session()
+            self.capture_no += 1
+
+    def shutdown(self):
+        '''Closes the session files and waits for every queued write to finish.'''
+
+        self.close_session()
+        self.writer_pool.shutdown()
+        with self.catalog_lock:
+            catalog_ready = list(self.catalog_ready.values())
+        for ready in catalog_ready:
+            ready.wait()
+        with self.catalog_lock:
+            for catalog in self.catalogs.values():
+                catalog.close()
+            self.catalogs = {}
+            self.catalog_ready = {}
@@ -0,0 +1,331 @@
+'''
+Catalog of the saved captures: an SQLite database next to the capture files that records every
+capture saved with its prefix, number, type, timestamp, arena settings, profile, and the file (and
+offset within it) it was written to.
+
+Checking whether a capture number is taken, finding the last capture number of a prefix to carry on
+from, and looking captures up afterwards are then index lookups, however many captures the directory
+holds, instead of building file names and checking the disk (or globbing) for every one.
+
+There is one catalog per directory (see catalog_file_name()), holding every prefix saved in it.
+Captures saved before the catalog existed are added the first time a prefix is used with it.
+
+Usage:
+    python walabot_catalog.py data/ --prefix run1 --type im_2d
+'''
+
+import json
+from os import scandir
+from os.path import basename, dirname, exists, isdir, join
+import re
+import sqlite3
+import threading
+import time
+from walabot_storage import SessionReader, session_file_name, SESSION_EXTENSION, SIGNALS, SIGNALS_FILTERED, RANGE_PROFILES, \
+    IMAGE_SLICE, IMAGE
+from walabot_image_store import ImageStoreReader, image_store_file_names, IMAGE_STORE_EXTENSION, RECORD_PREFIX
+
+CATALOG_FILE_NAME = 'walabot_catalog.sqlite'
+CAPTURE_TYPES = (SIGNALS, SIGNALS_FILTERED, RANGE_PROFILES, IMAGE_SLICE, IMAGE)
+
+CATALOG_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS captures (
+    prefix TEXT NOT NULL,
+    capture_no INTEGER NOT NULL,
+    capture_type TEXT NOT NULL,
+    device TEXT NOT NULL DEFAULT '',
+    timestamp REAL,
+    profile TEXT,
+    arena TEXT,
+    threshold REAL,
+    filter_type INTEGER,
+    file_name TEXT,
+    file_offset INTEGER,
+    PRIMARY KEY (prefix, capture_no, capture_type, device)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS captures_by_time ON captures (prefix, timestamp);
+CREATE TABLE IF NOT EXISTS prefixes (
+    prefix TEXT PRIMARY KEY,
+    indexed_at REAL
+);
+'''
+
+COLUMNS = ('prefix', 'capture_no', 'capture_type', 'device', 'timestamp', 'profile', 'arena', 'threshold',
+           'filter_type', 'file_name', 'file_offset')
+
+def catalog_file_name(prefix):
+    '''Returns the name of the catalog holding the captures saved with 'prefix' (the one in its directory).'''
+
+    return join(dirname(prefix), CATALOG_FILE_NAME)
+
+def catalog_entry(prefix, capture_no, capture_type, file_name, metadata=None, offset=None):
+    '''
+    Builds a catalog entry for a capture.
+
+    Inputs:
+        prefix: str, save file prefix (with or without its directory)
+        capture_no: int, capture number
+        capture_type: str, capture type
+        file_name: str, file the capture is saved to
+        metadata: dict of per-frame metadata (timestamp, profile, arena, threshold, filter_type, device), as
+                  stored in sessions
+        offset: int, offset of the capture's data within the file (None for CSV files, or if not known yet)
+
+    Output:
+        entry: dict of column -> value
+    '''
+
+    metadata = metadata or {}
+    arena = metadata.get('arena')
+    return {
+        'prefix': basename(prefix),
+        'capture_no': int(capture_no),
+        'capture_type': capture_type,
+        'device': metadata.get('device') or '',
+        'timestamp': metadata.get('timestamp'),
+        'profile': metadata.get('profile'),
+        'arena': json.dumps(arena) if arena is not None else None,
+        'threshold': metadata.get('threshold'),
+        'filter_type': metadata.get('filter_type'),
+        'file_name': basename(file_name),
+        'file_offset': offset
+    }
+
+class CaptureCatalog():
+    '''
+    SQLite catalog of the captures saved in one directory. Captures are keyed by (prefix, capture
+    number, capture type, device), so every lookup by prefix and number goes through the primary key
+    index. Safe to use from any thread.
+    '''
+
+    def __init__(self, file_name):
+        '''
+        Input:
+            file_name: str, catalog to open or create
+        '''
+
+        self.file_name = file_name
+        self.directory = dirname(file_name)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(file_name, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            # The catalog can be rebuilt from the capture files, so commits need not wait for the disk
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.executescript(CATALOG_SCHEMA)
+
+    def add_captures(self, entries):
+        '''Adds (or replaces) the captures described by a list of catalog_entry() dicts.'''
+
+        if not entries:
+            return
+
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO captures VALUES ({})'.format(
+                ', '.join(':' + column for column in COLUMNS)), entries)
+
+    def has_capture(self, prefix, capture_no, capture_types=CAPTURE_TYPES, device=None):
+        '''
+        Returns True if a capture of one of 'capture_types' has been saved under 'prefix' and 'capture_no'
+        (from 'device', if given).
+        '''
+
+        query = 'SELECT 1 FROM captures WHERE prefix = ? AND capture_no = ? AND capture_type IN ({})'.format(
+            ', '.join('?' * len(capture_types)))
+        parameters = [basename(prefix), int(capture_no)] + list(capture_types)
+        if device is not None:
+            query += ' AND device = ?'
+            parameters.append(device)
+
+        with self.lock:
+            return self.connection.execute(query + ' LIMIT 1', parameters).fetchone() is not None
+
+    def get_last_capture_no(self, prefix):
+        '''Returns the highest capture number saved under 'prefix', or None if there are none.'''
+
+        with self.lock:
+            return self.connection.execute('SELECT MAX(capture_no) FROM captures WHERE prefix = ?',
+                                           (basename(prefix),)).fetchone()[0]
+
+    def get_prefixes(self):
+        '''Returns the prefixes with captures in the catalog.'''
+
+        with self.lock:
+            return [row[0] for row in self.connection.execute('SELECT DISTINCT prefix FROM captures ORDER BY prefix')]
+
+    def find_captures(self, prefix=None, capture_type=None, first_capture_no=None, last_capture_no=None,
+                      start_time=None, end_time=None, profile=None, device=None):
+        '''
+        Looks up captures. Every argument left as None matches anything.
+
+        Inputs:
+            prefix: str, save file prefix
+            capture_type: str, capture type
+            first_capture_no, last_capture_no: int, range of capture numbers (inclusive)
+            start_time, end_time: float, range of timestamps (inclusive)
+            profile: str, Walabot profile
+            device: str, device name in multi-device sessions ('' for single Walabot captures)
+
+        Output:
+            captures: list of dicts of column -> value, ordered by prefix, capture number and type. The arena
+                      is decoded back into a list of the three arena parameters.
+        '''
+
+        conditions = []
+        parameters = []
+        for condition, value in (('prefix = ?', basename(prefix) if prefix is not None else None),
+                                 ('capture_type = ?', capture_type),
+                                 ('capture_no >= ?', first_capture_no),
+                                 ('capture_no <= ?', last_capture_no),
+                                 ('timestamp >= ?', start_time),
+                                 ('timestamp <= ?', end_time),
+                                 ('profile = ?', profile),
+                                 ('device = ?', device)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+
+        query = 'SELECT * FROM captures'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY prefix, capture_no, capture_type, device'
+
+        with self.lock:
+            rows = self.connection.execute(query, parameters).fetchall()
+
+        captures = []
+        for row in rows:
+            capture = dict(row)
+            if capture['arena'] is not None:
+                capture['arena'] = json.loads(capture['arena'])
+            captures.append(capture)
+
+        return captures
+
+    def is_indexed(self, prefix):
+        '''Returns True if the captures saved under 'prefix' before the catalog existed have been added.'''
+
+        with self.lock:
+            return self.connection.execute('SELECT 1 FROM prefixes WHERE prefix = ?',
+                                           (basename(prefix),)).fetchone() is not None
+
+    def index_prefix(self, prefix, reindex=False):
+        '''
+        Adds the captures already saved under 'prefix' in the catalog's directory: the CSV files, the
+        binary session and the 3D image store. This reads every file once, so it is only done the first
+        time a prefix is used (unless 'reindex' is set, which also forgets captures whose files are gone).
+
+        Output:
+            num_captures: int, number of captures found
+        '''
+
+        name = basename(prefix)
+        if not reindex and self.is_indexed(name):
+            return 0
+
+        entries = index_captures(join(self.directory, name))
+        with self.lock, self.connection:
+            if reindex:
+                self.connection.execute('DELETE FROM captures WHERE prefix = ?', (name,))
+            self.connection.executemany('INSERT OR IGNORE INTO captures VALUES ({})'.format(
+                ', '.join(':' + column for column in COLUMNS)), entries)
+            self.connection.execute('INSERT OR REPLACE INTO prefixes VALUES (?, ?)', (name, time.time()))
+
+        return len(entries)
+
+    def close(self):
+        '''Closes the catalog.'''
+
+        with self.lock:
+            self.connection.close()
+
+def index_captures(prefix):
+    '''
+    Lists the captures saved under 'prefix' by reading the files on disk.
+
+    Input:
+        prefix: str, save file prefix, including its directory
+
+    Output:
+        entries: list of catalog_entry() dicts
+    '''
+
+    entries = []
+    directory = dirname(prefix) or '.'
+
+    # CSV files: [prefix]_[capture_number]_[capture_type].csv
+    csv_pattern = re.compile(r'^{}_(\d+)_({})\.csv$'.format(re.escape(basename(prefix)),
+                                                            '|'.join(CAPTURE_TYPES)))
+    with scandir(directory) as directory_entries:
+        for directory_entry in directory_entries:
+            match = csv_pattern.match(directory_entry.name)
+            if match:
+                entries.append(catalog_entry(prefix, int(match.group(1)), match.group(2), directory_entry.name,
+                                             {'timestamp': directory_entry.stat().st_mtime}))
+
+    file_name = session_file_name(prefix)
+    if exists(file_name):
+        reader = SessionReader(file_name)
+        for record in reader.frames:
+            entries.append(catalog_entry(prefix, record['capture_no'], record['capture_type'], file_name,
+                                         record, record['offset']))
+        reader.close()
+
+    for file_name in image_store_file_names(prefix):
+        reader = ImageStoreReader(file_name)
+        for index, (capture_no, timestamp) in enumerate(zip(reader.capture_nos.tolist(), reader.timestamps.tolist())):
+            offset = reader.data_offset + index * reader.dtype.itemsize + RECORD_PREFIX.size
+            entries.append(catalog_entry(prefix, capture_no, IMAGE, file_name, {'timestamp': timestamp}, offset))
+        reader.close()
+
+    return entries
+
+def find_prefixes(directory):
+    '''Returns the save file prefixes of the captures in 'directory', read from the file names.'''
+
+    csv_pattern = re.compile(r'^(.+)_\d+_({})\.csv$'.format('|'.join(CAPTURE_TYPES)))
+    image_store_pattern = re.compile(r'^(.+)_{}(?:_\d+)?{}$'.format(IMAGE, re.escape(IMAGE_STORE_EXTENSION)))
+    prefixes = set()
+    with scandir(directory) as directory_entries:
+        for directory_entry in directory_entries:
+            name = directory_entry.name
+            match = csv_pattern.match(name) or image_store_pattern.match(name)
+            if match:
+                prefixes.add(match.group(1))
+            elif name.endswith(SESSION_EXTENSION):
+                prefixes.add(name[:-len(SESSION_EXTENSION)])
+
+    return sorted(prefixes)
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='List the captures saved in a directory.')
+    parser.add_argument('directory', help='directory holding the captures and their catalog')
+    parser.add_argument('--prefix', help='only list captures saved with this prefix')
+    parser.add_argument('--type', choices=CAPTURE_TYPES, help='only list captures of this type')
+    parser.add_argument('--first', type=int, help='first capture number to list')
+    parser.add_argument('--last', type=int, help='last capture number to list')
+    parser.add_argument('--reindex', action='store_true',
+                        help='read the capture files again, e.g. after files have been deleted or copied in')
+    args = parser.parse_args()
+
+    if not isdir(args.directory):
+        parser.error('{} is not a directory'.format(args.directory))
+
+    catalog = CaptureCatalog(join(args.directory, CATALOG_FILE_NAME))
+    if args.prefix:
+        prefixes = [args.prefix]
+    else:
+        # Reindexing also drops the prefixes whose files are all gone
+        prefixes = set(find_prefixes(args.directory))
+        if args.reindex:
+            prefixes.update(catalog.get_prefixes())
+    for prefix in sorted(prefixes):
+        catalog.index_prefix(prefix, reindex=args.reindex)
+
+    for capture in catalog.find_captures(args.prefix, args.type, args.first, args.last):
+        print('{prefix}\t{capture_no}\t{capture_type}\t{device}\t{timestamp}\t{profile}\t{file_name}\t{file_offset}'.format(
+            **capture))
+    catalog.close()
@@ -0,0 +1,110 @@
+'''
+Lossless compression of a run of frames with the same dtype and shape (a chunk).
+
+Frames from consecutive triggers are highly correlated, so every frame but the first is stored
+as its difference to the previous one. The differences are taken between the frames' raw bits
+(floats are viewed as unsigned integers of the same size, and the subtraction wraps around), so
+decoding gives back exactly the same bits. The bytes of each value are then split into planes by
+position (all first bytes, all second bytes, ...), which puts the slowly changing high bytes next
+to each other, and each plane is compressed with zlib. Planes that are pure noise (typically the
+low mantissa bytes of raw signals) are stored as they are, since zlib would only slow down on them.
+
+Each chunk is self-contained: decoding one never needs another chunk.
+'''
+
+import struct
+import zlib
+import numpy as np
+from walabot_metrics import metrics
+
+CODEC_NAME = 'delta-shuffle-zlib'
+
+PLANE_HEADER = struct.Struct('<BQ')  # Storage mode and length of each byte plane
+PLANE_RAW = 0
+PLANE_ZLIB = 1
+
+# A plane is only compressed if a sample of it shrinks to less than this fraction of its size
+SAMPLE_SIZE = 1 << 16
+MIN_SAMPLE_RATIO = 0.9
+
+def unsigned_view(frames):
+    '''Returns the raw bits of 'frames' as unsigned integers of the same size.'''
+
+    return frames.view(np.dtype('u{}'.format(frames.dtype.itemsize)))
+
+def encode_frames(frames, level=1):
+    '''
+    Compresses a chunk of frames.
+
+    Inputs:
+        frames: list of Numpy arrays (or a single array whose first axis is the frame number),
+                all with the same dtype and shape
+        level: int, zlib compression level (1 is fastest, 9 compresses most)
+
+    Output:
+        payload: bytes, the compressed chunk
+    '''
+
+    with metrics.timer('save.compress'):
+        frames = np.ascontiguousarray(np.stack(frames) if isinstance(frames, list) else frames)
+        payload = encode_planes(frames, level)
+    metrics.count_bytes('save.compress.input', frames.nbytes)
+    metrics.count_bytes('save.compress.output', len(payload))
+
+    return payload
+
+def encode_planes(frames, level):
+    '''Delta-codes a contiguous array of frames and compresses its byte planes (see encode_frames()).'''
+
+    values = unsigned_view(frames)
+
+    deltas = values.copy()
+    deltas[1:] -= values[:-1]
+
+    # One row per byte position within a value
+    planes = np.ascontiguousarray(deltas.view(np.uint8).reshape(-1, frames.dtype.itemsize).T)
+
+    parts = []
+    for plane in planes:
+        plane_bytes = plane.tobytes()
+        sample = plane_bytes[:SAMPLE_SIZE]
+        if len(zlib.compress(sample, 1)) < MIN_SAMPLE_RATIO * len(sample):
+            mode, data = PLANE_ZLIB, zlib.compress(plane_bytes, level)
+        else:
+            mode, data = PLANE_RAW, plane_bytes
+        parts.append(PLANE_HEADER.pack(mode, len(data)))
+        parts.append(data)
+
+    return b''.join(parts)
+
+def decode_frames(payload, dtype, shape, count):
+    '''
+    Decompresses a chunk written by encode_frames().
+
+    Inputs:
+        payload: bytes, the compressed chunk
+        dtype: Numpy dtype (or dtype string) of the frames
+        shape: shape of one frame
+        count: int, number of frames in the chunk
+
+    Output:
+        frames: Numpy array of shape (count, *shape)
+    '''
+
+    dtype = np.dtype(dtype)
+    num_values = count * int(np.prod(shape, dtype=np.int64))
+    planes = np.empty((dtype.itemsize, num_values), dtype=np.uint8)
+
+    position = 0
+    for plane in planes:
+        mode, length = PLANE_HEADER.unpack_from(payload, position)
+        position += PLANE_HEADER.size
+        data = payload[position:position + length]
+        position += length
+        plane[:] = np.frombuffer(zlib.decompress(data) if mode == PLANE_ZLIB else data, dtype=np.uint8)
+
+    deltas = np.ascontiguousarray(planes.T).view(np.dtype('u{}'.format(dtype.itemsize)))
+    deltas = deltas.reshape((count,) + tuple(shape))
+
+    values = np.cumsum(deltas, axis=0, dtype=deltas.dtype)
+    return values.view(dtype)
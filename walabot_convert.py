@@ -0,0 +1,275 @@
+'''
+Converts CSV capture archives ([prefix]_[n]_[signals|signals_filtered|range_profiles|im_2d|im_3d].csv plus the axes files) into
+binary sessions. One session is written per prefix, preserving the directory layout below the
+source directory. Every converted capture is listed in an index next to the sessions.
+
+The CSV files are parsed in a process pool. The conversion is resumable: a capture is only listed
+in the index once its data has been written, read back and checksum-verified. A later run skips
+every capture already in the index whose source files are unchanged. --verify checks every capture
+in the index against its session again, e.g. after copying the sessions elsewhere.
+
+Usage:
+    python walabot_convert.py <source directory> <output directory> [--workers N]
+    python walabot_convert.py <source directory> <output directory> --verify
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+from os.path import join, relpath, dirname, exists, getsize, getmtime
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from walabot_storage import SessionWriter, frame_payload, load_csv_capture, load_csv_axes, session_file_name, SIGNALS, \
+    SIGNALS_FILTERED, RANGE_PROFILES, IMAGE_SLICE, IMAGE
+
+INDEX_FILE_NAME = 'index.jsonl'
+CAPTURE_FILE_PATTERN = re.compile(r'^(.+)_(\d+)_(signals|signals_filtered|range_profiles|im_2d|im_3d)(_axes)?\.csv$')
+
+def file_sha256(file_name):
+    '''Returns the SHA-256 of a file's contents.'''
+
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def array_bytes(capture):
+    '''
+    Returns the bytes a capture's frame payload is stored as in a session (see SessionWriter.write_frame).
+    The raw signals' time column is left out, it is stored in a separate time record.
+    '''
+
+    payload, _, _ = frame_payload(capture)
+    return payload.tobytes()
+
+def scan_archive(source_dir):
+    '''
+    Finds the capture files below 'source_dir' and groups them by prefix and capture number.
+
+    Output:
+        groups: dict of (prefix, capture_no) -> {'files': {capture_type: file}, 'axes': {capture_type: file}}
+                where prefix is relative to 'source_dir'
+    '''
+
+    groups = {}
+    for directory, _, file_names in os.walk(source_dir):
+        for file_name in file_names:
+            match = CAPTURE_FILE_PATTERN.match(file_name)
+            if not match:
+                continue
+            prefix = relpath(join(directory, match.group(1)), source_dir)
+            group = groups.setdefault((prefix, int(match.group(2))), {'files': {}, 'axes': {}})
+            kind = 'axes' if match.group(4) else 'files'
+            group[kind][match.group(3)] = join(directory, file_name)
+
+    # Axes files on their own are not captures
+    return {key: group for key, group in groups.items() if group['files']}
+
+def parse_group(group):
+    '''
+    Parses the CSV files of one capture. Runs in a worker process.
+
+    Input:
+        group: dict as returned by scan_archive()
+
+    Output:
+        parsed: dict of capture_type -> dict with the capture, its axes (or None), the source file's
+                SHA-256 and size, and the size and SHA-256 of the capture's binary representation
+    '''
+
+    parsed = {}
+    for capture_type, file_name in sorted(group['files'].items()):
+        capture = load_csv_capture(file_name, capture_type)
+        capture_bytes = array_bytes(capture)
+        axes_file = group['axes'].get(capture_type)
+        parsed[capture_type] = {
+            'capture': capture,
+            'axes': load_csv_axes(axes_file) if axes_file else None,
+            'source': file_name,
+            'source_sha256': file_sha256(file_name),
+            'source_size': getsize(file_name),
+            'nbytes': len(capture_bytes),
+            'sha256': hashlib.sha256(capture_bytes).hexdigest()
+        }
+
+    return parsed
+
+def load_index(index_file):
+    '''
+    Reads the index of converted captures. A line cut short by an interrupted run is ignored.
+
+    Output:
+        index: dict of (source file, source size, source mtime) -> index entry
+    '''
+
+    index = {}
+    if not exists(index_file):
+        return index
+
+    with open(index_file) as infile:
+        for line in infile:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            index[(entry['source'], entry['source_size'], entry['source_mtime'])] = entry
+
+    return index
+
+def verify_payload(session_file, offset, nbytes, expected_sha256):
+    '''Reads a frame's data back from the session file and compares its SHA-256.'''
+
+    with open(session_file, 'rb') as infile:
+        infile.seek(offset)
+        return hashlib.sha256(infile.read(nbytes)).hexdigest() == expected_sha256
+
+def verify_archive(output_dir):
+    '''
+    Reads the data of every capture in the index back from its session and compares its SHA-256.
+
+    Input:
+        output_dir: str, directory holding the sessions and index
+
+    Outputs:
+        verified: int, number of captures whose data matches
+        failed: list of the index entries whose data is missing or does not match
+    '''
+
+    verified = 0
+    failed = []
+    for entry in load_index(join(output_dir, INDEX_FILE_NAME)).values():
+        session_file = join(output_dir, entry['session'])
+        if exists(session_file) and verify_payload(session_file, entry['offset'], entry['nbytes'], entry['sha256']):
+            verified += 1
+        else:
+            failed.append(entry)
+
+    return verified, failed
+
+def convert_archive(source_dir, output_dir, num_workers=None, window=None):
+    '''
+    Converts every capture below 'source_dir' that is not in the index yet.
+
+    Inputs:
+        source_dir: str, directory holding the CSV captures
+        output_dir: str, directory the sessions and index are written to
+        num_workers: int, number of parsing processes (defaults to the number of CPUs)
+        window: int, number of captures parsed ahead of the writer (bounds memory use)
+
+    Outputs:
+        converted: int, number of captures converted in this run
+        skipped: int, number of captures already converted by an earlier run
+    '''
+
+    os.makedirs(output_dir, exist_ok=True)
+    index_file = join(output_dir, INDEX_FILE_NAME)
+    index = load_index(index_file)
+
+    pending = []
+    skipped = 0
+    for key, group in sorted(scan_archive(source_dir).items()):
+        done = all((relpath(file_name, source_dir), getsize(file_name), getmtime(file_name)) in index
+                   for file_name in group['files'].values())
+        if done:
+            skipped += 1
+        else:
+            pending.append((key, group))
+
+    num_workers = num_workers or os.cpu_count() or 1
+    window = window or 4 * num_workers
+    writers = {}
+    converted = 0
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor, open(index_file, 'a') as index_out:
+        futures = []
+        next_submit = 0
+        for position in range(len(pending)):
+            # Keep at most 'window' captures in flight, and write them in order
+            while next_submit < len(pending) and next_submit < position + window:
+                futures.append(executor.submit(parse_group, pending[next_submit][1]))
+                next_submit += 1
+            (prefix, capture_no), _ = pending[position]
+            parsed = futures[position].result()
+            futures[position] = None
+
+            session_file = join(output_dir, session_file_name(prefix))
+            if session_file not in writers:
+                os.makedirs(dirname(session_file) or '.', exist_ok=True)
+                writers[session_file] = SessionWriter(session_file)
+            writer = writers[session_file]
+
+            entries = []
+            for capture_type in (SIGNALS, SIGNALS_FILTERED, RANGE_PROFILES, IMAGE_SLICE, IMAGE):
+                if capture_type not in parsed:
+                    continue
+                item = parsed[capture_type]
+                nbytes = item['nbytes']
+                source = relpath(item['source'], source_dir)
+                offset = writer.captures.get((capture_no, capture_type, None))
+                if offset is None or not verify_payload(session_file, offset, nbytes, item['sha256']):
+                    # Not written by an interrupted earlier run (or written incompletely), so write it now
+                    if item['axes'] is not None:
+                        writer.write_axes(*item['axes'])
+                    offset = writer.write_frame(capture_no, capture_type, item['capture'], {'source': source})
+                entries.append({
+                    'prefix': prefix,
+                    'capture_no': capture_no,
+                    'capture_type': capture_type,
+                    'source': source,
+                    'source_size': item['source_size'],
+                    'source_mtime': getmtime(item['source']),
+                    'source_sha256': item['source_sha256'],
+                    'session': relpath(session_file, output_dir),
+                    'offset': offset,
+                    'nbytes': nbytes,
+                    'sha256': item['sha256']
+                })
+
+            # Only list the capture once its data is safely on disk and reads back correctly
+            writer.flush()
+            os.fsync(writer.file.fileno())
+            for entry in entries:
+                if not verify_payload(session_file, entry['offset'], entry['nbytes'], entry['sha256']):
+                    raise IOError('Checksum mismatch for capture {} ({}) in {}'.format(
+                        capture_no, entry['capture_type'], session_file))
+                index_out.write(json.dumps(entry) + '\n')
+            index_out.flush()
+            os.fsync(index_out.fileno())
+            converted += 1
+
+            if converted % 100 == 0:
+                print('Converted {}/{} captures'.format(converted, len(pending)))
+
+    for writer in writers.values():
+        writer.close()
+
+    return converted, skipped
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert CSV capture archives to binary sessions.')
+    parser.add_argument('source_dir', help='directory holding the CSV captures (searched recursively)')
+    parser.add_argument('output_dir', help='directory to write the sessions and index to')
+    parser.add_argument('--workers', type=int, default=None, help='number of parsing processes')
+    parser.add_argument('--verify', action='store_true',
+                        help='check the converted captures against their checksums instead of converting')
+    args = parser.parse_args()
+
+    if args.verify:
+        verified, failed = verify_archive(args.output_dir)
+        for entry in failed:
+            print('Checksum mismatch for capture {} ({}) of {}'.format(entry['capture_no'], entry['capture_type'],
+                                                                     entry['session']))
+        print('{} captures verified, {} failed'.format(verified, len(failed)))
+        if failed:
+            sys.exit(1)
+        return
+
+    converted, skipped = convert_archive(args.source_dir, args.output_dir, args.workers)
+    print('Converted {} captures, {} already converted'.format(converted, skipped))
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,30 @@
-from tkinter import messagebox
-from tkinter.ttk import Combobox
-from os.path import exists
+from tkinter import messagebox, filedialog
+from tkinter.ttk import Combobox, Progressbar
 from walabot_hardware import Walabot
+from walabot_acquisition_engine import AcquisitionEngine
+from walabot_capture import CaptureController, CalibrationWorker, PROF_SHORT_RANGE_IMAGING, PROF_SENSOR_NARROW, PROF_TRACKER, PROFILES, \
+    FILTER_TYPES, FORMAT_SESSION, FORMAT_CSV, SAVE_FORMATS, parse_antenna_pairs, format_antenna_pairs
+from walabot_storage import export_session_csv, SIGNALS, IMAGE_SLICE, IMAGE
+from walabot_signal_filters import SIGNAL_FILTERS
+from walabot_range_profiles import SIGNALS_OUTPUTS
+from walabot_writer_pool import WriterPool
+from walabot_preview import PreviewRenderer
+from walabot_pretrigger import PreTriggerRecorder
+from walabot_event_detector import EventTrigger, create_event_detector, EVENT_DETECTORS, EVENT_DETECTOR_ENERGY, \
+    DEFAULT_EVENT_THRESHOLD, DEFAULT_RELEASE_RATIO, DEFAULT_HOLD_OFF
+from walabot_metrics import metrics
 import tkinter as tk
-import pandas as pd
-import numpy as np
 
 class MainApp(tk.Tk):
     '''Main application class'''
 
-    def __init__(self):
+    def __init__(self, walabot=None):
+        '''
+        Input:
+            walabot: Walabot (or a stand-in with the same interface such as walabot_replay.ReplayWalabot).
+                     Defaults to a Walabot using the vendor API.
+        '''
+
         tk.Tk.__init__(self)
         self.title('Walabot Data Acquisition')
 
@@ -54,34 +69,50 @@ class MainApp(tk.Tk):
             "A70000", "A30000", "9F0000", "9B0000", "970000", "930000", "8F0000",
             "8B0000", "870000", "830000", "7F0000"]
 
-        # Integer values of the profiles taken from WalabotAPI.py
-        # There is PROF_WIDE, but it is not supported for the Developer edition.
-        # Likewise PROF_TRACKER does not support raw signals.
-        self.PROF_SHORT_RANGE_IMAGING = 'SHORT_RANGE_IMAGING'
-        self.PROF_SENSOR_NARROW = 'SENSOR_NARROW'
-        self.PROF_TRACKER = 'TRACKER'
-        self.PROFILES = {
-            self.PROF_SHORT_RANGE_IMAGING: 0x00010000,
-            self.PROF_SENSOR_NARROW: 0x00020000 + 1,
-            self.PROF_TRACKER: 0x00030000
-        }
+        # Profiles, filters and save formats are defined in walabot_capture, which the
+        # headless front end shares.
+        self.PROF_SHORT_RANGE_IMAGING = PROF_SHORT_RANGE_IMAGING
+        self.PROF_SENSOR_NARROW = PROF_SENSOR_NARROW
+        self.PROF_TRACKER = PROF_TRACKER
+        self.PROFILES = PROFILES
         self.PROFILE_NAMES = list(self.PROFILES.keys())
 
-        # Filter constants taken from WalabotAPI.py
-        self.FILTER_TYPES = {
-            'None': 0,
-            'Derivative': 1,
-            'MTI': 2
-        }
+        self.FILTER_TYPES = FILTER_TYPES
         self.FILTER_NAMES = list(self.FILTER_TYPES.keys())
+        self.SIGNAL_FILTERS = SIGNAL_FILTERS
+        self.SIGNALS_OUTPUTS = SIGNALS_OUTPUTS
+        self.EVENT_DETECTORS = EVENT_DETECTORS
 
         # Capture types (raw signals, 2D image, 3D image)
-        self.SIGNALS = 'signals'
-        self.IMAGE_SLICE = 'im_2d'
-        self.IMAGE = 'im_3d'
+        self.SIGNALS = SIGNALS
+        self.IMAGE_SLICE = IMAGE_SLICE
+        self.IMAGE = IMAGE
+
+        self.FORMAT_SESSION = FORMAT_SESSION
+        self.FORMAT_CSV = FORMAT_CSV
+        self.SAVE_FORMATS = SAVE_FORMATS
+
+        # How often the GUI checks for new frames while acquiring continuously (ms)
+        self.ACQUISITION_POLL_INTERVAL = 20
+        # How often the GUI checks for finished save jobs (ms)
+        self.WRITER_POLL_INTERVAL = 100
+        # How often the calibration progress bar is updated (ms)
+        self.CALIBRATION_POLL_INTERVAL = 100
+        # How often the GUI checks whether the capture catalog has been opened (ms)
+        self.CATALOG_POLL_INTERVAL = 100
+        # Calibration is abandoned if it takes longer than this (s)
+        self.CALIBRATION_TIMEOUT = 60
+        # Default number of frames saved from before and after an event in continuous mode
+        self.PRE_TRIGGER_FRAMES = 50
+        self.POST_TRIGGER_FRAMES = 50
 
         # ----- Walabot API -----#
-        self.walabot = Walabot()
+        self.walabot = walabot if walabot is not None else Walabot()
+
+        # ----- Device and save logic ----- #
+        # Saving is done by the writer pool's background threads
+        self.writer_pool = WriterPool()
+        self.controller = CaptureController(self.walabot, self.writer_pool)
 
         # ----- Walabot control panel ------ #
         self.walabot_control_panel = tk.LabelFrame(self, text='Walabot control', padx=15, pady=5)
@@ -92,7 +123,6 @@ class MainApp(tk.Tk):
                                      width=20, state='readonly')
         self.profile_list.bind('<<ComboboxSelected>>', self.handle_profile_change)
         self.profile_list.current(0)  # Default to imaging profile
-        self.selected_profile = self.profile_list.get()
 
         self.walabot_settings_button = tk.Button(self.walabot_control_panel,
                                                  text='Walabot settings', width=20,
@@ -114,9 +144,42 @@ class MainApp(tk.Tk):
                                           width=10, command=self.handle_walabot_calibrate)
         self.trigger_button = tk.Button(self.acquisition_control_panel, text='Trigger (F1)',
                                         width=10, command=self.handle_walabot_trigger)
+        self.continuous_button = tk.Button(self.acquisition_control_panel, text='Start continuous (F3)',
+                                           width=23, command=self.handle_continuous_acquisition)
+        self.calibration_progress = Progressbar(self.acquisition_control_panel, orient='horizontal',
+                                                length=180, mode='determinate', maximum=100)
+
+        # Frames kept in memory during continuous acquisition and saved when an event is signalled
+        self.pre_trigger_frames_label = tk.Label(self.acquisition_control_panel, anchor='w',
+                                                 text='Frames before event:')
+        self.pre_trigger_frames = tk.IntVar()
+        self.pre_trigger_frames.set(self.PRE_TRIGGER_FRAMES)
+        self.pre_trigger_frames_entry = tk.Entry(self.acquisition_control_panel, width=8,
+                                                 textvariable=self.pre_trigger_frames)
+        self.post_trigger_frames_label = tk.Label(self.acquisition_control_panel, anchor='w',
+                                                  text='Frames after event:')
+        self.post_trigger_frames = tk.IntVar()
+        self.post_trigger_frames.set(self.POST_TRIGGER_FRAMES)
+        self.post_trigger_frames_entry = tk.Entry(self.acquisition_control_panel, width=8,
+                                                  textvariable=self.post_trigger_frames)
+        self.save_event_button = tk.Button(self.acquisition_control_panel, text='Save event (F4)',
+                                           width=23, command=self.handle_save_event)
+        self.auto_record = tk.IntVar()
+        self.auto_record_checkbutton = tk.Checkbutton(self.acquisition_control_panel,
+                                                      text='Auto record events',
+                                                      variable=self.auto_record,
+                                                      command=self.handle_auto_record_change)
 
         self.calibrate_button.grid(row=0, column=0, padx=5, pady=5)
         self.trigger_button.grid(row=0, column=1, padx=5, pady=5)
+        self.continuous_button.grid(row=1, column=0, columnspan=2, padx=5, pady=5)
+        self.calibration_progress.grid(row=2, column=0, columnspan=2, padx=5, pady=5)
+        self.pre_trigger_frames_label.grid(row=3, column=0, padx=5, pady=5, sticky='W')
+        self.pre_trigger_frames_entry.grid(row=3, column=1, padx=5, pady=5, sticky='W')
+        self.post_trigger_frames_label.grid(row=4, column=0, padx=5, pady=5, sticky='W')
+        self.post_trigger_frames_entry.grid(row=4, column=1, padx=5, pady=5, sticky='W')
+        self.save_event_button.grid(row=5, column=0, columnspan=2, padx=5, pady=5)
+        self.auto_record_checkbutton.grid(row=6, column=0, columnspan=2, padx=5, pady=5, sticky='W')
 
         # ----- Save control panel ----- #
         self.save_control_panel = tk.LabelFrame(self, text='Save', padx=15, pady=5)
@@ -125,15 +188,18 @@ class MainApp(tk.Tk):
         self.acquire_raw_signals = tk.IntVar()
         self.acquire_raw_signals_checkbutton = tk.Checkbutton(self.save_control_panel,
                                                               text='Raw Signals',
-                                                              variable=self.acquire_raw_signals)
+                                                              variable=self.acquire_raw_signals,
+                                                              command=self.handle_data_type_change)
         self.acquire_raw_image_slice = tk.IntVar()
         self.acquire_raw_image_slice_checkbutton = tk.Checkbutton(self.save_control_panel,
                                                                   text='Raw Image Slice (2D)',
-                                                                  variable=self.acquire_raw_image_slice)
+                                                                  variable=self.acquire_raw_image_slice,
+                                                                  command=self.handle_data_type_change)
         self.acquire_raw_image = tk.IntVar()
         self.acquire_raw_image_checkbutton = tk.Checkbutton(self.save_control_panel,
                                                             text='Raw Image (3D)',
-                                                            variable=self.acquire_raw_image)
+                                                            variable=self.acquire_raw_image,
+                                                            command=self.handle_data_type_change)
 
         self.save_file_prefix_entry_label = tk.Label(self.save_control_panel,
                                                      anchor='w', text='Save file prefix:')
@@ -141,6 +207,8 @@ class MainApp(tk.Tk):
         self.save_file_prefix.set('capture')  # Default save file prefix
         self.save_file_prefix_entry = tk.Entry(self.save_control_panel,
                                                width=20, textvariable=self.save_file_prefix)
+        self.save_file_prefix_entry.bind('<FocusOut>', self.handle_prefix_change)
+        self.save_file_prefix_entry.bind('<Return>', self.handle_prefix_change)
 
         self.capture_no_entry_label = tk.Label(self.save_control_panel,
                                                anchor='w', text='Capture no.:')
@@ -149,8 +217,19 @@ class MainApp(tk.Tk):
         self.capture_no_entry = tk.Entry(self.save_control_panel, width=20,
                                          textvariable=self.capture_no)
 
+        self.save_format_label = tk.Label(self.save_control_panel, anchor='w', text='Save format:')
+        self.save_format_list = Combobox(self.save_control_panel, values=self.SAVE_FORMATS,
+                                         width=17, state='readonly')
+        self.save_format_list.current(0)  # Default to binary sessions
+
         self.save_button = tk.Button(self.save_control_panel, text='Save acquisition (F2)',
                                      width=20, command=self.handle_save_capture)
+        self.export_button = tk.Button(self.save_control_panel, text='Export session to CSV',
+                                       width=20, command=self.handle_export_session)
+        self.pending_writes = tk.StringVar()
+        self.pending_writes.set('Pending writes: 0')
+        self.pending_writes_label = tk.Label(self.save_control_panel, anchor='w',
+                                             textvariable=self.pending_writes)
 
         self.acquire_raw_signals_checkbutton.grid(row=0, column=0, padx=5, pady=5, sticky='W')
         self.acquire_raw_image_slice_checkbutton.grid(row=1, column=0, padx=5, pady=5, sticky='W')
@@ -159,7 +238,14 @@ class MainApp(tk.Tk):
         self.save_file_prefix_entry.grid(row=4, column=0, padx=5, pady=5)
         self.capture_no_entry_label.grid(row=5, column=0, padx=5, pady=5, sticky='W')
         self.capture_no_entry.grid(row=6, column=0, padx=5, pady=5)
-        self.save_button.grid(row=7, column=0, padx=5, pady=5)
+        self.save_format_label.grid(row=7, column=0, padx=5, pady=5, sticky='W')
+        self.save_format_list.grid(row=8, column=0, padx=5, pady=5)
+        self.save_button.grid(row=9, column=0, padx=5, pady=5)
+        self.export_button.grid(row=10, column=0, padx=5, pady=5)
+        self.pending_writes_label.grid(row=11, column=0, padx=5, pady=5, sticky='W')
+
+        # Carry on after the last capture saved with the default prefix, if its directory has a catalog
+        self.resume_capture_no(create=False)
 
         # ----- Image preview panel ------ #
         # Aspect ratio of 2D image using short range imaging and standard settings is 17x21 (w*h)
@@ -170,22 +256,41 @@ class MainApp(tk.Tk):
                                               width=self.canvas_width, height=self.canvas_height)
         self.image_preview_canvas.configure(background='#' + self.COLOURS[0]) # Default background colour (purple)
 
-        self.image_preview_panel.grid(row=0, column=1, rowspan=3, padx=5, pady=5)
+        self.image_preview_panel.grid(row=0, column=1, rowspan=3, padx=5, pady=5, sticky='N')
         self.image_preview_canvas.grid(row=0, column=0)
 
+        # The slice is drawn as a single bitmap, coloured through a lookup table built from COLOURS
+        self.preview_renderer = PreviewRenderer(self.COLOURS, self.canvas_width, self.canvas_height)
+        self.preview_photo = None  # Tk photo image shown on the canvas, created once connected
+
         # ----- Variable initialisation ----- #
         self.capture_saved = False  # Used for detecting duplicate saves.
         self.counter = 0               # Number of captures saved with this file prefix
+        self.acquisition_engine = None # Background acquisition loop (continuous mode only)
+        self.pretrigger_recorder = None  # Keeps recent frames for Save event (continuous mode only)
+        self.event_frames_saved = 0    # Frames the recorder had saved when the capture no. was last updated
+
+        # Automatic event detection on the image slices (see walabot_event_detector)
+        self.event_detector_name = EVENT_DETECTOR_ENERGY
+        self.event_threshold = DEFAULT_EVENT_THRESHOLD
+        self.event_release = DEFAULT_RELEASE_RATIO * DEFAULT_EVENT_THRESHOLD
+        self.event_hold_off = DEFAULT_HOLD_OFF
+        self.calibration_worker = None # Background calibration, while calibrating
+        self.preview_queue = None      # Frames from the acquisition engine waiting to be previewed
+        self.latest_frame = None       # Most recent frame acquired in continuous mode
 
         # Default arena settings (profile dependent)
-        self.param_1, self.param_2, self.param_3, self.threshold, self.filter_type = self.init_walabot_settings(self.selected_profile)
+        self.controller.set_profile(self.profile_list.get())
 
         # ----- Start ----- #
         self.bind('<F1>', self.handle_walabot_trigger)
         self.bind('<F9>', self.handle_walabot_calibrate)
         self.bind('<F2>', self.handle_save_capture)
+        self.bind('<F3>', self.handle_continuous_acquisition)
+        self.bind('<F4>', self.handle_save_event)
         self.protocol('WM_DELETE_WINDOW', self.handle_app_exit) # Disconnect from Walabot if the application is closed
-        self.minsize(645, 553)
+        self.minsize(645, 875)
+        self.after(self.WRITER_POLL_INTERVAL, self.poll_writer_pool)
         self.mainloop()
 
     def is_walabot_connected(self):
@@ -196,80 +301,81 @@ class MainApp(tk.Tk):
         '''
         return self.walabot.is_connected
 
-    def init_walabot_settings(self, profile):
+    def is_acquiring_continuously(self):
+        '''Determines if the background acquisition engine is running.
+
+        Output:
+            True if frames are being acquired continuously. False otherwise.
         '''
-        Sets default arena, threshold, and filter type values.
-        These values were obtained from the Walabot API tutorial software.
+        return self.acquisition_engine is not None and self.acquisition_engine.is_running()
+
+    def is_recording_event(self):
+        '''Determines if the frames of an event are still being collected or saved.
+
+        Output:
+            True if an event is being recorded. False otherwise.
         '''
+        return self.pretrigger_recorder is not None and self.pretrigger_recorder.is_recording_event()
 
-        if profile == self.PROF_SHORT_RANGE_IMAGING: # Short range imaging profile
-            param_1 = (-4, 4, 0.25)
-            param_2 = (-6, 4, 0.25)
-            param_3 = (3, 8, 0.25)
-            threshold = 35.0
-            filter_type = self.FILTER_TYPES['None']
-        else:
-            # Sensor or sensor narrow profiles
-            param_1 = (10, 100, 1)
-            param_2 = (40, 50, 1)
-            param_3 = (40, 50, 1)
-            threshold = 35.0
-            filter_type = self.FILTER_TYPES['None']
+    def is_calibrating(self):
+        '''Determines if the Walabot is being calibrated.
 
-        return param_1, param_2, param_3, threshold, filter_type
+        Output:
+            True if calibration is running. False otherwise.
+        '''
+        return self.calibration_worker is not None and self.calibration_worker.is_running()
 
-    def get_image_dimensions(self):
+    def get_selected_data_types(self):
         '''
-        Returns the dimensions of a 2D image slice given the current arena configuration.
+        Returns the capture types ticked in the save panel.
+
+        Output:
+            data_types: list of capture types (e.g. ['signals', 'im_2d'])
         '''
 
-        width, height, walabot_error = self.walabot.get_image_dimensions()
-        if walabot_error:
-            error_msg = 'Walabot API error: {}'.format(walabot_error)
-            messagebox.showerror(title='Error getting image dimensions', message=error_msg)
+        data_types = []
+        if self.acquire_raw_signals.get() == 1:
+            data_types.append(self.SIGNALS)
+        if self.acquire_raw_image_slice.get() == 1:
+            data_types.append(self.IMAGE_SLICE)
+        if self.acquire_raw_image.get() == 1:
+            data_types.append(self.IMAGE)
 
-        return width, height
+        return data_types
 
-    def create_preview_pixels(self):
-        '''Create the individual pixels of the preview image canvas'''
+    def get_acquisition_data_types(self):
+        '''Returns the capture types the acquisition engine has to fetch: the ticked ones plus the preview slice.'''
 
-        # Code taken from the Walabot demo code RawImage.py
-        # https://github.com/Walabot-Projects/Walabot-RawImage
+        return set(self.get_selected_data_types()) | {self.IMAGE_SLICE}
 
-        # Width and height are reversed since the displayed image is transposed
-        self.image_width, self.image_height = self.get_image_dimensions()
-        rect_width, rect_height = self.canvas_width/self.image_width, self.canvas_height/self.image_height
+    def get_image_dimensions(self):
+        '''
+        Returns the dimensions of a 2D image slice given the current arena configuration.
+        '''
 
-        self.cells = [[
-            self.image_preview_canvas.create_rectangle(
-                rect_width*col, rect_height*row,
-                rect_width*(col+1), rect_height*(row+1),
-                width=0)
-            for col in range(self.image_width)] for row in range(self.image_height)]
+        return self.controller.get_geometry().image_slice_dimensions
 
-    def set_preview_pixel(self, row, col, value):
-        '''
-        Sets the pixel of [row][col] in the preview panel to 'value'.
+    def create_preview_pixels(self):
+        '''Creates the preview bitmap for the current arena and places it on the canvas'''
 
-        Inputs:
-            row: int, pixel's y-coordinate
-            col: int, pixel's x-coordinate
-            value: hex, pixel's colour
-        '''
+        # Width and height are reversed since the displayed image is transposed
+        self.image_width, self.image_height = self.get_image_dimensions()
+        self.preview_renderer.set_image_dimensions(self.image_width, self.image_height)
 
-        self.image_preview_canvas.itemconfigure(self.cells[row][col], fill='#'+value)
+        self.preview_photo = tk.PhotoImage(width=self.canvas_width, height=self.canvas_height)
+        self.image_preview_canvas.create_image(0, 0, anchor='nw', image=self.preview_photo)
+        self.clear_preview_pixels()
 
     def clear_preview_pixels(self):
         '''Resets the image preview'''
 
-        for col in range(self.image_width):
-            for row in range(self.image_height):
-                self.set_preview_pixel(row, col, self.COLOURS[0])
+        self.preview_photo.configure(data=self.preview_renderer.render_blank_ppm(), format='PPM')
 
     def delete_preview_pixels(self):
-        '''Deletes all the pixels in the image preview canvas'''
+        '''Deletes the preview bitmap from the image preview canvas'''
 
         self.image_preview_canvas.delete('all')
+        self.preview_photo = None
 
     def get_walabot_settings(self):
         '''
@@ -283,16 +389,27 @@ class MainApp(tk.Tk):
             filter_type: integer, refer to Walabot API for filter constants
         '''
 
-        return self.param_1, self.param_2, self.param_3, self.threshold, self.filter_type
+        return self.controller.get_walabot_settings()
 
     def set_walabot_settings(self, param_1, param_2, param_3, threshold, filter_type):
         '''Sets the arena parameters, threshold, and filter values'''
 
-        self.param_1 = param_1
-        self.param_2 = param_2
-        self.param_3 = param_3
-        self.threshold = threshold
-        self.filter_type = self.FILTER_TYPES[filter_type]
+        self.controller.set_walabot_settings(param_1, param_2, param_3, threshold, self.FILTER_TYPES[filter_type])
+
+    def set_antenna_pairs(self, antenna_pairs):
+        '''Selects the antenna pairs whose raw signals are read and saved (None for all of them)'''
+
+        self.controller.set_antenna_pairs(antenna_pairs)
+
+    def set_signal_filter(self, signal_filter, save_unfiltered):
+        '''Selects the software filter applied to the raw signals when they are saved'''
+
+        self.controller.set_signal_filter(signal_filter, save_unfiltered)
+
+    def set_signals_output(self, signals_output):
+        '''Selects whether the raw signals are saved as samples, range profiles, or both'''
+
+        self.controller.set_signals_output(signals_output)
 
     def is_settings_window_open(self):
         '''
@@ -315,8 +432,7 @@ class MainApp(tk.Tk):
 
         # Reinitialise the Walabot settings upon changing profile as the new profile might
         # require different settings (e.g. changing from imaging to sensor).
-        self.selected_profile = self.profile_list.get()
-        self.param_1, self.param_2, self.param_3, self.threshold, self.filter_type = self.init_walabot_settings(self.selected_profile)
+        self.controller.set_profile(self.profile_list.get())
 
         # If the settings window is open while changing profiles, close it and open it again for
         # the same reason as above.
@@ -324,10 +440,9 @@ class MainApp(tk.Tk):
             self.walabot_settings_window.close_settings_window()
             self.handle_walabot_settings_window()
 
-        # If the Walabot is connected, it must be reconnected before setting the profile again.
+        # If the Walabot is connected, apply the new profile without disconnecting.
         if self.is_walabot_connected():
-            self.handle_walabot_disconnect()
-            self.handle_walabot_connect_and_setup()
+            self.handle_walabot_reconfigure()
 
     def handle_walabot_settings_window(self):
         '''Opens the Walabot settings in a new window. If the window is already open, bring it in focus.'''
@@ -343,44 +458,48 @@ class MainApp(tk.Tk):
         arena settings and configure GUI buttons.
         '''
 
-        connect_error = self.walabot.connect()
-        if connect_error:
-            error_msg = 'Walabot API error: {}'.format(connect_error)
-            messagebox.showerror(title='Connect error', message=error_msg)
-            return
-
-        profile_error = self.walabot.set_profile(self.PROFILES[self.selected_profile])
-        if profile_error:
-            self.handle_walabot_disconnect()
-            error_msg = 'Walabot API error: {}'.format(profile_error)
-            messagebox.showerror(title='Error setting profile', message=error_msg)
-            return
-
-        if self.selected_profile == self.PROF_SHORT_RANGE_IMAGING:
-            arena_error = self.walabot.set_arena_imaging(self.param_1, self.param_2, self.param_3,
-                                                         self.threshold, self.filter_type)
-        else:
-            arena_error = self.walabot.set_arena_sensor(self.param_1, self.param_2, self.param_3,
-                                                        self.threshold, self.filter_type)
-        if arena_error:
-            self.handle_walabot_disconnect()
-            error_msg = 'Walabot API error: {}'.format(arena_error)
-            messagebox.showerror(title='Error setting arena', message=error_msg)
+        stage, walabot_error = self.controller.connect_and_setup()
+        if walabot_error:
+            error_msg = 'Walabot API error: {}'.format(walabot_error)
+            messagebox.showerror(title=stage, message=error_msg)
             return
 
         # Toggle button function to disconnect
         self.connect_disconnect_button.configure(text="Disconnect from Walabot",
                                                  command=self.handle_walabot_disconnect)
 
-        self.walabot.start()
-
         # Clear the previw image
         self.delete_preview_pixels()
         self.create_preview_pixels()
 
+    def handle_walabot_reconfigure(self):
+        '''
+        Applies changed profile, arena, threshold and filter settings to the connected Walabot
+        without disconnecting it, then resizes the preview to the new arena.
+        '''
+
+        self.stop_continuous_acquisition()
+        self.cancel_calibration()
+
+        stage, walabot_error = self.controller.reconfigure()
+        if walabot_error:
+            error_msg = 'Walabot API error: {}'.format(walabot_error)
+            messagebox.showerror(title=stage, message=error_msg)
+            if not self.is_walabot_connected():
+                self.connect_disconnect_button.configure(text='Connect to Walabot',
+                                                         command=self.handle_walabot_connect_and_setup)
+            return
+
+        self.image_width, self.image_height = self.get_image_dimensions()
+        self.preview_renderer.set_image_dimensions(self.image_width, self.image_height)
+        self.clear_preview_pixels()
+
     def handle_walabot_disconnect(self):
         '''Disconnect from the Walabot and reconfigure GUI buttons'''
 
+        self.stop_continuous_acquisition()
+        self.cancel_calibration()
+
         disconnect_error = self.walabot.disconnect()
         if disconnect_error:
             error_msg = 'Walabot API error {}'.format(disconnect_error)
@@ -392,17 +511,60 @@ class MainApp(tk.Tk):
                                                  command=self.handle_walabot_connect_and_setup)
 
     def handle_walabot_calibrate(self, *args):
-        '''Calibrates the Walabot using the Calibrate() function'''
+        '''
+        Starts calibrating the Walabot on a background thread, or cancels the calibration if it is running.
+        The progress is shown in the acquisition panel.
+
+        Note that this function ignores input arguments - *args exists as a placeholder for when
+        this function is called by a callback function which passes in an event.
+        '''
+
+        if self.is_calibrating():
+            self.calibration_worker.cancel_event.set()
+            return
 
         if not self.walabot.is_connected:
             messagebox.showerror('Calibrate error', 'The Walabot is not connected!')
             return
 
-        calibrate_error = self.walabot.calibrate()
+        if self.is_acquiring_continuously():
+            messagebox.showerror('Calibrate error', 'Stop continuous acquisition before calibrating.')
+            return
+
+        self.calibration_worker = CalibrationWorker(self.walabot, self.CALIBRATION_TIMEOUT)
+        self.calibration_worker.start()
+        self.calibration_progress.configure(value=0)
+        self.calibrate_button.configure(text='Cancel (F9)')
+        self.after(self.CALIBRATION_POLL_INTERVAL, self.poll_calibration)
+
+    def poll_calibration(self):
+        '''Updates the calibration progress bar and reports the outcome once calibration has finished.'''
+
+        if self.calibration_worker is None:
+            return
+
+        self.calibration_progress.configure(value=self.calibration_worker.progress)
+        if self.calibration_worker.is_running():
+            self.after(self.CALIBRATION_POLL_INTERVAL, self.poll_calibration)
+            return
+
+        calibrate_error = self.calibration_worker.walabot_error
+        self.calibration_worker = None
+        self.calibrate_button.configure(text='Calibrate (F9)')
         if calibrate_error:
+            self.calibration_progress.configure(value=0)
             error_msg = 'Walabot API error: {}'.format(calibrate_error)
             messagebox.showerror('Calibrate error', error_msg)
 
+    def cancel_calibration(self):
+        '''Cancels the calibration (if running), waits for it to stop and resets the progress bar.'''
+
+        if self.calibration_worker is not None:
+            self.calibration_worker.cancel()
+            self.calibration_worker = None
+        self.calibrate_button.configure(text='Calibrate (F9)')
+        self.calibration_progress.configure(value=0)
+
     def handle_walabot_trigger(self, *args):
         '''
         Runs a Trigger() command on the Walabot
@@ -415,6 +577,14 @@ class MainApp(tk.Tk):
             messagebox.showerror('Trigger error', 'The Walabot is not connected!')
             return
 
+        if self.is_calibrating():
+            messagebox.showerror('Trigger error', 'Wait for the calibration to finish.')
+            return
+
+        if self.is_acquiring_continuously():
+            # The acquisition engine is already triggering as fast as the Walabot allows
+            return
+
         trigger_error = self.walabot.trigger()
         if trigger_error:
             error_msg = 'Walabot API error: {}'.format(trigger_error)
@@ -431,44 +601,252 @@ class MainApp(tk.Tk):
                   "              __/ | __/ |                    \n"
                   "             |___/ |___/                     \n")
 
+    def handle_continuous_acquisition(self, *args):
+        '''
+        Starts or stops continuous acquisition. While running, a worker thread triggers the Walabot
+        in a loop and the GUI previews and saves the most recent frame.
+
+        Note that this function ignores input arguments - *args exists as a placeholder for when
+        this function is called by a callback function which passes in an event.
+        '''
+
+        if self.is_acquiring_continuously():
+            self.stop_continuous_acquisition()
+            return
+
+        if not self.walabot.is_connected:
+            messagebox.showerror('Acquisition error', 'The Walabot is not connected!')
+            return
+
+        if self.is_calibrating():
+            messagebox.showerror('Acquisition error', 'Wait for the calibration to finish.')
+            return
+
+        try:
+            pre_trigger_frames = self.pre_trigger_frames.get()
+            post_trigger_frames = self.post_trigger_frames.get()
+        except tk.TclError:
+            messagebox.showerror('Acquisition error', 'Invalid number of frames before or after an event.')
+            return
+
+        self.acquisition_engine = AcquisitionEngine(self.walabot, self.get_acquisition_data_types())
+        self.preview_queue = self.acquisition_engine.subscribe()
+        self.pretrigger_recorder = PreTriggerRecorder(self.acquisition_engine, self.controller,
+                                                      self.get_selected_data_types(),
+                                                      pre_trigger_frames, post_trigger_frames,
+                                                      event_trigger=self.create_event_trigger())
+        self.event_frames_saved = 0
+        self.latest_frame = None
+        self.pretrigger_recorder.start()
+        self.acquisition_engine.start()
+        self.continuous_button.configure(text='Stop continuous (F3)')
+        self.after(self.ACQUISITION_POLL_INTERVAL, self.poll_acquisition)
+
+    def stop_continuous_acquisition(self):
+        '''Stops the acquisition engine (if running) and resets the GUI buttons.'''
+
+        if self.acquisition_engine is not None:
+            self.acquisition_engine.stop()
+            self.acquisition_engine = None
+        if self.pretrigger_recorder is not None:
+            # Waits for the frames of the last event to be saved
+            self.pretrigger_recorder.stop()
+            self.update_event_capture_no()
+            self.pretrigger_recorder = None
+        self.continuous_button.configure(text='Start continuous (F3)')
+
+    def handle_save_event(self, *args):
+        '''
+        Saves the frames kept from before now and the frames acquired next (see walabot_pretrigger),
+        on a background thread. Only available in continuous mode.
+
+        Note that this function ignores input arguments - *args exists as a placeholder for when
+        this function is called by a callback function which passes in an event.
+        '''
+
+        if not self.is_acquiring_continuously():
+            messagebox.showerror('Save error', 'Start continuous acquisition to save events.')
+            return
+
+        if not self.get_selected_data_types():
+            messagebox.showerror('Save error', 'No acquisition type selected!')
+            return
+
+        if not self.is_recording_event():
+            # The save settings are only taken up between events, so one event is saved in one place
+            with self.controller.save_lock:
+                self.update_save_settings()
+        self.pretrigger_recorder.trigger_event()
+
+    def create_event_trigger(self):
+        '''Returns an EventTrigger with the auto record settings, or None if auto recording is off.'''
+
+        if self.auto_record.get() != 1:
+            return None
+
+        return EventTrigger(create_event_detector(self.event_detector_name), self.event_threshold,
+                            self.event_release, self.event_hold_off)
+
+    def handle_auto_record_change(self):
+        '''Switches automatic event recording on or off, straight away if acquiring continuously.'''
+
+        if self.is_acquiring_continuously():
+            self.pretrigger_recorder.set_event_trigger(self.create_event_trigger())
+
+    def set_event_detection(self, detector_name, threshold, release, hold_off):
+        '''Sets the detector, start and stop thresholds and hold-off used to record events automatically'''
+
+        self.event_detector_name = detector_name
+        self.event_threshold = threshold
+        self.event_release = release
+        self.event_hold_off = hold_off
+        self.handle_auto_record_change()
+
+    def update_event_capture_no(self):
+        '''Shows the next capture number once the recorder has saved frames.'''
+
+        if self.pretrigger_recorder is not None and self.pretrigger_recorder.saved_frames != self.event_frames_saved:
+            self.event_frames_saved = self.pretrigger_recorder.saved_frames
+            self.capture_no.set(self.controller.capture_no)
+
+    def handle_data_type_change(self):
+        '''Updates the data types fetched by the acquisition engine when a save checkbox is toggled.'''
+
+        if self.is_acquiring_continuously():
+            self.acquisition_engine.set_data_types(self.get_acquisition_data_types())
+            self.pretrigger_recorder.set_data_types(self.get_selected_data_types())
+
+    def poll_acquisition(self):
+        '''
+        Drains the preview queue on the Tk event thread and previews the newest frame.
+        Reschedules itself for as long as the acquisition engine is running.
+        '''
+
+        if self.acquisition_engine is None:
+            return
+
+        self.update_event_capture_no()
+        frame = None
+        while not self.preview_queue.empty():
+            frame = self.preview_queue.get_nowait()
+
+        if frame is not None:
+            if frame.walabot_error:
+                self.stop_continuous_acquisition()
+                error_msg = 'Walabot API error: {}'.format(frame.walabot_error)
+                messagebox.showerror('Acquisition error', error_msg)
+                return
+
+            self.latest_frame = frame
+            self.capture_saved = False
+            image_slice_capture = frame.get(self.IMAGE_SLICE)
+            if image_slice_capture is not None:
+                self.preview_image(image_slice_capture)
+
+        if self.is_acquiring_continuously() or not self.preview_queue.empty():
+            self.after(self.ACQUISITION_POLL_INTERVAL, self.poll_acquisition)
+        else:
+            self.stop_continuous_acquisition()
+
+    def get_capture(self, capture_type, getter):
+        '''
+        Returns the data to save for 'capture_type'. In continuous mode this comes from the most
+        recent frame, otherwise 'getter' is called to read it from the Walabot.
+
+        Outputs:
+            capture: signals DataFrame or image Numpy array
+            walabot_error: None if no error occurred. Otherwise returns the error message.
+        '''
+
+        if self.acquisition_engine is None:
+            return getter()
+
+        if self.latest_frame is None or self.latest_frame.get(capture_type) is None:
+            return None, 'No {} frame has been acquired yet.'.format(capture_type)
+
+        return self.latest_frame.get(capture_type), None
+
     def handle_app_exit(self):
         '''Disconnects from the Walabot if it is still connected and closes the program'''
 
+        self.stop_continuous_acquisition()
+        self.cancel_calibration()
         if self.is_walabot_connected():
             self.walabot.disconnect()
+
+        # Finish writing everything that is still queued, in order, before closing
+        self.controller.shutdown()
+        self.report_writer_results()
         self.destroy()
 
-    def generate_file_name(self, capture_type):
-        '''
-        Generates the file name for the capture and appends a counter and file type in the filename.
-        The prefix is automatically fetched from the entry widget.
+    def update_save_settings(self):
+        '''Passes the file prefix, capture number and save format entered in the save panel to the controller.'''
 
-        Input:
-            capture_type: str, capture type for reference purposes (e.g. capture_0_signals.csv, capture_0_im_2d.csv)
+        self.controller.prefix = self.save_file_prefix.get()
+        self.controller.capture_no = self.capture_no.get()
+        self.controller.save_format = self.save_format_list.get()
 
-        Outputs:
-            file_name: string, generated file name.
+    def flush_session(self):
+        '''Queues a flush of the binary session and image store after the writes already queued.'''
+
+        self.controller.flush_session()
+
+    def report_writer_results(self):
+        '''Reports finished save jobs. Failures are shown to the user.'''
+
+        for description, error in self.writer_pool.get_results():
+            if error:
+                messagebox.showerror(title='Error saving {}'.format(description), message=error)
+            else:
+                print('Finished writing {}'.format(description))
+
+    def poll_writer_pool(self):
+        '''Periodically reports finished save jobs and shows how far disk I/O is behind.'''
+
+        self.report_writer_results()
+        self.pending_writes.set('Pending writes: {}'.format(self.writer_pool.get_queue_depth()))
+        self.after(self.WRITER_POLL_INTERVAL, self.poll_writer_pool)
+
+    def handle_prefix_change(self, *args):
+        '''Carries on numbering after the last capture saved with the new file prefix, if there is one.'''
+
+        if self.save_file_prefix.get() != self.controller.prefix:
+            self.resume_capture_no()
+
+    def resume_capture_no(self, create=True):
+        '''
+        Opens the capture catalog of the current file prefix in the background, and carries on numbering
+        after the last capture saved with the prefix once it is open (see poll_catalog()).
         '''
 
-        file_name = '{}_{}_{}.csv'.format(self.save_file_prefix.get(),
-                                          str(self.capture_no.get()),
-                                          str(capture_type))
+        self.update_save_settings()
+        if self.controller.prepare_catalog(create=create) is not None:
+            self.poll_catalog(self.controller.prefix)
+
+    def poll_catalog(self, prefix):
+        '''Waits for the catalog of 'prefix' to be opened, then shows the capture number to carry on from.'''
 
-        return file_name
+        if self.save_file_prefix.get() != prefix:
+            # The prefix has changed again in the meantime
+            return
+
+        ready = self.controller.prepare_catalog(prefix, create=False)
+        if ready is not None and not ready.is_set():
+            self.after(self.CATALOG_POLL_INTERVAL, self.poll_catalog, prefix)
+            return
 
-    def check_file_exists(self, capture_type):
-        '''Checks if a file with the current file prefix, capture no., and capture type exists.
+        self.update_save_settings()
+        self.capture_no.set(self.controller.resume_capture_no(create=False, wait=False))
+
+    def check_file_exists(self, capture_types):
+        '''Checks if a file (or session capture) with the current file prefix, capture no., and one of the capture types exists.
 
         Output:
             file_exists: bool, True if file exists, False otherwise.
         '''
 
-        file_exists = False
-        file_name = self.generate_file_name(capture_type)
-        if exists(file_name):
-            file_exists = True
-
-        return file_exists
+        self.update_save_settings()
+        return self.controller.captures_exist(capture_types)
 
     def handle_save_capture(self, *args):
         '''
@@ -483,6 +861,14 @@ class MainApp(tk.Tk):
             messagebox.showerror('Connect error', 'The Walabot is not connected!')
             return
 
+        if self.is_calibrating():
+            messagebox.showerror('Save error', 'Wait for the calibration to finish.')
+            return
+
+        if self.is_recording_event():
+            messagebox.showerror('Save error', 'Wait for the event to finish saving.')
+            return
+
         if self.acquire_raw_signals.get() + \
            self.acquire_raw_image_slice.get() + \
            self.acquire_raw_image.get() == 0:
@@ -497,10 +883,8 @@ class MainApp(tk.Tk):
             if not continue_saving:
                 return
 
-        signals_file_exists = self.check_file_exists(self.SIGNALS)
-        image_slice_file_exists = self.check_file_exists(self.IMAGE_SLICE)
-        image_file_exists = self.check_file_exists(self.IMAGE)
-        if signals_file_exists or image_slice_file_exists or image_file_exists:
+        # One catalog lookup for every capture type
+        if self.check_file_exists(self.controller.get_signals_capture_types() + [self.IMAGE_SLICE, self.IMAGE]):
             continue_saving = messagebox.askyesno('File already exists',
                                                   'A file with the current prefix, capture no., and capture type already exists. Would you like to overwrite it?',
                                                   icon=messagebox.WARNING)
@@ -519,17 +903,26 @@ class MainApp(tk.Tk):
               "                             |___/       \n")
 
         # Save the requested data
+        captures = {}
         if self.acquire_raw_signals.get() == 1:
-            self.save_raw_signals()
+            self.save_raw_signals(captures)
 
         if self.acquire_raw_image_slice.get() == 1:
-            self.save_raw_image_slice()
+            self.save_raw_image_slice(captures)
 
         if self.acquire_raw_image.get() == 1:
-            self.save_raw_image()
+            self.save_raw_image(captures)
 
-        # Increment the capture number
-        self.capture_no.set(self.capture_no.get() + 1)
+        # Everything read from the widgets is fetched here, on the GUI thread. The writing itself is
+        # done by the writer pool.
+        self.update_save_settings()
+        self.controller.save_captures(captures)
+        if captures:
+            self.capture_saved = True
+        self.pending_writes.set('Pending writes: {}'.format(self.writer_pool.get_queue_depth()))
+
+        # The controller has moved on to the next capture number
+        self.capture_no.set(self.controller.capture_no)
 
         print("   _____                     _ \n"
               "  / ____|                   | |\n"
@@ -538,124 +931,78 @@ class MainApp(tk.Tk):
               "  ____) | (_| |\ V /  __/ (_| |\n"
               " |_____/ \__,_| \_/ \___|\__,_|\n")
 
-    def save_capture(self, capture, capture_type):
-        '''
-        Saves the provided capture matrix to a .csv file using the entered prefix.
+    def handle_export_session(self):
+        '''Exports a binary session chosen by the user to the CSV file layout.'''
 
-        Input:
-            capture: Pandas DataFrame or Numpy array containing the raw signals or image
-            capture_type: signals, raw image slice, or raw image
-        '''
-
-        # Generate file name with appropriate suffix based on capture type (e.g. capture_0_signals.csv, capture_0_2d_image.csv)
-        file_name = self.generate_file_name(capture_type)
-
-        # Pandas DataFrames have column labels by default.
-        # We only want this when we save raw signals and not if we are saving an image.
-        if capture_type == self.SIGNALS:
-            capture.to_csv(file_name, index=False)
-        elif capture_type == self.IMAGE_SLICE:
-            # capture.to_csv(file_name, index=False, header=False)
-            np.savetxt(file_name, capture, fmt='%.f', comments='', delimiter=',')
-        elif capture_type == self.IMAGE:
-            # https://stackoverflow.com/questions/3685265/how-to-write-a-multidimensional-array-to-a-text-file
-            with open(file_name, 'w') as outfile:
-                outfile.write('# Array shape (rows x columns x depth): {}x{}x{}\n'.format(capture.shape[1],
-                                                                                          capture.shape[2],
-                                                                                          capture.shape[0]))
-                for data_slice in capture:
-                    np.savetxt(outfile, data_slice, fmt='%.f', comments='', delimiter=',')
-                    outfile.write('# New slice\n')
-
-        self.capture_saved = True
-
-    def save_axes(self, image_dim):
-        '''
-        Saves the axes for plotting to a separate CSV file.
-        Note that although the 2D images only have two axes (X, Y) or (Phi, R),
-        all three axes are saved for reference purposes.
+        session_file = filedialog.askopenfilename(title='Export session to CSV',
+                                                  filetypes=[('Walabot session', '*.wbs')])
+        if not session_file:
+            return
 
-        Input:
-            image_dim: str, 2D or 3D for file name generation
-        '''
-
-        # Min, max, and increment size for either X, Y, Z or
-        # R, phi, theta depending on the profile
-        axis_1_min = self.param_1[0]
-        axis_1_max = self.param_1[1]
-        axis_1_res = self.param_1[2]
-        axis_2_min = self.param_2[0]
-        axis_2_max = self.param_2[1]
-        axis_2_res = self.param_2[2]
-        axis_3_min = self.param_3[0]
-        axis_3_max = self.param_3[1]
-        axis_3_res = self.param_3[2]
-
-        # Generate the axis vectors
-        axis_1_num_steps = int((axis_1_max - axis_1_min) / axis_1_res)
-        axis_1 = [axis_1_min + i*axis_1_res for i in range(axis_1_num_steps+1)]
-        axis_2_num_steps = int((axis_2_max - axis_2_min) / axis_2_res)
-        axis_2 = [axis_2_min + i*axis_2_res for i in range(axis_2_num_steps+1)]
-        axis_3_num_steps = int((axis_3_max - axis_3_min) / axis_3_res)
-        axis_3 = [axis_3_min + i*axis_3_res for i in range(axis_3_num_steps+1)]
-
-        # Save the axis vectors to a CSV file with each axis corresponding to a column
-        axes = [axis_1, axis_2, axis_3]
-        if self.selected_profile == self.PROF_SHORT_RANGE_IMAGING:
-            axes_pd = pd.DataFrame(axes, index=['X', 'Y', 'Z'])
-        else:
-            axes_pd = pd.DataFrame(axes, index=['R', 'theta', 'phi'])
-        file_name = self.generate_file_name(image_dim)
-        axes_pd = axes_pd.transpose()
-        axes_pd.to_csv(file_name, index=False)
+        # Make sure everything saved so far is on disk before reading the session back
+        self.flush_session()
+        self.writer_pool.flush()
+
+        try:
+            file_names = export_session_csv(session_file)
+        except (OSError, ValueError) as error:
+            messagebox.showerror('Export error', str(error))
+            return
 
-    def save_raw_signals(self):
-        '''Saves all of the Walabot's raw signals from the current trigger'''
+        messagebox.showinfo('Export complete', '{} CSV file(s) written.'.format(len(file_names)))
+
+    def save_raw_signals(self, captures):
+        '''Adds all of the Walabot's raw signals from the current trigger to the captures to save'''
 
         # One capture (trigger) contains a time column plus all of the raw signals from the antenna pairs.
         # E.g. All 40 pairs using the Sensor profile would result in an array of size 8192 by 41.
 
-        signals_capture, error = self.walabot.get_raw_signals()
+        signals_capture, error = self.get_capture(self.SIGNALS, self.walabot.get_raw_signals)
         if error:
             error_msg = 'Walabot API error: {}'.format(error)
             messagebox.showerror(title='Error saving raw signals', message=error_msg)
         else:
-            self.save_capture(signals_capture, self.SIGNALS)
+            captures[self.SIGNALS] = signals_capture
 
-    def save_raw_image_slice(self):
-        '''Saves a 2D image slice from the current trigger'''
+    def save_raw_image_slice(self, captures):
+        '''Adds a 2D image slice from the current trigger to the captures to save'''
 
-        image_slice_capture, error = self.walabot.get_raw_image_slice()
+        image_slice_capture, error = self.get_capture(self.IMAGE_SLICE, self.walabot.get_raw_image_slice)
         if error:
             error_msg = 'Walabot API error: {}'.format(error)
             messagebox.showerror(title='Error saving 2D image', message=error_msg)
         else:
-            self.save_capture(image_slice_capture, self.IMAGE_SLICE)
-            self.save_axes('im_2d_axes')
+            captures[self.IMAGE_SLICE] = image_slice_capture
 
-    def save_raw_image(self):
-        '''Saves a 3D image from the current trigger'''
+    def save_raw_image(self, captures):
+        '''Adds a 3D image from the current trigger to the captures to save'''
 
-        image_capture, error = self.walabot.get_raw_image()
+        image_capture, error = self.get_capture(self.IMAGE, self.walabot.get_raw_image)
         if error:
             error_msg = 'Walabot API error: {}'.format(error)
             messagebox.showerror(title='Error saving 3D image', message=error_msg)
         else:
-            self.save_capture(image_capture, self.IMAGE)
-            self.save_axes('im_3d_axes')
+            captures[self.IMAGE] = image_capture
+
+    def preview_image(self, image_slice_capture=None):
+        '''
+        Draws the triggered raw image slice.
 
-    def preview_image(self):
-        '''Draws the triggered raw image slice'''
+        Input:
+            image_slice_capture: 2D image as a Numpy array. If None, it is read from the Walabot.
+        '''
 
-        image_slice_capture, error = self.walabot.get_raw_image_slice()
+        error = None
+        if image_slice_capture is None:
+            image_slice_capture, error = self.walabot.get_raw_image_slice()
         if error:
             error_msg = 'Walabot API error: {}'.format(error)
             messagebox.showerror(title='Error previewing image slice', message=error_msg)
         else:
-            im = image_slice_capture.tolist()
-            for col in range(self.image_width):
-                for row in range(self.image_height):
-                    self.set_preview_pixel(row, col, self.COLOURS[im[row][col]])
+            with metrics.timer('preview.render'):
+                ppm = self.preview_renderer.render_ppm(image_slice_capture)
+            with metrics.timer('preview.draw'):
+                self.preview_photo.configure(data=ppm, format='PPM')
 
 class WalabotSettingsWindow(tk.Toplevel):
     '''
@@ -721,7 +1068,7 @@ class WalabotSettingsWindow(tk.Toplevel):
         # ----- Additional settings control panel ----- #
         # These widgets are common amongst the profiles.
         self.additional_control_panel = tk.LabelFrame(self, text='Additional settings',
-                                                      padx=86, pady=5)
+                                                      padx=40, pady=5)
         self.additional_control_panel.grid(row=1, column=0, padx=5, pady=5)
         self.threshold_label = tk.Label(self.additional_control_panel, text='Threshold: ')
         self.threshold_entry = tk.Entry(self.additional_control_panel, width=8)
@@ -732,13 +1079,67 @@ class WalabotSettingsWindow(tk.Toplevel):
                                     values=self.master.FILTER_NAMES, state='readonly', width=8)
         self.filter_list.current(filter_type)
 
+        # Software filter for the raw signals (the filter type above only applies to images)
+        self.signal_filter_label = tk.Label(self.additional_control_panel, text='Signal filter:')
+        self.signal_filter_list = Combobox(self.additional_control_panel,
+                                           values=self.master.SIGNAL_FILTERS, state='readonly', width=22)
+        self.signal_filter_list.current(self.master.SIGNAL_FILTERS.index(self.master.controller.signal_filter_name))
+        self.save_unfiltered = tk.IntVar()
+        self.save_unfiltered.set(int(self.master.controller.save_unfiltered_signals))
+        self.save_unfiltered_checkbutton = tk.Checkbutton(self.additional_control_panel,
+                                                          text='Also save unfiltered signals',
+                                                          variable=self.save_unfiltered)
+        self.signals_output_label = tk.Label(self.additional_control_panel, text='Save signals as:')
+        self.signals_output_list = Combobox(self.additional_control_panel,
+                                            values=self.master.SIGNALS_OUTPUTS, state='readonly', width=22)
+        self.signals_output_list.current(self.master.SIGNALS_OUTPUTS.index(self.master.controller.signals_output))
+        self.antenna_pairs_label = tk.Label(self.additional_control_panel, text='Antenna pairs:')
+        self.antenna_pairs_entry = tk.Entry(self.additional_control_panel, width=24)
+        self.antenna_pairs_entry.insert(0, format_antenna_pairs(self.master.controller.antenna_pairs))
+        self.antenna_pairs_hint = tk.Label(self.additional_control_panel, text='TX-RX, e.g. 1-2 1-3 (blank for all)')
+
         self.threshold_label.grid(row=0, column=0, padx=5, pady=5, sticky='W')
-        self.threshold_entry.grid(row=0, column=1, padx=5, pady=5)
+        self.threshold_entry.grid(row=0, column=1, padx=5, pady=5, sticky='W')
         self.filter_label.grid(row=1, column=0, padx=5, pady=5, sticky='W')
-        self.filter_list.grid(row=1, column=1, padx=5, pady=5)
+        self.filter_list.grid(row=1, column=1, padx=5, pady=5, sticky='W')
+        self.signal_filter_label.grid(row=2, column=0, padx=5, pady=5, sticky='W')
+        self.signal_filter_list.grid(row=2, column=1, padx=5, pady=5, sticky='W')
+        self.save_unfiltered_checkbutton.grid(row=3, column=0, columnspan=2, padx=5, pady=5, sticky='W')
+        self.signals_output_label.grid(row=4, column=0, padx=5, pady=5, sticky='W')
+        self.signals_output_list.grid(row=4, column=1, padx=5, pady=5, sticky='W')
+        self.antenna_pairs_label.grid(row=5, column=0, padx=5, pady=5, sticky='W')
+        self.antenna_pairs_entry.grid(row=5, column=1, padx=5, pady=5, sticky='W')
+        self.antenna_pairs_hint.grid(row=6, column=1, padx=5, sticky='W')
+
+        # ----- Auto record control panel ----- #
+        # Settings of the automatic event detection on the image slices
+        self.auto_record_control_panel = tk.LabelFrame(self, text='Auto record', padx=40, pady=5)
+        self.auto_record_control_panel.grid(row=2, column=0, padx=5, pady=5)
+        self.event_detector_label = tk.Label(self.auto_record_control_panel, text='Event detector:')
+        self.event_detector_list = Combobox(self.auto_record_control_panel,
+                                            values=self.master.EVENT_DETECTORS, state='readonly', width=22)
+        self.event_detector_list.current(self.master.EVENT_DETECTORS.index(self.master.event_detector_name))
+        self.event_threshold_label = tk.Label(self.auto_record_control_panel, text='Start above:')
+        self.event_threshold_entry = tk.Entry(self.auto_record_control_panel, width=8)
+        self.event_threshold_entry.insert(0, self.master.event_threshold)
+        self.event_release_label = tk.Label(self.auto_record_control_panel, text='Stop below:')
+        self.event_release_entry = tk.Entry(self.auto_record_control_panel, width=8)
+        self.event_release_entry.insert(0, self.master.event_release)
+        self.event_hold_off_label = tk.Label(self.auto_record_control_panel, text='Hold-off [frames]:')
+        self.event_hold_off_entry = tk.Entry(self.auto_record_control_panel, width=8)
+        self.event_hold_off_entry.insert(0, self.master.event_hold_off)
+
+        self.event_detector_label.grid(row=0, column=0, padx=5, pady=5, sticky='W')
+        self.event_detector_list.grid(row=0, column=1, padx=5, pady=5, sticky='W')
+        self.event_threshold_label.grid(row=1, column=0, padx=5, pady=5, sticky='W')
+        self.event_threshold_entry.grid(row=1, column=1, padx=5, pady=5, sticky='W')
+        self.event_release_label.grid(row=2, column=0, padx=5, pady=5, sticky='W')
+        self.event_release_entry.grid(row=2, column=1, padx=5, pady=5, sticky='W')
+        self.event_hold_off_label.grid(row=3, column=0, padx=5, pady=5, sticky='W')
+        self.event_hold_off_entry.grid(row=3, column=1, padx=5, pady=5, sticky='W')
 
         # Change the parameter labels according to the profile selected
-        if self.master.selected_profile == self.master.PROF_SHORT_RANGE_IMAGING:
+        if self.master.controller.profile == self.master.PROF_SHORT_RANGE_IMAGING:
             # Short range imaging.
             # If the imaging profile is selected, the Walabot requires the arena to
             # be set in Cartesian coordinates.
@@ -798,13 +1199,49 @@ class WalabotSettingsWindow(tk.Toplevel):
 
         filter_type = self.filter_list.get()
 
+        try:
+            event_threshold = float(self.event_threshold_entry.get())
+            event_release = float(self.event_release_entry.get())
+            event_hold_off = int(self.event_hold_off_entry.get())
+        except ValueError:
+            messagebox.showerror('Error setting auto record', 'Invalid threshold(s) or hold-off entered.')
+            return
+        if event_release > event_threshold:
+            messagebox.showerror('Error setting auto record', 'The stop threshold must not be above the start threshold.')
+            return
+
+        try:
+            antenna_pairs = parse_antenna_pairs(self.antenna_pairs_entry.get())
+        except ValueError:
+            messagebox.showerror('Error setting antenna pairs', 'Invalid antenna pairs entered. '
+                                 'Enter TX-RX pairs separated by spaces, e.g. 1-2 1-3.')
+            return
+
+        # The acquisition and calibration threads use the Walabot and the signal filter. Stop them before
+        # asking the Walabot for its antenna pairs and changing the settings, as reconfiguring does anyway.
+        if self.master.is_walabot_connected():
+            self.master.stop_continuous_acquisition()
+            self.master.cancel_calibration()
+
+        # When connected, check the pairs against those the current profile has
+        if antenna_pairs is not None and self.master.is_walabot_connected():
+            available_pairs, walabot_error = self.master.walabot.get_antenna_pairs()
+            unknown_pairs = [pair for pair in antenna_pairs if pair not in available_pairs]
+            if not walabot_error and unknown_pairs:
+                messagebox.showerror('Error setting antenna pairs', 'The Walabot has no antenna pair(s) {}.'.format(
+                    format_antenna_pairs(unknown_pairs)))
+                return
+
         self.master.set_walabot_settings(param_1, param_2, param_3, threshold, filter_type)
+        self.master.set_antenna_pairs(antenna_pairs)
+        self.master.set_event_detection(self.event_detector_list.get(), event_threshold, event_release, event_hold_off)
+        self.master.set_signal_filter(self.signal_filter_list.get(), self.save_unfiltered.get() == 1)
+        self.master.set_signals_output(self.signals_output_list.get())
         self.close_settings_window()
 
-        # Reconnect (if connected) to Walabot to apply settings
+        # Apply the settings to the Walabot if it is connected
         if self.master.is_walabot_connected():
-            self.master.handle_walabot_disconnect()
-            self.master.handle_walabot_connect_and_setup()
+            self.master.handle_walabot_reconfigure()
 
     def handle_cancel_button(self):
         '''Also closes the settings window'''
@@ -0,0 +1,173 @@
+'''
+Event detection on the 2D image slices, for recording automatically: only frames in which something
+is going on are saved, so an unattended Walabot can run for days without filling the disk with
+empty scenes.
+
+A detector turns each slice into a score with one or two vectorised Numpy operations. An EventTrigger
+then decides when an event starts and ends, with hysteresis (an event starts when the score reaches
+the threshold but only ends once it has dropped below a lower release level) and a hold-off (the score
+has to stay below the release level for a number of frames before the event ends). Scores are on the
+scale of the slice values (0 to 255), so the same thresholds work for every detector and arena size.
+'''
+
+import numpy as np
+
+# Event detector names, as shown in the GUI and accepted on the command line
+EVENT_DETECTOR_ENERGY = 'Energy'
+EVENT_DETECTOR_PEAK = 'Peak'
+EVENT_DETECTOR_CHANGE = 'Change from baseline'
+EVENT_DETECTORS = [EVENT_DETECTOR_ENERGY, EVENT_DETECTOR_PEAK, EVENT_DETECTOR_CHANGE]
+
+# Defaults: score an event starts at, release level as a fraction of it, number of quiet frames
+# before an event ends, and weight of a new frame in the running baseline
+DEFAULT_EVENT_THRESHOLD = 50.0
+DEFAULT_RELEASE_RATIO = 0.8
+DEFAULT_HOLD_OFF = 10
+DEFAULT_BASELINE_ALPHA = 0.02
+
+class EventDetector():
+    '''Base class of the event detectors. Subclasses implement score().'''
+
+    def reset(self):
+        '''Forgets the frames seen so far, e.g. after the arena has changed.'''
+
+    def score(self, image_slice):
+        '''
+        Scores one frame.
+
+        Input:
+            image_slice: 2D Numpy array, raw image slice
+
+        Output:
+            score: float, higher when there is more going on in the frame
+        '''
+
+        raise NotImplementedError
+
+class EnergyDetector(EventDetector):
+    '''Scores the overall energy of the slice, as the root mean square of its values.'''
+
+    def score(self, image_slice):
+        values = np.asarray(image_slice, dtype=np.float64).ravel()
+        return float(np.sqrt(np.dot(values, values) / max(values.size, 1)))
+
+class PeakDetector(EventDetector):
+    '''Scores the strongest reflection in the slice, i.e. its largest value.'''
+
+    def score(self, image_slice):
+        image_slice = np.asarray(image_slice)
+        return float(image_slice.max()) if image_slice.size else 0.0
+
+class BaselineChangeDetector(EventDetector):
+    '''
+    Scores how much the slice differs from the scene as it usually looks: the mean absolute
+    difference from an exponentially weighted running average of the previous slices. The
+    baseline keeps following the scene, so a change that stays (e.g. furniture moved) stops
+    scoring after a while.
+    '''
+
+    def __init__(self, alpha=DEFAULT_BASELINE_ALPHA):
+        '''
+        Input:
+            alpha: float between 0 and 1, weight of each new frame in the baseline.
+                   Larger values follow changes in the scene faster.
+        '''
+
+        self.alpha = alpha
+        self.baseline = None
+
+    def reset(self):
+        self.baseline = None
+
+    def score(self, image_slice):
+        values = np.asarray(image_slice, dtype=np.float64)
+        if self.baseline is None or self.baseline.shape != values.shape:
+            self.baseline = values.copy()
+            return 0.0
+
+        difference = values - self.baseline
+        # baseline += alpha * (values - baseline), in place
+        self.baseline += self.alpha * difference
+        np.abs(difference, out=difference)
+
+        return float(difference.mean())
+
+def create_event_detector(name, alpha=DEFAULT_BASELINE_ALPHA):
+    '''
+    Creates an event detector by name.
+
+    Inputs:
+        name: str, one of EVENT_DETECTORS
+        alpha: float, baseline weight of new frames (change from baseline only)
+
+    Output:
+        detector: EventDetector
+    '''
+
+    if name == EVENT_DETECTOR_ENERGY:
+        return EnergyDetector()
+    if name == EVENT_DETECTOR_PEAK:
+        return PeakDetector()
+    if name == EVENT_DETECTOR_CHANGE:
+        return BaselineChangeDetector(alpha)
+
+    raise ValueError('Unknown event detector: {}'.format(name))
+
+class EventTrigger():
+    '''
+    Decides from the detector scores whether an event is going on. An event starts on the first
+    frame scoring 'threshold' or more. It ends after 'hold_off' frames in a row have scored
+    below 'release'; frames scoring between the two keep it going.
+    '''
+
+    def __init__(self, detector, threshold=DEFAULT_EVENT_THRESHOLD, release=None, hold_off=DEFAULT_HOLD_OFF):
+        '''
+        Inputs:
+            detector: EventDetector scoring the frames
+            threshold: float, score at which an event starts
+            release: float, score below which the event winds down. Defaults to DEFAULT_RELEASE_RATIO * threshold.
+            hold_off: int, number of frames in a row below 'release' before the event ends
+        '''
+
+        self.detector = detector
+        self.threshold = threshold
+        self.release = release if release is not None else DEFAULT_RELEASE_RATIO * threshold
+        self.hold_off = max(0, int(hold_off))
+        self.active = False
+        self.quiet_frames = 0   # Frames in a row below the release level during an event
+        self.last_score = 0.0
+
+    def reset(self):
+        '''Ends any event in progress and resets the detector.'''
+
+        self.active = False
+        self.quiet_frames = 0
+        self.detector.reset()
+
+    def update(self, image_slice):
+        '''
+        Scores a frame and updates the event state.
+
+        Input:
+            image_slice: 2D Numpy array, raw image slice. None (not acquired) leaves the state as it is.
+
+        Output:
+            active: bool, True if the frame is part of an event
+        '''
+
+        if image_slice is None:
+            return self.active
+
+        score = self.last_score = self.detector.score(image_slice)
+        if not self.active:
+            if score >= self.threshold:
+                self.active = True
+                self.quiet_frames = 0
+        elif score < self.release:
+            self.quiet_frames += 1
+            if self.quiet_frames > self.hold_off:
+                self.active = False
+        else:
+            self.quiet_frames = 0
+
+        return self.active
@@ -1,23 +1,66 @@
-import WalabotAPI as walabot
+import time
 import pandas as pd
 import numpy as np
+from walabot_metrics import metrics
+
+try:
+    import WalabotAPI as walabot
+except ImportError:
+    # Only the simulated backend (walabot_simulator) can be used without the vendor API
+    walabot = None
 
 class Walabot():
-    '''Interfaces with the Walabot API.'''
+    '''
+    Interfaces with the Walabot API.
+
+    Data read after a trigger is cached until the next trigger, so the preview, the savers and any
+    processing of the same trigger share one read from the API. The cached arrays are shared and
+    must not be modified in place.
+    '''
+
+    def __init__(self, api=None):
+        '''
+        Load and initialise the Walabot API.
+
+        Input:
+            api: object implementing the WalabotAPI functions (e.g. walabot_simulator.SimulatedWalabotAPI).
+                 Defaults to the vendor WalabotAPI module.
+        '''
 
-    def __init__(self):
-        '''Load and initialise the Walabot API.'''
+        if api is None:
+            if walabot is None:
+                raise ImportError('The Walabot API (WalabotAPI) is not installed. '
+                                  'Install it or use the simulated backend.')
+            api = walabot
 
-        self.walabot = walabot
+        self.walabot = api
         self.walabot.Init()
         self.walabot.Initialize()
         self.is_connected = False
+
+        # Raw signals buffer and column labels, reused until the antenna pair configuration changes
+        self.signals_buffer = None
+        self.signals_pairs_key = None
+        self.signals_headers = []
+        self.signals_time_valid = False  # The buffer's time column holds the current configuration's time vector
+
+        # Antenna pairs read on every trigger
+        self.profile = None
+        self.antenna_pairs_cache = {}         # Profile -> antenna pairs from GetAntennaPairs()
+        self.antenna_pair_selection = None    # (tx, rx) pairs to read, None for all of them
+        self.selected_antenna_pairs = None    # Antenna pair objects to read, looked up on the first trigger
+
+        # Data read from the API since the last trigger
+        self.frame_cache = {}   # Getter name -> data of the current trigger
         print('Walabot API initialised')
 
-    def connect(self):
+    def connect(self, uid=None):
         '''
         Establishes a connection with the Walabot.
 
+        Input:
+            uid: str, identifier of the Walabot to connect to when several are attached. None connects to any Walabot.
+
         Output:
             walabot_error: None if a successful connection was made. Otherwise, the API error is returned.
         '''
@@ -25,9 +68,15 @@ class Walabot():
         walabot_error = None
         try:
             print('Connecting to the Walabot...')
-            self.walabot.ConnectAny()
+            if uid is None:
+                self.walabot.ConnectAny()
+            else:
+                self.walabot.Connect(uid)
             print('Connected to the Walabot!')
             self.is_connected = True
+            # Another Walabot may have been connected, with other antenna pairs
+            self.antenna_pairs_cache = {}
+            self.selected_antenna_pairs = None
         except self.walabot.WalabotError:
             print('Failed to connect to the Walabot!')
             walabot_error = self.walabot.GetErrorString()
@@ -43,10 +92,11 @@ class Walabot():
         '''
 
         walabot_error = None
+        self.frame_cache = {}
         try:
             print('Disconnecting from the Walabot...')
-            walabot.Stop()
-            walabot.Disconnect()
+            self.walabot.Stop()
+            self.walabot.Disconnect()
             print('Disconnected from the Walabot!')
             self.is_connected = False
         except self.walabot.WalabotError:
@@ -56,9 +106,37 @@ class Walabot():
         return walabot_error
 
     def start(self):
-        '''Starts the Walabot'''
+        '''
+        Starts the Walabot.
+
+        Output:
+            walabot_error: None if the Walabot was started. Otherwise, the API error is returned.
+        '''
+
+        walabot_error = None
+        try:
+            self.walabot.Start()
+        except self.walabot.WalabotError:
+            walabot_error = self.walabot.GetErrorString()
 
-        self.walabot.Start()
+        return walabot_error
+
+    def stop(self):
+        '''
+        Stops the Walabot without disconnecting, so that the profile and arena can be changed.
+
+        Output:
+            walabot_error: None if the Walabot was stopped. Otherwise, the API error is returned.
+        '''
+
+        walabot_error = None
+        self.frame_cache = {}
+        try:
+            self.walabot.Stop()
+        except self.walabot.WalabotError:
+            walabot_error = self.walabot.GetErrorString()
+
+        return walabot_error
 
     def set_profile(self, profile):
         '''
@@ -72,6 +150,9 @@ class Walabot():
         '''
 
         walabot_error = None
+        self.frame_cache = {}
+        self.profile = profile
+        self.selected_antenna_pairs = None
         try:
             self.walabot.SetProfile(profile)
         except self.walabot.WalabotError:
@@ -88,39 +169,208 @@ class Walabot():
         '''
 
         walabot_error = None
+        self.frame_cache = {}
         try:
-            self.walabot.Trigger()
+            with metrics.timer('walabot.trigger'):
+                self.walabot.Trigger()
         except self.walabot.WalabotError:
             walabot_error = self.walabot.GetErrorString()
 
         return walabot_error
 
-    def calibrate(self):
+    def get_cached(self, name, fetch):
+        '''
+        Returns the current trigger's result of the getter 'name', calling 'fetch' only if it has
+        not been read since the trigger. Errors are not cached, so a failed read can be retried.
+
+        Inputs:
+            name: str, name of the getter
+            fetch: callable returning (data, walabot_error)
         '''
-        Runs the built-in calibration function.
+
+        if name in self.frame_cache:
+            return self.frame_cache[name], None
+
+        data, walabot_error = fetch()
+        if not walabot_error:
+            self.frame_cache[name] = data
+
+        return data, walabot_error
+
+    def calibrate(self, progress_callback=None, cancel_event=None, timeout=None):
+        '''
+        Runs the built-in calibration function. According to the API doc, the Walabot requires
+        manual triggers to facilitate calibration, so this triggers until the calibration is done.
+        Can be run on a worker thread.
+
+        Inputs:
+            progress_callback: callable taking the calibration progress (0 to 100), called once per trigger
+            cancel_event: threading.Event, calibration stops early when it is set
+            timeout: float, seconds after which calibration is abandoned. None waits until it is done.
 
         Output:
-            walabot_error: None if calibration started successfully. Otherwise the API error is returned.
+            walabot_error: None if calibration finished. Otherwise the API error, or why calibration stopped early.
         '''
 
-        walabot_error = None
         try:
             self.walabot.StartCalibration()
         except self.walabot.WalabotError:
-            walabot_error = self.walabot.GetErrorString()
+            return self.walabot.GetErrorString()
 
-        # According to the API doc, the Walabot requires manual triggers to facilitate calibration.
-        while self.walabot.GetStatus()[0] == self.walabot.STATUS_CALIBRATING:
-            print('Calibrating: {}%'.format(self.walabot.GetStatus()[1]))
-            trigger_error = self.trigger()
-            if trigger_error:
+        walabot_error = None
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            try:
+                status, progress = self.walabot.GetStatus()
+            except self.walabot.WalabotError:
+                walabot_error = self.walabot.GetErrorString()
+                break
+            if status != self.walabot.STATUS_CALIBRATING:
+                break
+
+            if progress_callback is not None:
+                progress_callback(progress)
+            else:
+                print('Calibrating: {}%'.format(progress))
+
+            if cancel_event is not None and cancel_event.is_set():
+                walabot_error = 'Calibration cancelled'
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                walabot_error = 'Calibration timed out after {} s'.format(timeout)
+                break
+
+            walabot_error = self.trigger()
+            if walabot_error:
                 break
 
         return walabot_error
 
+    def set_antenna_pair_selection(self, antenna_pairs):
+        '''
+        Selects the antenna pairs whose raw signals are read on every trigger. Pairs that the
+        current profile does not have are ignored.
+
+        Input:
+            antenna_pairs: list of (tx, rx) antenna numbers, or None to read every pair
+        '''
+
+        self.antenna_pair_selection = list(antenna_pairs) if antenna_pairs is not None else None
+        self.selected_antenna_pairs = None
+        self.frame_cache = {}
+
+    def get_antenna_pairs(self):
+        '''
+        Returns every antenna pair of the current profile, whether selected or not.
+        The pairs are only requested from the API once per profile.
+
+        Outputs:
+            antenna_pairs: list of (tx, rx) antenna numbers
+            walabot_error: None if no error occurred. Otherwise returns the API error.
+        '''
+
+        walabot_error = None
+        antenna_pairs = []
+        try:
+            antenna_pairs = [(pair.txAntenna, pair.rxAntenna) for pair in self.get_all_antenna_pairs()]
+        except self.walabot.WalabotError:
+            walabot_error = self.walabot.GetErrorString()
+
+        return antenna_pairs, walabot_error
+
+    def get_all_antenna_pairs(self):
+        '''Returns the antenna pair objects of the current profile, from the API on first use. Raises WalabotError.'''
+
+        antenna_pairs = self.antenna_pairs_cache.get(self.profile)
+        if antenna_pairs is None:
+            antenna_pairs = self.antenna_pairs_cache[self.profile] = self.walabot.GetAntennaPairs()
+
+        return antenna_pairs
+
+    def get_selected_antenna_pairs(self):
+        '''
+        Returns the antenna pair objects read on every trigger: the selected ones in the order
+        of GetAntennaPairs(), or all of them. Raises WalabotError.
+        '''
+
+        if self.selected_antenna_pairs is None:
+            antenna_pairs = self.get_all_antenna_pairs()
+            if self.antenna_pair_selection is not None:
+                selection = set(self.antenna_pair_selection)
+                antenna_pairs = [pair for pair in antenna_pairs if (pair.txAntenna, pair.rxAntenna) in selection]
+            self.selected_antenna_pairs = antenna_pairs
+            self.signals_time_valid = False
+
+        return self.selected_antenna_pairs
+
+    def get_signals_headers(self, antenna_pairs):
+        '''
+        Returns the column labels for the raw signals matrix. The labels are only rebuilt
+        when the antenna pair configuration changes (e.g. after changing profile).
+
+        Input:
+            antenna_pairs: list of antenna pairs as returned by GetAntennaPairs()
+
+        Output:
+            headers: list of column labels, 'time' followed by 'tx=<n> rx=<m>' for each pair.
+        '''
+
+        pairs_key = tuple((pair.txAntenna, pair.rxAntenna) for pair in antenna_pairs)
+        if pairs_key != self.signals_pairs_key:
+            self.signals_pairs_key = pairs_key
+            self.signals_headers = ['time'] + ['tx={} rx={}'.format(tx, rx) for tx, rx in pairs_key]
+
+        return self.signals_headers
+
+    def get_raw_signals_array(self):
+        '''
+        Fast path for the raw signals. Fills a preallocated Numpy array which is reused across triggers,
+        so the returned array is only valid until the next trigger. Copy it if it needs to be kept.
+        Run a Trigger() command before getting the raw signals.
+
+        Outputs:
+            signals_np: NxM Numpy array where N is the number of samples and M is the time vector + number of antenna pairs.
+            headers: list of M column labels (time followed by the antenna pairs).
+            walabot_error: None if no error occurred. Otherwise returns the API error.
+        '''
+
+        if 'raw_signals_array' in self.frame_cache:
+            signals_np, headers = self.frame_cache['raw_signals_array']
+            return signals_np, headers, None
+
+        walabot_error = None
+        signals_np = np.empty((0, 0))
+        headers = []
+        try:
+            with metrics.timer('walabot.get_signals'):
+                antenna_pairs = self.get_selected_antenna_pairs()
+                if not antenna_pairs:
+                    return signals_np, headers, 'None of the selected antenna pairs are available with this profile'
+                headers = self.get_signals_headers(antenna_pairs)
+                for index, pair in enumerate(antenna_pairs):
+                    signal, time_vector = self.walabot.GetSignal(pair)
+                    if index == 0:
+                        # All the pairs share the same time vector, which only changes with the configuration.
+                        # The number of samples is only known now, so (re)allocate the buffer if it changed.
+                        shape = (len(time_vector), len(headers))
+                        if self.signals_buffer is None or self.signals_buffer.shape != shape:
+                            self.signals_buffer = np.empty(shape)
+                            self.signals_time_valid = False
+                        if not self.signals_time_valid:
+                            self.signals_buffer[:, 0] = time_vector
+                            self.signals_time_valid = True
+                    self.signals_buffer[:, index + 1] = signal
+            signals_np = self.signals_buffer
+            metrics.count_bytes('walabot.get_signals', signals_np.nbytes)
+            self.frame_cache['raw_signals_array'] = (signals_np, headers)
+        except self.walabot.WalabotError:
+            walabot_error = self.walabot.GetErrorString()
+
+        return signals_np, headers, walabot_error
+
     def get_raw_signals(self):
         '''
-        Returns all the raw signals from the available antenna pairs.
+        Returns the raw signals of the selected antenna pairs (all of them unless set_antenna_pair_selection() was called).
         Rows are the pairs' amplitude at the particular time instance and columns are the time vector followed by the antenna pairs.
         Run a Trigger() command before getting the raw signals.
         For more information, refer to the Walabot API functions GetAntennaPairs() and GetSignal().
@@ -129,33 +379,18 @@ class Walabot():
             signals_pd: raw signals as an NxM Pandas DataFrame where N is the number of samples and M is the time vector + number of antenna pairs.
             walabot_error: None if no error occurred. Otherwise returns the API error.
         '''
-        signals_pd = pd.DataFrame()
-        walabot_error = None
-        antenna_pairs = self.walabot.GetAntennaPairs()
 
-        try:
-            # This bit could do with some optimisation, perhaps allocating a matrix instead of appending to a list.
-            # The data is stored row-wise at the momenet, we will transpose it later to make it column-wise.
-            headers = ['time']
-            signals = []
-
-            # Save the time vector. Since all the pairs will have the
-            # same time vector it does not matter whuch pair we grab it from.
-            _, time = walabot.GetSignal(antenna_pairs[0])
-            signals.append(time)
-
-            # Save the antenna pair signal vectors
-            for pair in range(len(antenna_pairs)):
-                headers.append('tx={} rx={}'.format(antenna_pairs[pair].txAntenna, antenna_pairs[pair].rxAntenna))
-                signal, _ = walabot.GetSignal(antenna_pairs[pair])
-                signals.append(signal) # Matrix of the time vector and all antenna pair signals
-
-            # Transpose so that columns are time, pair 1 signal, pair 2 signal, ..., pair n signal and
-            # rows are the time ticks/pair's received signal amplitude
-            signals_pd = pd.DataFrame(signals, index=headers) # Index not column labels because we transpose
-            signals_pd = signals_pd.transpose()
-        except self.walabot.WalabotError:
-            walabot_error = self.walabot.GetErrorString()
+        return self.get_cached('raw_signals', self.fetch_raw_signals)
+
+    def fetch_raw_signals(self):
+        '''Reads the raw signals into a new DataFrame (see get_raw_signals()).'''
+
+        signals_pd = pd.DataFrame()
+        signals_np, headers, walabot_error = self.get_raw_signals_array()
+        if not walabot_error:
+            # The DataFrame is a view on a copy of the buffer so that it stays valid after the next trigger.
+            with metrics.timer('signals.dataframe'):
+                signals_pd = pd.DataFrame(signals_np.copy(), columns=headers, copy=False)
 
         return signals_pd, walabot_error
 
@@ -174,6 +409,8 @@ class Walabot():
             walabot_error: Nothing if arena was set successfully. Otherwise, the API error is returned.
         '''
         walabot_error = None
+        self.frame_cache = {}
+        self.signals_time_valid = False
         try:
             self.walabot.SetArenaX(*x)
             self.walabot.SetArenaY(*y)
@@ -201,6 +438,8 @@ class Walabot():
         '''
 
         walabot_error = None
+        self.frame_cache = {}
+        self.signals_time_valid = False
         try:
             self.walabot.SetArenaR(*r)
             self.walabot.SetArenaTheta(*theta)
@@ -212,6 +451,67 @@ class Walabot():
 
         return walabot_error
 
+    def set_arena_axes(self, axes):
+        '''
+        Sets some of the arena axes, leaving the others as they are. The Walabot must be stopped.
+
+        Input:
+            axes: list of (axis, param) pairs, axis being the API name ('X', 'Y', 'Z', 'R', 'Theta' or 'Phi')
+                  and param a 1x3 tuple (min, max, step)
+
+        Output:
+            walabot_error: None if the axes were set successfully. Otherwise, the API error is returned.
+        '''
+
+        walabot_error = None
+        self.frame_cache = {}
+        self.signals_time_valid = False
+        try:
+            for axis, param in axes:
+                getattr(self.walabot, 'SetArena' + axis)(*param)
+        except self.walabot.WalabotError:
+            walabot_error = self.walabot.GetErrorString()
+
+        return walabot_error
+
+    def set_threshold(self, threshold):
+        '''
+        Sets the image threshold. Can be changed while the Walabot is running.
+
+        Input:
+            threshold: double, between 0.1 and 100
+
+        Output:
+            walabot_error: None if the threshold was set successfully. Otherwise, the API error is returned.
+        '''
+
+        walabot_error = None
+        try:
+            self.walabot.SetThreshold(threshold)
+        except self.walabot.WalabotError:
+            walabot_error = self.walabot.GetErrorString()
+
+        return walabot_error
+
+    def set_filter_type(self, filter_type):
+        '''
+        Sets the dynamic image filter. Can be changed while the Walabot is running.
+
+        Input:
+            filter_type: integer, refer to Walabot API for filter constants
+
+        Output:
+            walabot_error: None if the filter was set successfully. Otherwise, the API error is returned.
+        '''
+
+        walabot_error = None
+        try:
+            self.walabot.SetDynamicImageFilter(filter_type)
+        except self.walabot.WalabotError:
+            walabot_error = self.walabot.GetErrorString()
+
+        return walabot_error
+
     def get_raw_image_slice(self):
         '''
         Returns a 2D image slice as defined by the arena parameters,
@@ -223,11 +523,20 @@ class Walabot():
             walabot_error: None if 2D image captured successfully. Otherwise returns the API error.
         '''
 
+        return self.get_cached('raw_image_slice', self.fetch_raw_image_slice)
+
+    def fetch_raw_image_slice(self):
+        '''Reads a 2D image slice from the API (see get_raw_image_slice()).'''
+
         walabot_error = None
         image_slice_np = np.array([])
         try:
-            image_slice, _, _, _, _ = self.walabot.GetRawImageSlice()
-            image_slice_np = np.transpose(np.array(image_slice)) # Row, column
+            with metrics.timer('walabot.get_raw_image_slice'):
+                image_slice, _, _, _, _ = self.walabot.GetRawImageSlice()
+            with metrics.timer('image_slice.transpose'):
+                image_slice_np = np.transpose(np.array(image_slice)) # Row, column
+            image_slice_np.flags.writeable = False  # Shared by every consumer of this trigger
+            metrics.count_bytes('walabot.get_raw_image_slice', image_slice_np.nbytes)
         except self.walabot.WalabotError:
             walabot_error = self.walabot.GetErrorString()
 
@@ -262,12 +571,21 @@ class Walabot():
             walabot_error: None if 3D image captured successfully. Otherwise returns the API error.
         '''
 
+        return self.get_cached('raw_image', self.fetch_raw_image)
+
+    def fetch_raw_image(self):
+        '''Reads a 3D image from the API (see get_raw_image()).'''
+
         walabot_error = None
         image_np = np.array([])
         try:
-            image, _, _, _, _ = self.walabot.GetRawImage()
-            image_np = np.array(image)
-            image_np = np.fliplr(np.transpose(image_np, (2, 0, 1))) # Transpose (row, column, depth) and flip
+            with metrics.timer('walabot.get_raw_image'):
+                image, _, _, _, _ = self.walabot.GetRawImage()
+            with metrics.timer('image.reorient'):
+                image_np = np.array(image)
+                image_np = np.fliplr(np.transpose(image_np, (2, 0, 1))) # Transpose (row, column, depth) and flip
+            image_np.flags.writeable = False  # Shared by every consumer of this trigger
+            metrics.count_bytes('walabot.get_raw_image', image_np.nbytes)
         except self.walabot.WalabotError:
             walabot_error = self.walabot.GetErrorString()
 
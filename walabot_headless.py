@@ -0,0 +1,304 @@
+'''
+Captures data from a Walabot without a GUI, for unattended or scripted recording (e.g. on a
+server with no display). Uses the same device and save logic as the GUI (walabot_capture).
+
+The acquisition engine triggers as fast as the Walabot allows while the main thread hands every
+frame over to the writer pool. Nothing is dropped: if saving falls behind, triggering waits.
+With --auto-record, only the frames around events detected in the image slices are saved
+(see walabot_event_detector and walabot_pretrigger).
+
+Usage:
+    python walabot_headless.py --profile SHORT_RANGE_IMAGING --frames 1000 --data-types im_2d im_3d --output data/run1
+    python walabot_headless.py --simulate --duration 60 --output data/run2 --format CSV
+    python walabot_headless.py --auto-record "Change from baseline" --event-threshold 10 --data-types im_2d signals
+'''
+
+from queue import Empty
+import argparse
+import os
+import sys
+import time
+from os.path import dirname
+from walabot_hardware import Walabot
+from walabot_acquisition_engine import AcquisitionEngine
+from walabot_pretrigger import PreTriggerRecorder
+from walabot_event_detector import EventTrigger, create_event_detector, EVENT_DETECTORS, DEFAULT_EVENT_THRESHOLD, \
+    DEFAULT_HOLD_OFF
+from walabot_capture import CaptureController, add_backend_arguments, create_walabot, parse_antenna_pair, PROFILES, \
+    FILTER_TYPES, SAVE_FORMATS, FORMAT_SESSION
+from walabot_storage import SIGNALS, IMAGE_SLICE, IMAGE
+from walabot_metrics import add_metrics_arguments, start_metrics, finish_metrics
+from walabot_signal_filters import SIGNAL_FILTERS, SIGNAL_FILTER_NONE, DEFAULT_BACKGROUND_ALPHA, DEFAULT_MTI_WINDOW
+from walabot_range_profiles import SIGNALS_OUTPUTS, SIGNALS_OUTPUT_SAMPLES, DEFAULT_DECIMATION
+
+DATA_TYPES = [SIGNALS, IMAGE_SLICE, IMAGE]
+
+# How often progress is printed (frames)
+PROGRESS_INTERVAL = 100
+
+def add_capture_arguments(parser):
+    '''Adds the Walabot configuration and capture length options to an argparse parser.'''
+
+    parser.add_argument('--profile', choices=list(PROFILES), default='SHORT_RANGE_IMAGING', help='scan profile')
+    parser.add_argument('--param-1', type=float, nargs=3, metavar=('MIN', 'MAX', 'RES'),
+                        help='arena X [cm] (imaging) or R [cm] (sensor). Defaults to the profile default.')
+    parser.add_argument('--param-2', type=float, nargs=3, metavar=('MIN', 'MAX', 'RES'),
+                        help='arena Y [cm] (imaging) or theta [deg] (sensor)')
+    parser.add_argument('--param-3', type=float, nargs=3, metavar=('MIN', 'MAX', 'RES'),
+                        help='arena Z [cm] (imaging) or phi [deg] (sensor)')
+    parser.add_argument('--threshold', type=float, help='image threshold, between 0.1 and 100')
+    parser.add_argument('--filter', choices=list(FILTER_TYPES), help='dynamic image filter')
+    parser.add_argument('--antenna-pairs', nargs='+', type=parse_antenna_pair, metavar='TX-RX',
+                        help='only read and save the raw signals of these antenna pairs (default: all)')
+    parser.add_argument('--signal-filter', choices=SIGNAL_FILTERS, default=SIGNAL_FILTER_NONE,
+                        help='software clutter filter applied to the raw signals before saving')
+    parser.add_argument('--signal-filter-alpha', type=float, default=DEFAULT_BACKGROUND_ALPHA, metavar='ALPHA',
+                        help='weight of each new frame in the background (background subtraction)')
+    parser.add_argument('--signal-filter-window', type=int, default=DEFAULT_MTI_WINDOW, metavar='FRAMES',
+                        help='number of frames averaged (moving average MTI)')
+    parser.add_argument('--save-unfiltered', action='store_true',
+                        help='with a signal filter, save the unfiltered raw signals as well')
+    parser.add_argument('--signals-output', choices=SIGNALS_OUTPUTS, default=SIGNALS_OUTPUT_SAMPLES,
+                        help='save the raw signals as samples, as range profiles, or both')
+    parser.add_argument('--max-range', type=float, default=None, metavar='METRES',
+                        help='largest range kept in the range profiles (default: the whole signal)')
+    parser.add_argument('--range-decimation', type=int, default=DEFAULT_DECIMATION, metavar='SAMPLES',
+                        help='number of signal samples per range profile bin')
+    parser.add_argument('--calibrate', action='store_true', help='calibrate before capturing')
+    parser.add_argument('--calibration-timeout', type=float, default=60.0, metavar='SECONDS',
+                        help='give up calibrating after this long')
+    parser.add_argument('--frames', type=int, default=0, help='number of frames to capture (0 for no limit)')
+    parser.add_argument('--duration', type=float, default=None, metavar='SECONDS', help='stop after this long')
+    parser.add_argument('--data-types', nargs='+', choices=DATA_TYPES, default=[IMAGE_SLICE],
+                        help='capture types to save per frame')
+    parser.add_argument('--queue-size', type=int, default=16,
+                        help='frames buffered between the acquisition thread and the writers')
+
+def add_auto_record_arguments(parser):
+    '''Adds the automatic event recording options to an argparse parser.'''
+
+    parser.add_argument('--auto-record', choices=EVENT_DETECTORS, metavar='DETECTOR',
+                        help='only save the frames around events detected in the image slices, with this '
+                             'detector ({})'.format(', '.join(EVENT_DETECTORS)))
+    parser.add_argument('--event-threshold', type=float, default=DEFAULT_EVENT_THRESHOLD,
+                        help='detector score at which an event starts')
+    parser.add_argument('--event-release', type=float, default=None,
+                        help='detector score below which an event winds down (default: 0.8 x threshold)')
+    parser.add_argument('--event-hold-off', type=int, default=DEFAULT_HOLD_OFF, metavar='FRAMES',
+                        help='number of frames in a row below the release score before an event ends')
+    parser.add_argument('--pre-event-frames', type=int, default=50, metavar='FRAMES',
+                        help='number of frames saved from before each event')
+    parser.add_argument('--post-event-frames', type=int, default=50, metavar='FRAMES',
+                        help='number of frames saved after each event')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Acquire and save data from a Walabot without a GUI.')
+    add_capture_arguments(parser)
+    parser.add_argument('--output', default='capture', metavar='PREFIX',
+                        help='save file prefix, may include a directory (e.g. data/run1)')
+    parser.add_argument('--format', choices=SAVE_FORMATS, default=FORMAT_SESSION, help='save format')
+    parser.add_argument('--capture-no', type=int, default=None,
+                        help='number of the first capture (default: carry on after the last capture saved with the prefix)')
+    add_auto_record_arguments(parser)
+    add_backend_arguments(parser)
+    add_metrics_arguments(parser)
+    return parser.parse_args()
+
+def configure_controller(controller, args):
+    '''Applies the profile, arena, threshold, filter and antenna pair options from add_capture_arguments() to a CaptureController.'''
+
+    controller.set_profile(args.profile)
+    param_1, param_2, param_3, threshold, filter_type = controller.get_walabot_settings()
+    controller.set_walabot_settings(tuple(args.param_1) if args.param_1 else param_1,
+                                    tuple(args.param_2) if args.param_2 else param_2,
+                                    tuple(args.param_3) if args.param_3 else param_3,
+                                    args.threshold if args.threshold is not None else threshold,
+                                    FILTER_TYPES[args.filter] if args.filter else filter_type)
+    controller.set_antenna_pairs(args.antenna_pairs)
+    controller.set_signal_filter(args.signal_filter, args.save_unfiltered, args.signal_filter_alpha,
+                                 args.signal_filter_window)
+    controller.set_signals_output(args.signals_output, args.max_range, args.range_decimation)
+
+def report_writer_results(writer_pool):
+    '''Prints the save jobs that failed since the last call and returns how many there were.'''
+
+    num_errors = 0
+    for description, error in writer_pool.get_results():
+        if error:
+            print('Error saving {}: {}'.format(description, error))
+            num_errors += 1
+
+    return num_errors
+
+def run_capture(controller, data_types, num_frames=0, duration=None, queue_size=16):
+    '''
+    Acquires frames continuously and saves every one of them.
+
+    Inputs:
+        controller: CaptureController with a connected and started Walabot
+        data_types: list of capture types to save per frame
+        num_frames: int, number of frames to capture. 0 runs until 'duration' is up or Ctrl+C is pressed.
+        duration: float, seconds to capture for. None has no time limit.
+        queue_size: int, frames buffered between the acquisition thread and the writers
+
+    Outputs:
+        num_saved: int, number of frames handed over to the writers
+        num_errors: int, number of save jobs that failed
+        walabot_error: None if no error occurred. Otherwise returns the error message.
+    '''
+
+    engine = AcquisitionEngine(controller.walabot, data_types, max_frames=num_frames)
+    frame_queue = engine.subscribe(maxsize=queue_size, drop_oldest=False)
+    deadline = time.monotonic() + duration if duration else None
+    # Frame timestamps are taken from the performance counter, convert them to wall clock time
+    clock_offset = time.time() - time.perf_counter()
+
+    num_saved = 0
+    num_errors = 0
+    walabot_error = None
+    start = time.monotonic()
+    engine.start()
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            try:
+                frame = frame_queue.get(timeout=0.1)
+            except Empty:
+                # The engine only stops after publishing its last frame, so an empty queue means it is done
+                if not engine.is_running() and frame_queue.empty():
+                    break
+                continue
+
+            if frame.walabot_error:
+                walabot_error = frame.walabot_error
+                break
+
+            controller.save_captures(frame.data, {'timestamp': frame.timestamp + clock_offset})
+            num_saved += 1
+            if num_saved % PROGRESS_INTERVAL == 0:
+                num_errors += report_writer_results(controller.writer_pool)
+                elapsed = time.monotonic() - start
+                print('{} frames in {:.1f} s ({:.1f} frames/s), {} pending writes'.format(
+                    num_saved, elapsed, num_saved / elapsed, controller.writer_pool.get_queue_depth()))
+    except KeyboardInterrupt:
+        print('Interrupted, finishing the frames already acquired')
+    finally:
+        engine.stop()
+
+    # Save what was acquired before the engine stopped
+    while walabot_error is None and not frame_queue.empty():
+        frame = frame_queue.get_nowait()
+        if frame.walabot_error:
+            walabot_error = frame.walabot_error
+        else:
+            controller.save_captures(frame.data, {'timestamp': frame.timestamp + clock_offset})
+            num_saved += 1
+
+    num_errors += report_writer_results(controller.writer_pool)
+    return num_saved, num_errors, walabot_error
+
+def run_auto_record(controller, data_types, event_trigger, pre_frames, post_frames, num_frames=0, duration=None,
+                    queue_size=16):
+    '''
+    Acquires frames continuously and only saves those around the events found by 'event_trigger'.
+
+    Inputs:
+        controller: CaptureController with a connected and started Walabot
+        data_types: list of capture types to save per frame
+        event_trigger: EventTrigger deciding from the image slices when events start and end
+        pre_frames: int, number of frames saved from before each event
+        post_frames: int, number of frames saved after each event
+        num_frames: int, number of frames to acquire. 0 runs until 'duration' is up or Ctrl+C is pressed.
+        duration: float, seconds to capture for. None has no time limit.
+        queue_size: int, frames buffered between the acquisition thread and the recorder
+
+    Outputs:
+        num_saved: int, number of frames handed over to the writers
+        num_errors: int, number of save jobs that failed
+        walabot_error: None if no error occurred. Otherwise returns the error message.
+    '''
+
+    # The image slices are needed for detection even if they are not saved
+    engine = AcquisitionEngine(controller.walabot, set(data_types) | {IMAGE_SLICE}, max_frames=num_frames)
+    recorder = PreTriggerRecorder(engine, controller, data_types, pre_frames, post_frames, queue_size, event_trigger)
+    deadline = time.monotonic() + duration if duration else None
+
+    num_errors = 0
+    num_events = 0
+    recorder.start()
+    engine.start()
+    try:
+        while engine.is_running() and (deadline is None or time.monotonic() < deadline):
+            time.sleep(0.1)
+            if recorder.event_count != num_events:
+                num_events = recorder.event_count
+                num_errors += report_writer_results(controller.writer_pool)
+                print('{} event(s), {} frames saved from {} acquired'.format(
+                    num_events, recorder.saved_frames, engine.frame_count))
+    except KeyboardInterrupt:
+        print('Interrupted, finishing the event being saved')
+    finally:
+        engine.stop()
+        recorder.stop()
+
+    num_errors += report_writer_results(controller.writer_pool)
+    print('{} event(s) in {} frames'.format(recorder.event_count, engine.frame_count))
+    return recorder.saved_frames, num_errors, recorder.walabot_error
+
+def main():
+    args = parse_args()
+    start_metrics(args)
+
+    walabot = create_walabot(args)
+    if walabot is None:
+        walabot = Walabot()
+
+    controller = CaptureController(walabot)
+    configure_controller(controller, args)
+    controller.prefix = args.output
+    controller.save_format = args.format
+    os.makedirs(dirname(args.output) or '.', exist_ok=True)
+    if args.capture_no is not None:
+        controller.capture_no = args.capture_no
+    else:
+        print('Starting at capture {}'.format(controller.resume_capture_no()))
+
+    stage, walabot_error = controller.connect_and_setup()
+    if walabot_error:
+        print('{}: Walabot API error: {}'.format(stage, walabot_error))
+        sys.exit(1)
+
+    if args.calibrate:
+        print('Calibrating')
+        walabot_error = walabot.calibrate(timeout=args.calibration_timeout)
+        if walabot_error:
+            print('Calibrate error: Walabot API error: {}'.format(walabot_error))
+            walabot.disconnect()
+            sys.exit(1)
+
+    start = time.monotonic()
+    if args.auto_record:
+        event_trigger = EventTrigger(create_event_detector(args.auto_record), args.event_threshold,
+                                     args.event_release, args.event_hold_off)
+        num_saved, num_errors, walabot_error = run_auto_record(controller, args.data_types, event_trigger,
+                                                               args.pre_event_frames, args.post_event_frames,
+                                                               args.frames, args.duration, args.queue_size)
+    else:
+        num_saved, num_errors, walabot_error = run_capture(controller, args.data_types, args.frames,
+                                                           args.duration, args.queue_size)
+    walabot.disconnect()
+
+    # Wait for the writers to finish before reporting
+    controller.shutdown()
+    num_errors += report_writer_results(controller.writer_pool)
+    elapsed = time.monotonic() - start
+    print('Saved {} frames in {:.1f} s ({:.1f} frames/s) to {}'.format(
+        num_saved, elapsed, num_saved / max(elapsed, 1e-9), args.output))
+    finish_metrics(args)
+
+    if walabot_error:
+        print('Acquisition error: Walabot API error: {}'.format(walabot_error))
+    if walabot_error or num_errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
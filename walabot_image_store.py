@@ -0,0 +1,269 @@
+from os.path import basename, exists, getsize
+import glob
+import json
+import re
+import struct
+import numpy as np
+from walabot_metrics import metrics
+
+# ----- Fixed-record image store ----- #
+# The file starts with IMAGE_STORE_MAGIC, the length of the header and a UTF-8 JSON header
+# holding the image dtype, shape and (optionally) the arena axes. The records start at the next
+# multiple of RECORD_ALIGNMENT bytes. Every record has the same size: the capture number, the
+# timestamp and the image itself, so frame N lives at a known offset and can be memory-mapped.
+IMAGE_STORE_EXTENSION = '.wbi'
+IMAGE_STORE_MAGIC = b'WBIMG001'
+HEADER_PREFIX = struct.Struct('<8sI')
+RECORD_PREFIX = struct.Struct('<qd')  # Capture number and timestamp, as in record_dtype()
+RECORD_ALIGNMENT = 64
+
+def image_store_file_name(prefix, index=0):
+    '''
+    Returns the name of a 3D image store of 'prefix'. Every store holds the images of one arena
+    configuration: the first one is [prefix]_im_3d.wbi, and the stores started after the arena
+    has changed are [prefix]_im_3d_1.wbi, [prefix]_im_3d_2.wbi, and so on.
+
+    Inputs:
+        prefix: str, save file prefix
+        index: int, number of the store (0 for the first one)
+    '''
+
+    if index:
+        return '{}_im_3d_{}{}'.format(prefix, index, IMAGE_STORE_EXTENSION)
+
+    return prefix + '_im_3d' + IMAGE_STORE_EXTENSION
+
+def list_image_stores(prefix):
+    '''Returns (index, file name) of every existing 3D image store of 'prefix', in the order they were started.'''
+
+    pattern = re.compile(re.escape(basename(prefix)) + r'_im_3d(?:_(\d+))?' + re.escape(IMAGE_STORE_EXTENSION) + '$')
+    stores = []
+    for file_name in glob.glob(glob.escape(prefix) + '_im_3d*' + IMAGE_STORE_EXTENSION):
+        match = pattern.match(basename(file_name))
+        if match:
+            stores.append((int(match.group(1) or 0), file_name))
+
+    return sorted(stores)
+
+def image_store_file_names(prefix):
+    '''Returns the existing 3D image stores of 'prefix', in the order they were started.'''
+
+    return [file_name for _, file_name in list_image_stores(prefix)]
+
+def find_image_store(prefix, names, axes):
+    '''
+    Returns the 3D image store of 'prefix' to save images with the given arena axes to: the store
+    already holding images with these axes, or else the name of a new store.
+
+    Inputs:
+        prefix: str, save file prefix
+        names: list of axis names
+        axes: list of 1D Numpy arrays, one per name
+    '''
+
+    stores = list_image_stores(prefix)
+    for _, file_name in stores:
+        if getsize(file_name) == 0:
+            # Nothing has been written to it yet
+            return file_name
+        with open(file_name, 'rb') as infile:
+            header, _ = read_header(infile)
+        stored_axes = header.get('axes')
+        if stored_axes is not None and stored_axes['names'] == list(names) and \
+           len(stored_axes['values']) == len(axes) and \
+           all(np.array_equal(np.asarray(stored), np.asarray(axis)) for stored, axis in zip(stored_axes['values'], axes)):
+            return file_name
+
+    return image_store_file_name(prefix, stores[-1][0] + 1 if stores else 0)
+
+def record_dtype(dtype, shape):
+    '''Returns the structured Numpy dtype of one record for images of the given dtype and shape.'''
+
+    return np.dtype([('capture_no', '<i8'), ('timestamp', '<f8'), ('image', np.dtype(dtype), tuple(shape))])
+
+def read_header(file):
+    '''
+    Reads the header of an image store.
+
+    Outputs:
+        header: dict with 'dtype', 'shape' and 'axes'
+        data_offset: int, offset of the first record
+    '''
+
+    magic, header_length = HEADER_PREFIX.unpack(file.read(HEADER_PREFIX.size))
+    if magic != IMAGE_STORE_MAGIC:
+        raise ValueError('{} is not a Walabot image store'.format(file.name))
+    header = json.loads(file.read(header_length).decode('utf-8'))
+    data_offset = -(-(HEADER_PREFIX.size + header_length) // RECORD_ALIGNMENT) * RECORD_ALIGNMENT
+
+    return header, data_offset
+
+class ImageStoreWriter():
+    '''
+    Appends fixed-size 3D image records to an image store. The image shape, dtype and axes are
+    fixed by the first image written (or by the existing file when appending to it), so images
+    of another arena configuration go to another store (see find_image_store()).
+    '''
+
+    def __init__(self, file_name):
+        '''
+        Input:
+            file_name: str, image store to create or append to
+        '''
+
+        self.file_name = file_name
+        self.file = None
+        self.dtype = None
+        self.capture_nos = set()
+        self.on_frame_written = None  # Called with (capture_no, image offset) for every image written
+
+        if exists(file_name) and getsize(file_name) > 0:
+            with open(file_name, 'rb') as infile:
+                header, self.data_offset = read_header(infile)
+            self.dtype = record_dtype(header['dtype'], header['shape'])
+            num_records = (getsize(file_name) - self.data_offset) // self.dtype.itemsize
+            if num_records:
+                records = np.memmap(file_name, dtype=self.dtype, mode='r',
+                                    offset=self.data_offset, shape=(num_records,))
+                self.capture_nos = set(records['capture_no'].tolist())
+                del records
+
+            # Drop a partially written record, if any
+            self.file = open(file_name, 'r+b')
+            self.file.truncate(self.data_offset + num_records * self.dtype.itemsize)
+            self.file.seek(0, 2)
+
+    def create(self, image, axes=None):
+        '''Creates the file and writes the header using the first image's dtype and shape.'''
+
+        header = {'dtype': image.dtype.str, 'shape': list(image.shape)}
+        if axes is not None:
+            names, values = axes
+            header['axes'] = {'names': list(names), 'values': [np.asarray(axis).tolist() for axis in values]}
+        header_bytes = json.dumps(header).encode('utf-8')
+
+        self.dtype = record_dtype(image.dtype, image.shape)
+        self.data_offset = -(-(HEADER_PREFIX.size + len(header_bytes)) // RECORD_ALIGNMENT) * RECORD_ALIGNMENT
+        self.file = open(self.file_name, 'wb')
+        self.file.write(HEADER_PREFIX.pack(IMAGE_STORE_MAGIC, len(header_bytes)))
+        self.file.write(header_bytes)
+        self.file.write(b'\0' * (self.data_offset - self.file.tell()))
+
+    def has_capture(self, capture_no):
+        '''Returns True if the store already holds an image for 'capture_no'.'''
+
+        return capture_no in self.capture_nos
+
+    def append(self, capture_no, image, timestamp=0.0, axes=None):
+        '''
+        Appends one 3D image. The image is written as is, without any reformatting.
+
+        Inputs:
+            capture_no: int, capture number
+            image: 3D Numpy array
+            timestamp: float, time of the capture
+            axes: (names, axes) tuple stored in the header when the store is created
+        '''
+
+        image = np.asarray(image)
+        if self.file is None:
+            self.create(image, axes)
+
+        image_dtype, image_shape = self.dtype['image'].base, self.dtype['image'].shape
+        if image.shape != image_shape:
+            raise ValueError('Image shape {} does not match the image store shape {}. '
+                             'Use a new file prefix after changing the arena.'.format(image.shape, image_shape))
+
+        image_offset = self.file.tell() + RECORD_PREFIX.size
+        with metrics.timer('save.image_store'):
+            self.file.write(RECORD_PREFIX.pack(capture_no, timestamp))
+            self.file.write(np.ascontiguousarray(image, dtype=image_dtype).data)
+        metrics.count_bytes('save.image_store', RECORD_PREFIX.size + image.nbytes)
+        self.capture_nos.add(capture_no)
+        if self.on_frame_written is not None:
+            self.on_frame_written(capture_no, image_offset)
+
+    def flush(self):
+        '''Flushes buffered records to disk.'''
+
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        '''Closes the image store.'''
+
+        if self.file is not None and not self.file.closed:
+            self.file.close()
+
+class ImageStoreReader():
+    '''
+    Memory-maps an image store. Frames are returned as zero-copy views, so analysis code can
+    get frame N of a long recording without reading the rest of it.
+    '''
+
+    def __init__(self, file_name):
+        '''
+        Input:
+            file_name: str, image store to read
+        '''
+
+        self.file_name = file_name
+        with open(file_name, 'rb') as infile:
+            self.header, self.data_offset = read_header(infile)
+        self.dtype = record_dtype(self.header['dtype'], self.header['shape'])
+        self.records = None
+        self.refresh()
+
+    def refresh(self):
+        '''Re-maps the file so that records appended since it was opened become visible.'''
+
+        num_records = (getsize(self.file_name) - self.data_offset) // self.dtype.itemsize
+        if num_records > 0:
+            self.records = np.memmap(self.file_name, dtype=self.dtype, mode='r',
+                                     offset=self.data_offset, shape=(num_records,))
+        else:
+            self.records = np.empty((0,), dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return self.records['image'][index]
+
+    @property
+    def shape(self):
+        '''Shape of a single image.'''
+
+        return tuple(self.header['shape'])
+
+    @property
+    def capture_nos(self):
+        '''Capture numbers of every record (memory-mapped).'''
+
+        return self.records['capture_no']
+
+    @property
+    def timestamps(self):
+        '''Timestamps of every record (memory-mapped).'''
+
+        return self.records['timestamp']
+
+    def get_axes(self):
+        '''
+        Returns the arena axes stored in the header.
+
+        Outputs:
+            names: list of axis names (empty if no axes were stored)
+            axes: list of 1D Numpy arrays
+        '''
+
+        axes = self.header.get('axes')
+        if axes is None:
+            return [], []
+
+        return axes['names'], [np.array(values) for values in axes['values']]
+
+    def close(self):
+        '''Releases the memory map.'''
+
+        self.records = None
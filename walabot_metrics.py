@@ -0,0 +1,281 @@
+'''
+Lightweight instrumentation of the capture cycle: how long each stage takes (triggering, reading
+from the API, building DataFrames, reorienting images, rendering the preview, saving) and how many
+bytes go through it.
+
+Stages are timed with the monotonic performance counter and collected into fixed-size histograms in
+memory, so that measuring costs the same whether a run lasts a minute or a week. The histograms can
+be written to a JSON file or served on a local HTTP endpoint (JSON, or the Prometheus text format for
+scraping).
+
+Instrumentation is off by default. While it is off, timer() returns a shared object that does
+nothing and count_bytes() returns straight away, so the instrumented code runs at full speed.
+
+Usage:
+    from walabot_metrics import metrics
+
+    with metrics.timer('walabot.trigger'):
+        api.Trigger()
+    metrics.count_bytes('save.session', len(payload))
+'''
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+# Upper bounds of the histogram buckets [s]: 1 us to 100 s, four buckets per decade.
+# Durations above the last bound go into an overflow bucket.
+BUCKET_BOUNDS = [round(10.0 ** (exponent / 4.0), 12) for exponent in range(-24, 9)]
+
+class Histogram():
+    '''Distribution of the durations of one stage, in fixed log-spaced buckets.'''
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.minimum = float('inf')
+        self.maximum = 0.0
+
+    def add(self, value):
+        '''Adds a duration [s].'''
+
+        self.bucket_counts[bisect_left(BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def percentile(self, fraction):
+        '''
+        Estimates a percentile from the buckets.
+
+        Input:
+            fraction: float between 0 and 1 (e.g. 0.99 for the 99th percentile)
+
+        Output:
+            value: float, upper bound of the bucket holding the percentile, capped at the largest duration seen
+        '''
+
+        if not self.count:
+            return 0.0
+
+        target = fraction * self.count
+        running = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            running += bucket_count
+            if running >= target and bucket_count:
+                bound = BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.maximum
+                return min(bound, self.maximum)
+
+        return self.maximum
+
+    def to_dict(self):
+        '''Returns the histogram's summary statistics and non-empty buckets.'''
+
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'min': self.minimum if self.count else 0.0,
+            'max': self.maximum,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'buckets': {repr(BUCKET_BOUNDS[index]) if index < len(BUCKET_BOUNDS) else 'inf': bucket_count
+                        for index, bucket_count in enumerate(self.bucket_counts) if bucket_count}
+        }
+
+class Timer():
+    '''Context manager timing one run of a stage.'''
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record_time(self.name, time.perf_counter() - self.start)
+        return False
+
+class NullTimer():
+    '''Stand-in for Timer while instrumentation is off.'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_TIMER = NullTimer()
+
+class Metrics():
+    '''Collects stage timings and byte counts. Safe to use from any thread.'''
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.timings = {}     # Stage name -> Histogram
+        self.byte_counts = {} # Stage name -> [number of events, number of bytes]
+
+    def enable(self):
+        '''Starts collecting.'''
+
+        self.enabled = True
+
+    def disable(self):
+        '''Stops collecting. What has been collected so far is kept.'''
+
+        self.enabled = False
+
+    def reset(self):
+        '''Forgets everything collected so far.'''
+
+        with self.lock:
+            self.started = time.time()
+            self.timings = {}
+            self.byte_counts = {}
+
+    def timer(self, name):
+        '''Returns a context manager timing the stage 'name' (a shared no-op one while disabled).'''
+
+        if not self.enabled:
+            return NULL_TIMER
+
+        return Timer(self, name)
+
+    def record_time(self, name, seconds):
+        '''Adds a duration [s] to the histogram of the stage 'name'.'''
+
+        if not self.enabled:
+            return
+
+        with self.lock:
+            histogram = self.timings.get(name)
+            if histogram is None:
+                histogram = self.timings[name] = Histogram()
+            histogram.add(seconds)
+
+    def count_bytes(self, name, nbytes):
+        '''Adds 'nbytes' to the byte counter of the stage 'name'.'''
+
+        if not self.enabled:
+            return
+
+        with self.lock:
+            counter = self.byte_counts.setdefault(name, [0, 0])
+            counter[0] += 1
+            counter[1] += int(nbytes)
+
+    def snapshot(self):
+        '''Returns everything collected so far as a JSON-serialisable dict.'''
+
+        with self.lock:
+            return {
+                'started': self.started,
+                'elapsed': time.time() - self.started,
+                'timings': {name: histogram.to_dict() for name, histogram in sorted(self.timings.items())},
+                'bytes': {name: {'count': counter[0], 'bytes': counter[1]}
+                          for name, counter in sorted(self.byte_counts.items())}
+            }
+
+    def export_json(self, file_name):
+        '''Writes snapshot() to a JSON file.'''
+
+        with open(file_name, 'w') as outfile:
+            json.dump(self.snapshot(), outfile, indent=2)
+
+    def to_prometheus(self):
+        '''Returns everything collected so far in the Prometheus text exposition format.'''
+
+        lines = []
+        with self.lock:
+            for name, histogram in sorted(self.timings.items()):
+                metric = 'walabot_{}_seconds'.format(name.replace('.', '_'))
+                lines.append('# TYPE {} histogram'.format(metric))
+                running = 0
+                for index, bound in enumerate(BUCKET_BOUNDS):
+                    running += histogram.bucket_counts[index]
+                    lines.append('{}_bucket{{le="{!r}"}} {}'.format(metric, bound, running))
+                lines.append('{}_bucket{{le="+Inf"}} {}'.format(metric, histogram.count))
+                lines.append('{}_sum {!r}'.format(metric, histogram.total))
+                lines.append('{}_count {}'.format(metric, histogram.count))
+            for name, (count, nbytes) in sorted(self.byte_counts.items()):
+                metric = 'walabot_{}_bytes_total'.format(name.replace('.', '_'))
+                lines.append('# TYPE {} counter'.format(metric))
+                lines.append('{} {}'.format(metric, nbytes))
+
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        '''
+        Serves the metrics over HTTP on a background thread: /metrics in the Prometheus text format
+        and /metrics.json as JSON.
+
+        Inputs:
+            port: int, port to listen on (0 picks a free one)
+            host: str, address to listen on. Defaults to the local machine only.
+
+        Output:
+            server: the HTTP server. Call server.shutdown() to stop it.
+        '''
+
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = metrics.to_prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(metrics.snapshot()), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='walabot-metrics', daemon=True).start()
+        return server
+
+# The instance used by the rest of the application
+metrics = Metrics()
+
+def add_metrics_arguments(parser):
+    '''Adds the instrumentation options to an argparse parser.'''
+
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='time the capture stages and write the histograms to this JSON file on exit')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help='time the capture stages and serve the histograms on http://127.0.0.1:PORT/metrics')
+
+def start_metrics(args):
+    '''Enables instrumentation if asked for by the options from add_metrics_arguments(), and starts the endpoint.'''
+
+    if args.metrics or args.metrics_port is not None:
+        metrics.enable()
+    if args.metrics_port is not None:
+        server = metrics.serve(args.metrics_port)
+        print('Serving metrics on http://127.0.0.1:{}/metrics'.format(server.server_address[1]))
+
+def finish_metrics(args):
+    '''Writes the metrics file asked for by the options from add_metrics_arguments().'''
+
+    if args.metrics:
+        metrics.export_json(args.metrics)
+        print('Metrics written to {}'.format(args.metrics))
@@ -0,0 +1,463 @@
+'''
+Captures from several Walabots at once into one binary session, e.g. for rigs with sensors placed
+around one scene.
+
+The Walabot API drives one device per process, so every Walabot gets its own worker process with its
+own acquisition engine. The workers never share an interpreter, so triggering and fetching data on
+one device is never held up by the others (or by saving). Each worker sends its frames to a
+coordinator in the main process, which groups frames from the different devices by timestamp and
+writes each group under one capture number.
+
+Frame timestamps are taken with time.perf_counter() straight after the trigger. The performance
+counter is system-wide (CLOCK_MONOTONIC on Linux, QueryPerformanceCounter on Windows,
+mach_absolute_time on macOS), so timestamps taken in different processes on the same host can be
+compared directly. time.monotonic() is not used: on Windows before Python 3.13 it only advances in
+steps of about 16 ms, which is coarser than the skew between devices.
+
+Every device uses the same profile and arena.
+
+Usage:
+    python walabot_multi_device.py --devices UID1 UID2 UID3 --frames 1000 --data-types im_2d --output data/rig1
+    python walabot_multi_device.py --simulate --num-devices 3 --duration 60 --output data/rig2
+'''
+
+from collections import deque
+from queue import Empty, Full
+import argparse
+import copy
+from functools import partial
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from os.path import dirname
+from walabot_hardware import Walabot
+from walabot_acquisition_engine import AcquisitionEngine
+from walabot_capture import CaptureController, add_backend_arguments, create_walabot, \
+    FORMAT_SESSION, FORMAT_COMPRESSED_SESSION, COMPRESSION_CHUNK_SIZE
+from walabot_headless import add_capture_arguments, configure_controller, PROGRESS_INTERVAL
+from walabot_storage import SessionWriter, session_file_name, SIGNALS, IMAGE_SLICE, IMAGE
+from walabot_metrics import metrics, add_metrics_arguments, start_metrics, finish_metrics
+
+# Messages sent from the device workers to the coordinator: (kind, device, payload)
+MESSAGE_READY = 'ready'   # Connected and set up, payload is the error (None if all went well)
+MESSAGE_FRAME = 'frame'   # Payload is an acquisition engine Frame
+MESSAGE_DONE = 'done'     # The worker has stopped acquiring, payload is None
+
+def put_message(message_queue, message, stop_event):
+    '''
+    Sends a message to the coordinator, waiting for room in the queue.
+
+    Output:
+        sent: bool, False if the coordinator asked the workers to stop before there was room
+    '''
+
+    while True:
+        try:
+            message_queue.put(message, timeout=0.1)
+            return True
+        except Full:
+            if stop_event.is_set():
+                return False
+
+def run_device(device, uid, args, seed, message_queue, start_event, stop_event):
+    '''
+    Device worker process: connects to one Walabot, waits for every other device to be ready,
+    then acquires frames and sends them to the coordinator until told to stop.
+
+    Inputs:
+        device: str, name of the device in the session (e.g. 'dev0')
+        uid: str, Walabot to connect to. None connects to any Walabot (simulated or replayed devices).
+        args: parsed command-line arguments
+        seed: int, seed of a simulated Walabot
+        message_queue: multiprocessing queue to the coordinator
+        start_event, stop_event: multiprocessing events set by the coordinator
+    '''
+
+    # Ctrl+C reaches every process in the terminal, the coordinator decides when the workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if args.metrics:
+        metrics.enable()
+
+    walabot = create_walabot(args, seed=seed)
+    if walabot is None:
+        walabot = Walabot()
+
+    controller = CaptureController(walabot)
+    configure_controller(controller, args)
+    controller.device_uid = uid
+
+    stage, walabot_error = controller.connect_and_setup()
+    if walabot_error:
+        walabot_error = '{}: {}'.format(stage, walabot_error)
+    elif args.calibrate:
+        walabot_error = walabot.calibrate(timeout=args.calibration_timeout)
+    put_message(message_queue, (MESSAGE_READY, device, walabot_error), stop_event)
+
+    if not walabot_error:
+        # Start all the devices together, so that their first frames line up
+        while not start_event.wait(0.1) and not stop_event.is_set():
+            pass
+        if not stop_event.is_set():
+            acquire_frames(device, walabot, args, message_queue, stop_event)
+
+    if walabot.is_connected:
+        walabot.disconnect()
+    if args.metrics:
+        metrics.export_json(device_metrics_file_name(args.metrics, device))
+    put_message(message_queue, (MESSAGE_DONE, device, None), stop_event)
+
+def device_metrics_file_name(file_name, device):
+    '''Returns the name of a device worker's metrics file: the coordinator's file name with the device name added.'''
+
+    base, extension = os.path.splitext(file_name)
+    return '{}_{}{}'.format(base, device, extension)
+
+def acquire_frames(device, walabot, args, message_queue, stop_event):
+    '''Runs an acquisition engine and forwards every frame to the coordinator. Runs in a device worker.'''
+
+    engine = AcquisitionEngine(walabot, args.data_types, max_frames=args.frames)
+    frame_queue = engine.subscribe(maxsize=args.queue_size, drop_oldest=False)
+    engine.start()
+    while not stop_event.is_set():
+        try:
+            frame = frame_queue.get(timeout=0.1)
+        except Empty:
+            if not engine.is_running() and frame_queue.empty():
+                break
+            continue
+
+        if not put_message(message_queue, (MESSAGE_FRAME, device, frame), stop_event) or frame.walabot_error:
+            break
+    engine.stop()
+
+class FrameAligner():
+    '''
+    Groups frames from several devices by timestamp.
+
+    A group starts at the earliest frame waiting and takes the earliest waiting frame of every
+    device within the allowed skew of it. Groups are only formed once every device still
+    acquiring has a frame waiting, so a frame that belongs in a group is never left out because
+    it arrived late. Devices without a frame close enough are left out of the group.
+
+    The devices are free-running, so by default the allowed skew is half the frame interval of the
+    fastest device: every frame is then grouped with the nearest frame of each of the other devices.
+    '''
+
+    def __init__(self, devices, max_skew=None):
+        '''
+        Inputs:
+            devices: list of device names
+            max_skew: float, largest difference in seconds between the timestamps of the frames of a group.
+                      None follows the measured frame interval.
+        '''
+
+        self.max_skew = max_skew
+        self.pending = {device: deque() for device in devices}  # Device -> frames waiting, oldest first
+        self.acquiring = set(devices)                           # Devices that may still send frames
+        self.last_timestamps = {}                               # Device -> timestamp of its last frame
+        self.intervals = {}                                     # Device -> smoothed frame interval
+
+    def add(self, device, frame):
+        '''Adds a frame received from a device.'''
+
+        last_timestamp = self.last_timestamps.get(device)
+        if last_timestamp is not None:
+            interval = frame.timestamp - last_timestamp
+            self.intervals[device] = 0.9 * self.intervals.get(device, interval) + 0.1 * interval
+        self.last_timestamps[device] = frame.timestamp
+        self.pending[device].append(frame)
+
+    def get_max_skew(self):
+        '''Returns the largest difference in seconds allowed between the timestamps of the frames of a group.'''
+
+        if self.max_skew is not None:
+            return self.max_skew
+        if not self.intervals:
+            # The devices were started together, so their first frames belong together
+            return float('inf')
+
+        return 0.5 * min(self.intervals.values())
+
+    def finish(self, device):
+        '''Marks a device as done, so that the remaining groups are formed without waiting for it.'''
+
+        self.acquiring.discard(device)
+
+    def pop_groups(self):
+        '''
+        Returns the groups that are complete.
+
+        Output:
+            groups: list of dicts of device -> Frame, in timestamp order
+        '''
+
+        groups = []
+        max_skew = self.get_max_skew()
+        while any(self.pending.values()) and all(self.pending[device] for device in self.acquiring):
+            start = min(frames[0].timestamp for frames in self.pending.values() if frames)
+            groups.append({device: frames.popleft() for device, frames in self.pending.items()
+                           if frames and frames[0].timestamp - start <= max_skew})
+
+        return groups
+
+class SessionCoordinator():
+    '''
+    Receives the frames from the device workers, aligns them and writes them to one binary session.
+    Every frame is stored under its group's capture number with its device name, its timestamp on
+    the shared clock and its offset from the first frame of the group.
+    '''
+
+    def __init__(self, devices, uids, controller, max_skew=None, compress=False):
+        '''
+        Inputs:
+            devices: list of device names
+            uids: dict of device name -> Walabot uid (or None)
+            controller: CaptureController holding the shared configuration, save prefix and first capture number
+            max_skew: float, largest timestamp difference in seconds between frames saved under one capture number.
+                      None allows half the frame interval.
+            compress: bool, write a compressed session
+        '''
+
+        self.devices = devices
+        self.uids = uids
+        self.controller = controller
+        self.aligner = FrameAligner(devices, max_skew)
+        # Every device has its own scene, so each gets its own copy of the signal filter
+        self.signal_filters = {device: copy.deepcopy(controller.signal_filter) for device in devices}
+        self.writer = SessionWriter(session_file_name(controller.prefix),
+                                    chunk_size=COMPRESSION_CHUNK_SIZE if compress else 0)
+        # The frames are added to the capture catalog as they are written
+        self.writer.on_frame_written = partial(controller.capture_written, controller.prefix)
+
+        # Maps the shared performance counter to wall-clock time
+        self.clock_start = time.perf_counter()
+        self.wall_clock_start = time.time()
+
+        # Statistics
+        self.num_groups = 0
+        self.num_incomplete = 0  # Groups missing at least one device
+        self.frame_counts = {device: 0 for device in devices}
+        self.max_observed_skew = 0.0
+
+    def add_frame(self, device, frame):
+        '''Adds a frame from a device worker and writes the groups it completes.'''
+
+        self.aligner.add(device, frame)
+        self.frame_counts[device] += 1
+        self.write_groups(self.aligner.pop_groups())
+
+    def finish_device(self, device):
+        '''Called once a device has stopped, writes the groups that were waiting on it.'''
+
+        self.aligner.finish(device)
+        self.write_groups(self.aligner.pop_groups())
+
+    def write_frame(self, capture_no, capture_type, capture, metadata):
+        '''Writes one device's capture to the session. It is added to the capture catalog once it has been written.'''
+
+        self.controller.add_pending_capture(self.controller.prefix, capture_no, capture_type, self.writer.file_name, metadata)
+        self.writer.write_frame(capture_no, capture_type, capture, metadata)
+
+    def write_groups(self, groups):
+        '''Writes aligned groups of frames to the session, one capture number per group.'''
+
+        if not groups:
+            return
+
+        geometry = self.controller.get_geometry()
+        metadata = self.controller.get_frame_metadata()
+        for group in groups:
+            capture_no = self.controller.capture_no
+            start = min(frame.timestamp for frame in group.values())
+            for device in self.devices:
+                frame = group.get(device)
+                if frame is None:
+                    continue
+                skew = frame.timestamp - start
+                self.max_observed_skew = max(self.max_observed_skew, skew)
+                metadata.update({
+                    'device': device,
+                    'uid': self.uids[device],
+                    'seq': frame.seq,
+                    'timestamp': self.wall_clock_start + frame.timestamp - self.clock_start,
+                    'clock': frame.timestamp - self.clock_start,
+                    'skew': skew
+                })
+                if SIGNALS in frame.data:
+                    signals_captures = self.controller.process_signals(frame.data[SIGNALS], self.signal_filters[device])
+                    for capture_type, capture in signals_captures.items():
+                        self.write_frame(capture_no, capture_type, capture, metadata)
+                for capture_type in (IMAGE_SLICE, IMAGE):
+                    if capture_type in frame.data:
+                        self.writer.write_axes(geometry.names, geometry.axes)
+                        self.write_frame(capture_no, capture_type, frame.data[capture_type], metadata)
+
+            if len(group) < len(self.devices):
+                self.num_incomplete += 1
+            self.num_groups += 1
+            self.controller.capture_no += 1
+
+        self.writer.flush()
+
+    def close(self):
+        '''Writes any frames still waiting and closes the session.'''
+
+        for device in self.devices:
+            self.aligner.finish(device)
+        self.write_groups(self.aligner.pop_groups())
+        self.writer.close()
+
+def run_coordinator(coordinator, message_queue, processes, start_event, stop_event, duration=None):
+    '''
+    Waits for every device to be ready, starts them together and saves their frames until they have
+    all stopped, 'duration' is up or Ctrl+C is pressed.
+
+    Outputs:
+        walabot_errors: dict of device -> error message, for the devices that failed
+    '''
+
+    walabot_errors = {}
+    ready = set()
+    done = set()
+    deadline = None
+    start = None
+    next_report = PROGRESS_INTERVAL
+    try:
+        while len(done) < len(processes):
+            if deadline is not None and time.monotonic() >= deadline:
+                stop_event.set()
+            try:
+                kind, device, payload = message_queue.get(timeout=0.1)
+            except Empty:
+                # A worker that crashed never says it is done
+                for name, process in processes.items():
+                    if name not in done and not process.is_alive():
+                        walabot_errors.setdefault(name, 'The device worker exited unexpectedly')
+                        done.add(name)
+                        coordinator.finish_device(name)
+                continue
+
+            if kind == MESSAGE_READY:
+                ready.add(device)
+                if payload:
+                    walabot_errors[device] = payload
+                    stop_event.set()
+                elif len(ready) == len(processes) and not stop_event.is_set():
+                    print('All {} devices ready, acquiring'.format(len(processes)))
+                    start = time.monotonic()
+                    deadline = start + duration if duration else None
+                    start_event.set()
+            elif kind == MESSAGE_FRAME:
+                if payload.walabot_error:
+                    walabot_errors[device] = payload.walabot_error
+                    continue
+                coordinator.add_frame(device, payload)
+                if coordinator.num_groups >= next_report:
+                    elapsed = time.monotonic() - start
+                    print('{} captures in {:.1f} s ({:.1f} captures/s), {} missing a device'.format(
+                        coordinator.num_groups, elapsed, coordinator.num_groups / elapsed, coordinator.num_incomplete))
+                    next_report += PROGRESS_INTERVAL
+            elif kind == MESSAGE_DONE:
+                done.add(device)
+                coordinator.finish_device(device)
+    except KeyboardInterrupt:
+        print('Interrupted, saving the frames already acquired')
+        stop_event.set()
+        # The workers send what they have left and stop
+        while len(done) < len(processes):
+            try:
+                kind, device, payload = message_queue.get(timeout=1.0)
+            except Empty:
+                break
+            if kind == MESSAGE_FRAME and not payload.walabot_error:
+                coordinator.add_frame(device, payload)
+            elif kind == MESSAGE_DONE:
+                done.add(device)
+
+    return walabot_errors
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Acquire from several Walabots into one session.')
+    parser.add_argument('--devices', nargs='+', metavar='UID', help='uids of the Walabots to capture from')
+    parser.add_argument('--num-devices', type=int, default=2,
+                        help='number of devices to simulate or replay (with --simulate or --replay)')
+    add_capture_arguments(parser)
+    parser.add_argument('--output', default='capture', metavar='PREFIX',
+                        help='session file prefix, may include a directory (e.g. data/rig1)')
+    parser.add_argument('--format', choices=[FORMAT_SESSION, FORMAT_COMPRESSED_SESSION], default=FORMAT_SESSION,
+                        help='save format')
+    parser.add_argument('--capture-no', type=int, default=None,
+                        help='number of the first capture (default: carry on after the last capture saved with the prefix)')
+    parser.add_argument('--max-skew', type=float, default=None, metavar='SECONDS',
+                        help='largest timestamp difference between the frames saved under one capture number '
+                             '(default: half the frame interval)')
+    add_backend_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    if not args.devices and not (args.simulate or args.replay):
+        parser.error('--devices is required unless --simulate or --replay is used')
+
+    return args
+
+def main():
+    args = parse_args()
+    start_metrics(args)
+
+    if args.devices and not (args.simulate or args.replay):
+        uids = list(args.devices)
+    else:
+        uids = [None] * args.num_devices
+    devices = ['dev{}'.format(index) for index in range(len(uids))]
+
+    controller = CaptureController(None)
+    configure_controller(controller, args)
+    controller.prefix = args.output
+    os.makedirs(dirname(args.output) or '.', exist_ok=True)
+    if args.capture_no is not None:
+        controller.capture_no = args.capture_no
+    else:
+        print('Starting at capture {}'.format(controller.resume_capture_no()))
+
+    # Spawned rather than forked, so that no device library state or threads are inherited
+    context = multiprocessing.get_context('spawn')
+    message_queue = context.Queue(maxsize=args.queue_size * len(devices))
+    start_event = context.Event()
+    stop_event = context.Event()
+    processes = {}
+    for index, (device, uid) in enumerate(zip(devices, uids)):
+        process = context.Process(target=run_device, name='walabot-{}'.format(device),
+                                  args=(device, uid, args, index, message_queue, start_event, stop_event))
+        process.start()
+        processes[device] = process
+
+    coordinator = SessionCoordinator(devices, dict(zip(devices, uids)), controller, args.max_skew,
+                                     compress=args.format == FORMAT_COMPRESSED_SESSION)
+    start = time.monotonic()
+    walabot_errors = run_coordinator(coordinator, message_queue, processes, start_event, stop_event, args.duration)
+    coordinator.close()
+    controller.shutdown()
+
+    stop_event.set()
+    for process in processes.values():
+        process.join(5)
+        if process.is_alive():
+            process.terminate()
+
+    elapsed = time.monotonic() - start
+    print('Saved {} captures in {:.1f} s to {} ({} missing a device, largest skew {:.1f} ms)'.format(
+        coordinator.num_groups, elapsed, coordinator.writer.file_name, coordinator.num_incomplete,
+        coordinator.max_observed_skew * 1000))
+    for device in devices:
+        print('  {}: {} frames'.format(device, coordinator.frame_counts[device]))
+    finish_metrics(args)
+
+    for device, walabot_error in sorted(walabot_errors.items()):
+        print('{}: Walabot API error: {}'.format(device, walabot_error))
+    if walabot_errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+'''
+Pre-trigger recording: the most recent frames of continuous acquisition are kept in memory, so that
+when something happens the frames leading up to it can be saved along with the ones that follow.
+
+The frames are copied into arrays allocated once per data type (capacity x frame shape), so the
+memory used stays the same however long acquisition runs. When an event is signalled (trigger_event(),
+e.g. from a hotkey), the buffered frames and the next 'post_frames' frames are saved on a background
+thread through the CaptureController, while acquisition carries on. Events can also be detected
+automatically from the image slices with an EventTrigger (see walabot_event_detector).
+
+Usage:
+    recorder = PreTriggerRecorder(engine, controller, [IMAGE_SLICE], pre_frames=50, post_frames=50)
+    recorder.start()
+    ...
+    recorder.trigger_event()
+'''
+
+from queue import Queue, Empty
+import threading
+import time
+import numpy as np
+from walabot_acquisition_engine import Frame, IMAGE_SLICE
+from walabot_metrics import metrics
+
+class FrameRingBuffer():
+    '''
+    Fixed-size buffer of the most recent frames. Each data type is kept in one preallocated
+    array with a slot per frame. The arrays are allocated on the first frame (when the shapes
+    are known) and again only if a data type's shape changes, e.g. after changing the arena.
+    '''
+
+    def __init__(self, capacity, data_types):
+        '''
+        Inputs:
+            capacity: int, number of frames kept. 0 keeps none.
+            data_types: iterable of capture types to keep from each frame
+        '''
+
+        self.capacity = max(0, int(capacity))
+        self.data_types = frozenset(data_types)
+        self.seqs = np.zeros(self.capacity, dtype=np.int64)
+        self.timestamps = np.zeros(self.capacity)
+        self.slots = {}      # Capture type -> capacity x shape array
+        self.columns = {}    # Capture type -> DataFrame column labels (raw signals only)
+        self.present = {}    # Capture type -> capacity bool array, True where the slot holds data
+        self.position = 0    # Slot the next frame goes into
+        self.count = 0       # Number of frames held
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        '''Forgets the frames held. The arrays are kept for reuse.'''
+
+        self.position = 0
+        self.count = 0
+
+    def set_data_types(self, data_types):
+        '''Changes the data types kept. Buffered frames are forgotten if the types change.'''
+
+        data_types = frozenset(data_types)
+        if data_types != self.data_types:
+            self.data_types = data_types
+            self.slots = {capture_type: slot for capture_type, slot in self.slots.items() if capture_type in data_types}
+            self.clear()
+
+    def allocate(self, capture_type, values):
+        '''(Re)allocates the slots of 'capture_type' for frames shaped like 'values'. Clears the buffer.'''
+
+        self.slots[capture_type] = np.empty((self.capacity,) + values.shape, dtype=values.dtype)
+        self.present[capture_type] = np.zeros(self.capacity, dtype=bool)
+        self.clear()
+
+    def add(self, frame):
+        '''Copies a frame into the buffer, overwriting the oldest one if the buffer is full.'''
+
+        if not self.capacity:
+            return
+
+        for capture_type in self.data_types:
+            data = frame.get(capture_type)
+            if data is None:
+                continue
+            if hasattr(data, 'columns'):
+                columns = list(data.columns)
+                values = data.to_numpy()
+                if self.columns.get(capture_type) != columns:
+                    self.columns[capture_type] = columns
+                    self.slots.pop(capture_type, None)
+            else:
+                values = np.asarray(data)
+            slot = self.slots.get(capture_type)
+            if slot is None or slot.shape[1:] != values.shape or slot.dtype != values.dtype:
+                self.allocate(capture_type, values)
+
+        position = self.position
+        self.seqs[position] = frame.seq
+        self.timestamps[position] = frame.timestamp
+        for capture_type, slot in self.slots.items():
+            data = frame.get(capture_type)
+            self.present[capture_type][position] = data is not None
+            if data is not None:
+                slot[position] = data.to_numpy() if hasattr(data, 'columns') else data
+
+        self.position = (position + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def drain(self):
+        '''
+        Takes the buffered frames out of the buffer, oldest first. The data is copied out of the
+        slots, so the frames stay valid while the buffer is refilled.
+
+        Output:
+            frames: list of Frame
+        '''
+
+        import pandas as pd
+
+        frames = []
+        start = (self.position - self.count) % self.capacity if self.capacity else 0
+        for index in range(self.count):
+            position = (start + index) % self.capacity
+            frame = Frame(int(self.seqs[position]), float(self.timestamps[position]))
+            for capture_type, slot in self.slots.items():
+                if not self.present[capture_type][position]:
+                    continue
+                if capture_type in self.columns:
+                    frame.data[capture_type] = pd.DataFrame(slot[position].copy(), columns=self.columns[capture_type],
+                                                            copy=False)
+                else:
+                    frame.data[capture_type] = slot[position].copy()
+            frames.append(frame)
+
+        self.clear()
+        return frames
+
+class PreTriggerRecorder():
+    '''
+    Keeps the last 'pre_frames' frames of an AcquisitionEngine in a FrameRingBuffer and saves
+    them, together with the following 'post_frames' frames, whenever an event is signalled.
+    An event signalled while the frames after the previous one are still being collected
+    extends the recording instead of starting a new one.
+
+    With an EventTrigger, every frame during which the trigger is active signals an event, so
+    recording starts with the frames from before the event and stops 'post_frames' frames after
+    it has ended. The engine must then acquire the image slices.
+
+    Frames are read from the engine by a worker thread and saved by another, so neither the
+    preview nor acquisition waits for the disk. The recorder subscribes without dropping frames,
+    so the frames saved for an event are always consecutive.
+    '''
+
+    def __init__(self, engine, controller, data_types, pre_frames, post_frames, queue_size=16, event_trigger=None):
+        '''
+        Inputs:
+            engine: AcquisitionEngine the frames come from
+            controller: CaptureController the frames are saved with
+            data_types: iterable of capture types to keep and save
+            pre_frames: int, number of frames kept from before an event
+            post_frames: int, number of frames saved after an event
+            queue_size: int, frames buffered between the engine and the recorder
+            event_trigger: EventTrigger detecting events from the image slices, or None to only
+                           record the events signalled with trigger_event()
+        '''
+
+        self.engine = engine
+        self.controller = controller
+        self.event_trigger = event_trigger
+        self.post_frames = max(0, int(post_frames))
+        self.ring_buffer = FrameRingBuffer(pre_frames, data_types)
+        self.buffer_lock = threading.Lock()
+
+        self.frame_queue = engine.subscribe(maxsize=queue_size, drop_oldest=False)
+        self.save_queue = Queue()      # Lists of (captures, metadata) waiting to be saved, None to finish
+        self.event_requested = threading.Event()
+        self.stop_event = threading.Event()
+        self.threads = []
+
+        self.event_count = 0           # Number of events recorded so far
+        self.post_remaining = 0        # Frames still to be saved after the current event
+        self.event_offset = 0          # Position of the next frame relative to the current event
+        self.saved_frames = 0          # Number of frames handed over to the controller so far
+        self.walabot_error = None      # First error reported by the engine, if any
+
+    def start(self):
+        '''Starts the threads reading and saving frames.'''
+
+        self.stop_event.clear()
+        self.threads = [threading.Thread(target=self.run, name='walabot-pretrigger', daemon=True),
+                        threading.Thread(target=self.run_saver, name='walabot-pretrigger-saver', daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self, timeout=None):
+        '''
+        Stops reading frames and waits for the frames of the last event to be saved. Frames
+        still to come after the last event are not waited for.
+
+        Input:
+            timeout: float, seconds to wait for each thread (None waits indefinitely)
+        '''
+
+        self.stop_event.set()
+        self.engine.unsubscribe(self.frame_queue)
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+        self.threads = []
+
+    def is_recording_event(self):
+        '''Returns True while frames after an event are still being collected or saved.'''
+
+        return self.event_requested.is_set() or self.post_remaining > 0 or self.save_queue.unfinished_tasks > 0
+
+    def set_data_types(self, data_types):
+        '''Changes the data types kept and saved. Frames buffered so far are forgotten if they change.'''
+
+        with self.buffer_lock:
+            self.ring_buffer.set_data_types(data_types)
+
+    def set_event_trigger(self, event_trigger):
+        '''Switches automatic event detection to another EventTrigger, or off with None.'''
+
+        self.event_trigger = event_trigger
+
+    def trigger_event(self):
+        '''Saves the buffered frames and the next 'post_frames' frames. Returns straight away.'''
+
+        self.event_requested.set()
+
+    def run(self):
+        '''Worker loop: buffers every frame and passes the frames of events on to the saver.'''
+
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    frame = self.frame_queue.get(timeout=0.1)
+                except Empty:
+                    if not self.engine.is_running() and self.frame_queue.empty():
+                        break
+                    continue
+
+                if frame.walabot_error:
+                    self.walabot_error = frame.walabot_error
+                    break
+
+                if self.event_requested.is_set():
+                    self.event_requested.clear()
+                    self.start_event()
+
+                event_trigger = self.event_trigger
+                if event_trigger is not None:
+                    with metrics.timer('pretrigger.detect'):
+                        active = event_trigger.update(frame.get(IMAGE_SLICE))
+                    if active:
+                        self.start_event()
+
+                if self.post_remaining > 0:
+                    # Frames after an event go straight to the saver
+                    self.queue_frames([frame])
+                    self.post_remaining -= 1
+                else:
+                    with self.buffer_lock:
+                        self.ring_buffer.add(frame)
+        finally:
+            self.save_queue.put(None)
+
+    def start_event(self):
+        '''Hands the buffered frames to the saver and starts collecting the frames after the event.'''
+
+        if self.post_remaining == 0:
+            # A new event, rather than one extending the current recording
+            self.event_count += 1
+            with self.buffer_lock, metrics.timer('pretrigger.drain'):
+                frames = self.ring_buffer.drain()
+            self.event_offset = -len(frames)
+            self.queue_frames(frames)
+            print('Event {}: saving {} frame(s) from before it'.format(self.event_count, len(frames)))
+
+        self.post_remaining = self.post_frames
+
+    def queue_frames(self, frames):
+        '''Queues frames of the current event for saving, with their position relative to the event.'''
+
+        if not frames:
+            return
+
+        # Frame timestamps are taken from the performance counter, convert them to wall clock time
+        clock_offset = time.time() - time.perf_counter()
+        data_types = self.ring_buffer.data_types
+        batch = []
+        for frame in frames:
+            # Leave out what was only acquired for the preview
+            captures = {capture_type: data for capture_type, data in frame.data.items() if capture_type in data_types}
+            metadata = {'timestamp': frame.timestamp + clock_offset, 'event': self.event_count,
+                        'event_offset': self.event_offset}
+            batch.append((captures, metadata))
+            self.event_offset += 1
+        self.save_queue.put(batch)
+
+    def run_saver(self):
+        '''Saver loop: saves the queued frames through the controller, in order.'''
+
+        while True:
+            batch = self.save_queue.get()
+            if batch is None:
+                self.save_queue.task_done()
+                break
+
+            for captures, metadata in batch:
+                if not captures:
+                    continue
+                self.controller.save_captures(captures, metadata)
+                self.saved_frames += 1
+            self.save_queue.task_done()
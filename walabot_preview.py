@@ -0,0 +1,81 @@
+import numpy as np
+
+# Number of image sizes whose index maps are kept
+INDEX_MAP_CACHE_SIZE = 8
+
+class PreviewRenderer():
+    '''
+    Turns a 2D image slice into a canvas-sized RGB bitmap in a couple of Numpy operations:
+    the slice is resampled to the canvas size with precomputed index maps (nearest neighbour)
+    and mapped to colours through a lookup table.
+    '''
+
+    def __init__(self, colours, canvas_width, canvas_height):
+        '''
+        Inputs:
+            colours: list of hex colour strings (e.g. '0000FF'). A pixel value of n is drawn with colours[n].
+            canvas_width: int, width of the rendered bitmap
+            canvas_height: int, height of the rendered bitmap
+        '''
+
+        self.lut = np.array([[int(colour[i:i+2], 16) for i in (0, 2, 4)] for colour in colours], dtype=np.uint8)
+        self.canvas_width = canvas_width
+        self.canvas_height = canvas_height
+        self.ppm_header = 'P6 {} {} 255\n'.format(canvas_width, canvas_height).encode('ascii')
+        self.rows = None
+        self.cols = None
+        self.index_maps = {}  # (image_width, image_height) -> (rows, cols) of recently used image sizes
+        self.set_image_dimensions(1, 1)
+
+    def set_image_dimensions(self, image_width, image_height):
+        '''
+        Precomputes which image pixel every canvas pixel shows. Only needs to be called when
+        the arena (and therefore the image size) changes. The index maps of the last
+        INDEX_MAP_CACHE_SIZE image sizes are kept, so switching between arenas reuses them.
+
+        Inputs:
+            image_width: int, number of columns in the image slice
+            image_height: int, number of rows in the image slice
+        '''
+
+        self.image_width = image_width
+        self.image_height = image_height
+
+        key = (image_width, image_height)
+        index_map = self.index_maps.pop(key, None)
+        if index_map is None:
+            index_map = ((np.arange(self.canvas_height) * image_height // self.canvas_height)[:, np.newaxis],
+                         (np.arange(self.canvas_width) * image_width // self.canvas_width)[np.newaxis, :])
+        self.index_maps[key] = index_map
+        if len(self.index_maps) > INDEX_MAP_CACHE_SIZE:
+            del self.index_maps[next(iter(self.index_maps))]
+        self.rows, self.cols = index_map
+
+    def render_rgb(self, image_slice):
+        '''
+        Renders an image slice.
+
+        Input:
+            image_slice: 2D Numpy array (rows x columns) of colour indices
+
+        Output:
+            rgb: canvas_height x canvas_width x 3 Numpy array of uint8
+        '''
+
+        image_slice = np.asarray(image_slice)
+        if image_slice.ndim == 2 and image_slice.shape != (self.image_height, self.image_width):
+            # The slice does not have the size expected from the arena (e.g. when replaying a recording)
+            self.set_image_dimensions(image_slice.shape[1], image_slice.shape[0])
+
+        indices = np.clip(image_slice, 0, len(self.lut) - 1).astype(np.intp, copy=False)
+        return self.lut[indices[self.rows, self.cols]]
+
+    def render_ppm(self, image_slice):
+        '''Renders an image slice as binary PPM data, which Tk photo images can load directly.'''
+
+        return self.ppm_header + self.render_rgb(image_slice).tobytes()
+
+    def render_blank_ppm(self):
+        '''Renders an empty preview (every pixel set to the first colour).'''
+
+        return self.ppm_header + np.broadcast_to(self.lut[0], (self.canvas_height, self.canvas_width, 3)).tobytes()
@@ -0,0 +1,116 @@
+'''
+Range profiles computed from the raw signals as they are saved: the echo strength of every antenna
+pair against distance, which is usually all that is needed from the signals and takes a fraction of
+the space of the samples.
+
+The raw signals are time-domain echoes, so a range profile is the envelope of each pair's signal
+plotted against range (c * t / 2). The envelope is the magnitude of the analytic signal, obtained with
+one FFT over every pair at once: the negative frequencies are zeroed, the positive ones are tapered
+with a Hann window to suppress out-of-band noise and ringing, and the inverse FFT is taken. The
+envelope is then cut to the range of interest and reduced to one bin per 'decimation' samples
+(keeping the peak of each bin) in single precision.
+
+Everything that only depends on the time vector (spectral weights, range axis, bins) is computed
+once and reused until the time vector changes.
+'''
+
+import numpy as np
+
+SPEED_OF_LIGHT = 299792458.0  # m/s
+
+# How the raw signals are saved
+SIGNALS_OUTPUT_SAMPLES = 'Samples'
+SIGNALS_OUTPUT_BOTH = 'Samples and range profiles'
+SIGNALS_OUTPUT_RANGE_PROFILES = 'Range profiles'
+SIGNALS_OUTPUTS = [SIGNALS_OUTPUT_SAMPLES, SIGNALS_OUTPUT_BOTH, SIGNALS_OUTPUT_RANGE_PROFILES]
+
+DEFAULT_DECIMATION = 4
+
+class RangeProfiler():
+    '''Computes the range profiles of all antenna pairs of a trigger in one batch.'''
+
+    def __init__(self, max_range=None, decimation=DEFAULT_DECIMATION):
+        '''
+        Inputs:
+            max_range: float, largest range kept [m]. None keeps the whole signal.
+            decimation: int, number of samples per range bin
+        '''
+
+        self.max_range = max_range
+        self.decimation = max(1, int(decimation))
+
+        # Computed from the time vector by prepare()
+        self.time_key = None     # (number of samples, first time, last time) the values below are for
+        self.weights = None      # Analytic signal weights for the rfft bins, including the taper
+        self.num_kept = 0        # Number of samples kept (a whole number of range bins)
+        self.ranges = None       # Range of each bin [m]
+
+    def prepare(self, time_vector):
+        '''Computes the spectral weights and range bins for 'time_vector', unless they are already known.'''
+
+        time_vector = np.asarray(time_vector, dtype=np.float64)
+        num_samples = len(time_vector)
+        time_key = (num_samples, float(time_vector[0]), float(time_vector[-1])) if num_samples else (0, 0.0, 0.0)
+        if time_key == self.time_key:
+            return
+
+        # Analytic signal: keep DC (and Nyquist), double the positive frequencies, drop the negative ones.
+        # The positive frequencies are tapered with the falling half of a Hann window.
+        num_bins = num_samples // 2 + 1
+        weights = 0.5 * (1.0 + np.cos(np.pi * np.arange(num_bins) / max(num_bins, 1)))
+        weights[1:num_samples - num_bins + 1] *= 2.0
+
+        ranges = (time_vector - time_vector[0]) * SPEED_OF_LIGHT / 2.0 if num_samples else time_vector
+        num_kept = num_samples
+        if self.max_range is not None:
+            num_kept = int(np.searchsorted(ranges, self.max_range, side='right'))
+        num_kept -= num_kept % self.decimation
+
+        self.time_key = time_key
+        self.weights = weights[:, np.newaxis]
+        self.num_kept = num_kept
+        self.ranges = ranges[:num_kept].reshape(-1, self.decimation)[:, 0].copy()
+
+    def compute(self, amplitudes, time_vector):
+        '''
+        Computes the range profiles of one trigger.
+
+        Inputs:
+            amplitudes: NxP Numpy array, N samples for each of P antenna pairs
+            time_vector: 1D array of the N sample times [s]
+
+        Outputs:
+            profiles: BxP Numpy array of float32, the envelope peak of each range bin for every pair
+            ranges: 1D Numpy array of the B bin ranges [m]
+        '''
+
+        self.prepare(time_vector)
+        amplitudes = np.asarray(amplitudes, dtype=np.float64)
+        num_samples, num_pairs = amplitudes.shape
+
+        spectrum = np.zeros((num_samples, num_pairs), dtype=np.complex128)
+        spectrum[:len(self.weights)] = np.fft.rfft(amplitudes, axis=0) * self.weights
+        envelope = np.abs(np.fft.ifft(spectrum, axis=0)[:self.num_kept])
+
+        profiles = envelope.reshape(-1, self.decimation, num_pairs).max(axis=1).astype(np.float32)
+        return profiles, self.ranges
+
+    def compute_signals(self, signals):
+        '''
+        Computes the range profiles of a raw signals DataFrame as returned by Walabot.get_raw_signals().
+
+        Input:
+            signals: Pandas DataFrame, the time column followed by one column per antenna pair
+
+        Output:
+            range_profiles: Pandas DataFrame, a 'range' column [m] followed by one column per antenna pair
+        '''
+
+        import pandas as pd
+
+        values = signals.to_numpy()
+        profiles, ranges = self.compute(values[:, 1:], values[:, 0])
+
+        range_profiles = pd.DataFrame(profiles, columns=signals.columns[1:], copy=False)
+        range_profiles.insert(0, 'range', ranges.astype(np.float32))
+        return range_profiles
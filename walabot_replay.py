@@ -0,0 +1,349 @@
+from os.path import getmtime, basename
+import glob
+import re
+import time
+import numpy as np
+import pandas as pd
+from walabot_storage import SessionReader, load_csv_capture, parse_signals_header, SESSION_EXTENSION, SIGNALS, \
+    IMAGE_SLICE, IMAGE
+from walabot_image_store import ImageStoreReader, image_store_file_names
+
+class CsvRecording():
+    '''
+    A recording saved as CSV files: [prefix]_[capture_number]_[capture_type].csv.
+    The capture time is taken from the files' modification times.
+    '''
+
+    def __init__(self, prefix):
+        '''
+        Input:
+            prefix: str, file prefix including its directory (e.g. 'data/capture')
+        '''
+
+        self.devices = []
+
+        pattern = re.compile(re.escape(basename(prefix)) + r'_(\d+)_(signals|im_2d|im_3d)\.csv$')
+        self.files = {}  # capture_no -> {capture_type: file name}
+        for file_name in glob.glob(glob.escape(prefix) + '_*.csv'):
+            match = pattern.match(basename(file_name))
+            if match:
+                self.files.setdefault(int(match.group(1)), {})[match.group(2)] = file_name
+
+        self.capture_nos = sorted(self.files)
+        self.timestamps = [min(getmtime(file_name) for file_name in self.files[capture_no].values())
+                           for capture_no in self.capture_nos]
+
+    def __len__(self):
+        return len(self.capture_nos)
+
+    def load(self, index, capture_type):
+        '''Returns capture 'index' of 'capture_type', or None if it was not recorded.'''
+
+        file_name = self.files[self.capture_nos[index]].get(capture_type)
+        if file_name is None:
+            return None
+
+        return load_csv_capture(file_name, capture_type)
+
+class SessionRecording():
+    '''
+    A recording saved as a binary session ([prefix].wbs) and its 3D image stores ([prefix]_im_3d*.wbi).
+    A multi-device session holds one capture per device under each capture number, so one of its
+    devices is replayed at a time.
+    '''
+
+    def __init__(self, session_file, device=None):
+        '''
+        Inputs:
+            session_file: str, binary session file
+            device: str, device to replay from a multi-device session (e.g. 'dev0'). Can be left
+                    out if the session only has one device.
+        '''
+
+        self.session = SessionReader(session_file)
+        self.devices = self.session.get_devices()
+        if device is None and len(self.devices) > 1:
+            raise ValueError('{} was recorded from devices {}, choose the one to replay'.format(
+                session_file, ', '.join(self.devices)))
+        if device is not None and device not in self.devices:
+            raise ValueError('{} has no device {}'.format(session_file, device))
+        if device is None and self.devices:
+            device = self.devices[0]
+        self.device = device
+
+        # Only single Walabot sessions save their 3D images in image stores
+        prefix = session_file[:-len(SESSION_EXTENSION)]
+        image_store_files = image_store_file_names(prefix) if device is None else []
+        self.image_stores = [ImageStoreReader(file_name) for file_name in image_store_files]
+
+        # capture_no -> {capture_type: (session frame index, None) or (None, (image store, index within it))}
+        self.frames = {}
+        timestamps = {}
+        for index, record in enumerate(self.session.frames):
+            if record.get('device') != device:
+                continue
+            self.frames.setdefault(record['capture_no'], {})[record['capture_type']] = (index, None)
+            timestamps.setdefault(record['capture_no'], record.get('timestamp', 0.0))
+        for image_store in self.image_stores:
+            for index, capture_no in enumerate(image_store.capture_nos.tolist()):
+                self.frames.setdefault(capture_no, {})[IMAGE] = (None, (image_store, index))
+                timestamps.setdefault(capture_no, float(image_store.timestamps[index]))
+
+        self.capture_nos = sorted(self.frames)
+        self.timestamps = [timestamps[capture_no] for capture_no in self.capture_nos]
+
+    def __len__(self):
+        return len(self.capture_nos)
+
+    def load(self, index, capture_type):
+        '''Returns capture 'index' of 'capture_type', or None if it was not recorded.'''
+
+        location = self.frames[self.capture_nos[index]].get(capture_type)
+        if location is None:
+            return None
+
+        frame_index, image_store_location = location
+        if image_store_location is not None:
+            image_store, image_store_index = image_store_location
+            return np.array(image_store[image_store_index])
+        if capture_type == SIGNALS:
+            return self.session.read_signals(frame_index)
+        capture, _ = self.session.read_frame(frame_index)
+        return capture
+
+def open_recording(path, device=None):
+    '''
+    Opens a recording.
+
+    Inputs:
+        path: str, binary session file (.wbs) or CSV file prefix (e.g. 'data/capture')
+        device: str, device to replay from a multi-device session. None for a single Walabot recording.
+
+    Output:
+        recording: SessionRecording or CsvRecording
+
+    Raises ValueError if 'device' is not in the recording, or if it is None for a session
+    recorded from several devices.
+    '''
+
+    if path.endswith(SESSION_EXTENSION):
+        return SessionRecording(path, device)
+
+    if device is not None:
+        raise ValueError('CSV recordings are from a single Walabot, there is no device {}'.format(device))
+    return CsvRecording(path)
+
+class ReplayWalabot():
+    '''
+    Stand-in for walabot_hardware.Walabot that replays a recorded session. Every trigger moves on to
+    the next capture, so the preview, the acquisition engine and any downstream processing run on
+    recorded data exactly as they would on the device.
+
+    Captures are released at the recorded pace divided by 'speed': 1.0 is real time, 2.0 is twice as
+    fast and 0 replays as fast as possible.
+    '''
+
+    def __init__(self, path, speed=1.0, loop=False, device=None):
+        '''
+        Inputs:
+            path: str, binary session file (.wbs) or CSV file prefix
+            speed: float, replay speed relative to real time. 0 replays as fast as possible.
+            loop: bool, start again from the first capture after the last one
+            device: str, device to replay from a multi-device session (see SessionRecording)
+        '''
+
+        self.recording = open_recording(path, device)
+        self.speed = speed
+        self.loop = loop
+        self.is_connected = False
+        self.index = -1
+        self.replay_start = None  # (wall clock, recording time) of the first capture
+        self.cache = {}           # Capture type -> data of the current capture
+        self.antenna_pair_selection = None  # (tx, rx) pairs whose recorded signals are returned, None for all
+        print('Replaying {} captures from {}'.format(len(self.recording), path))
+
+    def connect(self, uid=None):
+        '''Opens the replay. Returns an error if the recording is empty. The device 'uid' is ignored.'''
+
+        if len(self.recording) == 0:
+            return 'The recording contains no captures'
+        self.is_connected = True
+        return None
+
+    def disconnect(self):
+        '''Closes the replay and rewinds to the first capture.'''
+
+        self.is_connected = False
+        self.index = -1
+        self.replay_start = None
+        self.cache = {}
+        return None
+
+    def start(self):
+        '''Nothing to start when replaying.'''
+
+        return None
+
+    def stop(self):
+        '''Nothing to stop when replaying.'''
+
+        return None
+
+    def set_profile(self, profile):
+        '''The profile is fixed by the recording.'''
+
+        return None
+
+    def set_arena_imaging(self, x, y, z, threshold, filter_type):
+        '''The arena is fixed by the recording.'''
+
+        return None
+
+    def set_arena_sensor(self, r, theta, phi, threshold, filter_type):
+        '''The arena is fixed by the recording.'''
+
+        return None
+
+    def set_arena_axes(self, axes):
+        '''The arena is fixed by the recording.'''
+
+        return None
+
+    def set_threshold(self, threshold):
+        '''The threshold is fixed by the recording.'''
+
+        return None
+
+    def set_filter_type(self, filter_type):
+        '''The filter is fixed by the recording.'''
+
+        return None
+
+    def set_antenna_pair_selection(self, antenna_pairs):
+        '''Selects the recorded antenna pairs returned with the raw signals, None for all of them.'''
+
+        self.antenna_pair_selection = list(antenna_pairs) if antenna_pairs is not None else None
+
+    def get_antenna_pairs(self):
+        '''Returns the recorded antenna pairs as (tx, rx) antenna numbers.'''
+
+        signals, walabot_error = self.get_capture(SIGNALS)
+        if walabot_error:
+            return [], walabot_error
+        return [parse_signals_header(header) for header in signals.columns[1:]], None
+
+    def calibrate(self, progress_callback=None, cancel_event=None, timeout=None):
+        '''Recorded data cannot be recalibrated.'''
+
+        return None
+
+    def trigger(self):
+        '''
+        Moves on to the next capture, waiting until it is due at the selected replay speed.
+
+        Output:
+            walabot_error: None if a capture is available. Otherwise a message saying the replay is over.
+        '''
+
+        next_index = self.index + 1
+        if next_index >= len(self.recording):
+            if not self.loop:
+                return 'End of recording'
+            next_index = 0
+            self.replay_start = None
+
+        if self.speed > 0:
+            recorded_time = self.recording.timestamps[next_index]
+            if self.replay_start is None:
+                self.replay_start = (time.monotonic(), recorded_time)
+            wall_start, recording_start = self.replay_start
+            delay = wall_start + (recorded_time - recording_start) / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        self.index = next_index
+        self.cache = {}
+        return None
+
+    def get_capture(self, capture_type):
+        '''Returns the current capture of 'capture_type' and an error if it was not recorded.'''
+
+        if self.index < 0:
+            return None, 'Trigger before getting data from a replay'
+
+        if capture_type not in self.cache:
+            self.cache[capture_type] = self.recording.load(self.index, capture_type)
+        capture = self.cache[capture_type]
+        if capture is None:
+            return None, 'Capture {} has no {} data'.format(self.recording.capture_nos[self.index], capture_type)
+
+        return capture, None
+
+    def get_raw_signals(self):
+        '''Returns the recorded raw signals of the current capture.'''
+
+        signals, walabot_error = self.get_capture(SIGNALS)
+        if walabot_error:
+            return pd.DataFrame(), walabot_error
+        if self.antenna_pair_selection is not None:
+            selection = set(self.antenna_pair_selection)
+            signals = signals[[signals.columns[0]] + [header for header in signals.columns[1:]
+                                                      if parse_signals_header(header) in selection]]
+        return signals, None
+
+    def get_raw_signals_array(self):
+        '''Returns the recorded raw signals of the current capture as a Numpy array and column labels.'''
+
+        signals, walabot_error = self.get_raw_signals()
+        if walabot_error:
+            return np.empty((0, 0)), [], walabot_error
+        return signals.to_numpy(), list(signals.columns), None
+
+    def get_raw_image_slice(self):
+        '''Returns the recorded 2D image slice of the current capture.'''
+
+        image_slice, walabot_error = self.get_capture(IMAGE_SLICE)
+        if walabot_error:
+            return np.array([]), walabot_error
+        return image_slice, None
+
+    def get_raw_image(self):
+        '''Returns the recorded 3D image of the current capture.'''
+
+        image, walabot_error = self.get_capture(IMAGE)
+        if walabot_error:
+            return np.array([]), walabot_error
+        return image, None
+
+    def get_image_dimensions(self):
+        '''Returns the width and height of the recorded 2D image slices.'''
+
+        for index in range(len(self.recording)):
+            image_slice = self.recording.load(index, IMAGE_SLICE)
+            if image_slice is not None:
+                height, width = image_slice.shape
+                return width, height, None
+
+        return 0, 0, 'The recording contains no 2D image slices'
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Replay a recording as fast as possible and report the throughput.')
+    parser.add_argument('path', help='binary session file (.wbs) or CSV file prefix')
+    parser.add_argument('--device', help='device to replay from a multi-device session (e.g. dev0)')
+    args = parser.parse_args()
+
+    try:
+        walabot = ReplayWalabot(args.path, speed=0, device=args.device)
+    except ValueError as error:
+        parser.error(str(error))
+    walabot.connect()
+    start = time.perf_counter()
+    num_frames = 0
+    while walabot.trigger() is None:
+        for getter in (walabot.get_raw_signals, walabot.get_raw_image_slice, walabot.get_raw_image):
+            getter()
+        num_frames += 1
+    elapsed = time.perf_counter() - start
+    print('{} captures in {:.2f} s ({:.1f} captures/s)'.format(num_frames, elapsed, num_frames / max(elapsed, 1e-9)))
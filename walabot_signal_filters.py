@@ -0,0 +1,196 @@
+'''
+Streaming clutter removal for raw signals. The Walabot's dynamic image filter (SetDynamicImageFilter)
+only applies to images, so these filters do the same job for the raw signals, in software, as the
+frames are saved.
+
+Each filter is fed the signals of consecutive triggers and removes what does not change between them
+(the direct path between the antennas and reflections off static objects), leaving the echoes of
+moving targets. Every filter works on all of the antenna pairs at once and keeps a fixed amount of
+state per sample and pair, however long the recording is.
+'''
+
+import numpy as np
+
+# Signal filter names, as shown in the GUI and accepted on the command line
+SIGNAL_FILTER_NONE = 'None'
+SIGNAL_FILTER_BACKGROUND = 'Background subtraction'
+SIGNAL_FILTER_DIFFERENCE = 'Frame difference'
+SIGNAL_FILTER_MTI = 'Moving average MTI'
+SIGNAL_FILTERS = [SIGNAL_FILTER_NONE, SIGNAL_FILTER_BACKGROUND, SIGNAL_FILTER_DIFFERENCE, SIGNAL_FILTER_MTI]
+
+# Defaults: weight of a new frame in the running background, and number of frames averaged for MTI
+DEFAULT_BACKGROUND_ALPHA = 0.05
+DEFAULT_MTI_WINDOW = 8
+
+class SignalFilter():
+    '''
+    Base class of the streaming signal filters. Subclasses implement estimate_background(),
+    which returns the clutter estimate to remove from a frame and updates the filter's state.
+    The state is reset whenever the number of samples or antenna pairs changes.
+    '''
+
+    def __init__(self):
+        self.shape = None  # Shape of the amplitudes the state was built for
+
+    def reset(self):
+        '''Forgets the frames seen so far, e.g. after the arena or profile has changed.'''
+
+        self.shape = None
+
+    def apply(self, amplitudes):
+        '''
+        Filters one frame.
+
+        Input:
+            amplitudes: NxP Numpy array, N samples for each of P antenna pairs (no time column)
+
+        Output:
+            filtered: NxP Numpy array of float64, the amplitudes with the clutter estimate removed
+        '''
+
+        amplitudes = np.asarray(amplitudes, dtype=np.float64)
+        if amplitudes.shape != self.shape:
+            self.start(amplitudes)
+            self.shape = amplitudes.shape
+
+        return amplitudes - self.estimate_background(amplitudes)
+
+    def filter_signals(self, signals):
+        '''
+        Filters a raw signals DataFrame as returned by Walabot.get_raw_signals().
+
+        Input:
+            signals: Pandas DataFrame, the time column followed by one column per antenna pair
+
+        Output:
+            filtered: Pandas DataFrame with the same columns, the time column unchanged
+        '''
+
+        import pandas as pd
+
+        values = signals.to_numpy()
+        filtered = np.empty(values.shape)
+        filtered[:, 0] = values[:, 0]
+        filtered[:, 1:] = self.apply(values[:, 1:])
+
+        return pd.DataFrame(filtered, columns=signals.columns, copy=False)
+
+    def start(self, amplitudes):
+        '''Sets up the state from the first frame (or the first after the shape changed).'''
+
+        raise NotImplementedError
+
+    def estimate_background(self, amplitudes):
+        '''Returns the clutter estimate for 'amplitudes' and adds them to the state.'''
+
+        raise NotImplementedError
+
+class BackgroundSubtraction(SignalFilter):
+    '''
+    Removes an exponentially weighted running average of the previous frames. Slowly changing
+    clutter is followed, while targets that keep moving are left in.
+    '''
+
+    def __init__(self, alpha=DEFAULT_BACKGROUND_ALPHA):
+        '''
+        Input:
+            alpha: float between 0 and 1, weight of each new frame in the background.
+                   Larger values follow changes in the scene faster.
+        '''
+
+        SignalFilter.__init__(self)
+        self.alpha = alpha
+        self.background = None
+
+    def start(self, amplitudes):
+        self.background = amplitudes.copy()
+
+    def estimate_background(self, amplitudes):
+        background = self.background.copy()
+        # background += alpha * (amplitudes - background), in place
+        self.background *= 1.0 - self.alpha
+        self.background += self.alpha * amplitudes
+
+        return background
+
+class FrameDifference(SignalFilter):
+    '''Removes the previous frame (two-pulse canceller). Only what changed since the last trigger is left.'''
+
+    def __init__(self):
+        SignalFilter.__init__(self)
+        self.previous = None
+
+    def start(self, amplitudes):
+        self.previous = amplitudes.copy()
+
+    def estimate_background(self, amplitudes):
+        background = self.previous.copy()
+        self.previous[...] = amplitudes
+
+        return background
+
+class MovingAverageMTI(SignalFilter):
+    '''
+    Moving target indication: removes the mean of the last 'window' frames. The frames are kept in
+    a preallocated ring buffer alongside their running sum, so each frame costs the same whatever
+    the window length.
+    '''
+
+    def __init__(self, window=DEFAULT_MTI_WINDOW):
+        '''
+        Input:
+            window: int, number of previous frames averaged
+        '''
+
+        SignalFilter.__init__(self)
+        self.window = window
+        self.frames = None   # Ring buffer of the last 'window' frames
+        self.total = None    # Sum of the frames in the ring buffer
+        self.count = 0       # Number of frames in the ring buffer
+        self.position = 0    # Ring buffer slot the next frame goes into
+
+    def start(self, amplitudes):
+        self.frames = np.empty((self.window,) + amplitudes.shape)
+        self.total = np.zeros(amplitudes.shape)
+        self.count = 0
+        self.position = 0
+
+    def estimate_background(self, amplitudes):
+        background = self.total / self.count if self.count else amplitudes.copy()
+
+        if self.count == self.window:
+            self.total -= self.frames[self.position]
+        else:
+            self.count += 1
+        self.frames[self.position] = amplitudes
+        self.total += amplitudes
+        self.position = (self.position + 1) % self.window
+        if self.position == 0:
+            # Recompute the sum once per pass over the buffer so that rounding errors cannot build up
+            self.frames[:self.count].sum(axis=0, out=self.total)
+
+        return background
+
+def create_signal_filter(name, alpha=DEFAULT_BACKGROUND_ALPHA, window=DEFAULT_MTI_WINDOW):
+    '''
+    Creates a signal filter by name.
+
+    Inputs:
+        name: str, one of SIGNAL_FILTERS
+        alpha: float, background weight of new frames (background subtraction only)
+        window: int, number of frames averaged (moving average MTI only)
+
+    Output:
+        signal_filter: SignalFilter, or None for SIGNAL_FILTER_NONE
+    '''
+
+    if name == SIGNAL_FILTER_NONE:
+        return None
+    if name == SIGNAL_FILTER_BACKGROUND:
+        return BackgroundSubtraction(alpha)
+    if name == SIGNAL_FILTER_DIFFERENCE:
+        return FrameDifference()
+    if name == SIGNAL_FILTER_MTI:
+        return MovingAverageMTI(window)
+
+    raise ValueError('Unknown signal filter: {}'.format(name))
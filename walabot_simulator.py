@@ -0,0 +1,272 @@
+import time
+import numpy as np
+
+class SimulatedWalabotAPI():
+    '''
+    Hardware-free stand-in for the vendor WalabotAPI module. It exposes the subset of the API used by
+    walabot_hardware.Walabot and produces deterministic synthetic antenna pairs, signals, 2D slices and
+    3D images with the shapes the real device would return for the current profile and arena.
+
+    Per-call latency and errors can be injected to profile and load-test the acquisition pipeline:
+        api = SimulatedWalabotAPI(latency={'Trigger': 0.02}, error_rate={'GetRawImage': 0.01})
+        walabot = Walabot(api)
+    '''
+
+    # Constants taken from WalabotAPI.py
+    PROF_SHORT_RANGE_IMAGING = 0x00010000
+    PROF_SENSOR = 0x00020000
+    PROF_SENSOR_NARROW = 0x00020000 + 1
+    PROF_TRACKER = 0x00030000
+
+    FILTER_TYPE_NONE = 0
+    FILTER_TYPE_DERIVATIVE = 1
+    FILTER_TYPE_MTI = 2
+
+    STATUS_CLEAN = 0
+    STATUS_INITIALIZED = 1
+    STATUS_CONNECTED = 2
+    STATUS_CONFIGURED = 3
+    STATUS_SCANNING = 4
+    STATUS_CALIBRATING = 5
+    STATUS_CALIBRATING_NO_MOVEMENT = 6
+
+    class WalabotError(Exception):
+        '''Raised by the simulated API calls, like WalabotAPI.WalabotError.'''
+
+    class AntennaPair():
+        '''Simulated antenna pair, like WalabotAPI.AntennaPair.'''
+
+        def __init__(self, txAntenna, rxAntenna):
+            self.txAntenna = txAntenna
+            self.rxAntenna = rxAntenna
+
+    def __init__(self, latency=None, error_rate=None, seed=0, num_samples=8192, num_pairs=40,
+                 calibration_steps=10):
+        '''
+        Inputs:
+            latency: dict of API function name -> seconds to sleep per call (e.g. {'Trigger': 0.02}).
+                     The key '*' applies to every call without its own entry.
+            error_rate: dict of API function name -> probability (0 to 1) that a call raises WalabotError.
+                        The key '*' applies to every call without its own entry.
+            seed: int, seed of the synthetic data and of the error injection
+            num_samples: int, number of samples per raw signal
+            num_pairs: int, number of antenna pairs for the imaging and sensor profiles
+            calibration_steps: int, number of triggers a calibration takes
+        '''
+
+        self.latency = dict(latency or {})
+        self.error_rate = dict(error_rate or {})
+        self.seed = seed
+        self.num_samples = num_samples
+        self.num_pairs = num_pairs
+        self.calibration_steps = calibration_steps
+        self.error_random = np.random.RandomState(seed)
+
+        self.error_string = ''
+        self.status = self.STATUS_CLEAN
+        self.calibration_progress = 0
+        self.profile = self.PROF_SHORT_RANGE_IMAGING
+        self.arena = {}
+        self.threshold = 35.0
+        self.filter_type = self.FILTER_TYPE_NONE
+        self.trigger_count = 0
+
+        self.antenna_pairs = [self.AntennaPair(tx, rx) for tx, rx in self.generate_pair_numbers()]
+        self.pair_indices = {(pair.txAntenna, pair.rxAntenna): index for index, pair in enumerate(self.antenna_pairs)}
+        self.time_vector = (np.arange(num_samples) * 1e-11).tolist()  # ~82 ns window at 8192 samples
+        self.signal_cache = (None, None)  # (trigger count, list of signal lists)
+
+    def generate_pair_numbers(self):
+        '''Returns deterministic (tx, rx) antenna numbers for the simulated antenna pairs.'''
+
+        pairs = []
+        for tx in range(1, 19):
+            for rx in range(1, 19):
+                if tx != rx:
+                    pairs.append((tx, rx))
+        return pairs[:self.num_pairs]
+
+    def call(self, name):
+        '''Applies the configured latency and error injection for the API function 'name'.'''
+
+        delay = self.latency.get(name, self.latency.get('*', 0))
+        if delay:
+            time.sleep(delay)
+
+        rate = self.error_rate.get(name, self.error_rate.get('*', 0))
+        if rate and self.error_random.random_sample() < rate:
+            self.error_string = 'Simulated error in {}'.format(name)
+            raise self.WalabotError(self.error_string)
+
+    def require_status(self, name, minimum_status):
+        '''Raises WalabotError if the simulated device has not reached 'minimum_status'.'''
+
+        if self.status < minimum_status:
+            self.error_string = '{}: the Walabot is not in the right state'.format(name)
+            raise self.WalabotError(self.error_string)
+
+    # ----- Setup ----- #
+    def Init(self):
+        self.call('Init')
+
+    def Initialize(self, *args):
+        self.call('Initialize')
+        self.status = max(self.status, self.STATUS_INITIALIZED)
+
+    def GetErrorString(self):
+        return self.error_string
+
+    def ConnectAny(self):
+        self.call('ConnectAny')
+        self.status = self.STATUS_CONNECTED
+
+    def Connect(self, uid):
+        self.call('Connect')
+        self.status = self.STATUS_CONNECTED
+
+    def Disconnect(self):
+        self.call('Disconnect')
+        self.status = self.STATUS_INITIALIZED
+
+    def Start(self):
+        self.call('Start')
+        self.require_status('Start', self.STATUS_CONNECTED)
+        self.status = self.STATUS_SCANNING
+
+    def Stop(self):
+        self.call('Stop')
+        if self.status >= self.STATUS_SCANNING:
+            self.status = self.STATUS_CONFIGURED
+
+    def GetStatus(self):
+        self.call('GetStatus')
+        return self.status, self.calibration_progress
+
+    def SetProfile(self, profile):
+        self.call('SetProfile')
+        self.require_status('SetProfile', self.STATUS_CONNECTED)
+        self.profile = profile
+
+    def SetThreshold(self, threshold):
+        self.call('SetThreshold')
+        self.threshold = threshold
+
+    def SetDynamicImageFilter(self, filter_type):
+        self.call('SetDynamicImageFilter')
+        self.filter_type = filter_type
+
+    def set_arena_axis(self, axis, minimum, maximum, resolution):
+        '''Stores one arena axis after checking it makes sense.'''
+
+        self.call('SetArena' + axis)
+        if resolution <= 0 or maximum < minimum:
+            self.error_string = 'Invalid arena {}: ({}, {}, {})'.format(axis, minimum, maximum, resolution)
+            raise self.WalabotError(self.error_string)
+        self.arena[axis] = (minimum, maximum, resolution)
+
+    def SetArenaX(self, minimum, maximum, resolution):
+        self.set_arena_axis('X', minimum, maximum, resolution)
+
+    def SetArenaY(self, minimum, maximum, resolution):
+        self.set_arena_axis('Y', minimum, maximum, resolution)
+
+    def SetArenaZ(self, minimum, maximum, resolution):
+        self.set_arena_axis('Z', minimum, maximum, resolution)
+
+    def SetArenaR(self, minimum, maximum, resolution):
+        self.set_arena_axis('R', minimum, maximum, resolution)
+
+    def SetArenaTheta(self, minimum, maximum, resolution):
+        self.set_arena_axis('Theta', minimum, maximum, resolution)
+
+    def SetArenaPhi(self, minimum, maximum, resolution):
+        self.set_arena_axis('Phi', minimum, maximum, resolution)
+
+    # ----- Acquisition ----- #
+    def StartCalibration(self):
+        self.call('StartCalibration')
+        self.require_status('StartCalibration', self.STATUS_SCANNING)
+        self.status = self.STATUS_CALIBRATING
+        self.calibration_progress = 0
+
+    def Trigger(self):
+        self.call('Trigger')
+        self.require_status('Trigger', self.STATUS_SCANNING)
+        self.trigger_count += 1
+        if self.status == self.STATUS_CALIBRATING:
+            self.calibration_progress = min(100, self.calibration_progress + 100 // self.calibration_steps)
+            if self.calibration_progress >= 100:
+                self.status = self.STATUS_SCANNING
+                self.calibration_progress = 0
+
+    def GetAntennaPairs(self):
+        self.call('GetAntennaPairs')
+        if self.profile == self.PROF_TRACKER:
+            self.error_string = 'Raw signals are not available with the tracker profile'
+            raise self.WalabotError(self.error_string)
+        return list(self.antenna_pairs)
+
+    def GetSignal(self, antenna_pair):
+        self.call('GetSignal')
+        self.require_status('GetSignal', self.STATUS_SCANNING)
+
+        trigger_count, signals = self.signal_cache
+        if trigger_count != self.trigger_count:
+            signals = self.generate_signals()
+            self.signal_cache = (self.trigger_count, signals)
+
+        index = self.pair_indices[(antenna_pair.txAntenna, antenna_pair.rxAntenna)]
+        return signals[index], self.time_vector
+
+    def GetRawImageSlice(self):
+        self.call('GetRawImageSlice')
+        self.require_status('GetRawImageSlice', self.STATUS_SCANNING)
+        size_x, size_y, _ = self.get_image_size()
+        image = self.generate_image(size_x, size_y, 1)[:, :, 0]
+        return image.tolist(), size_x, size_y, 0.0, float(image.max())
+
+    def GetRawImage(self):
+        self.call('GetRawImage')
+        self.require_status('GetRawImage', self.STATUS_SCANNING)
+        size_x, size_y, size_z = self.get_image_size()
+        image = self.generate_image(size_x, size_y, size_z)
+        return image.tolist(), size_x, size_y, size_z, float(image.max())
+
+    # ----- Synthetic data ----- #
+    def get_axis_size(self, axis):
+        '''Returns the number of points along an arena axis.'''
+
+        minimum, maximum, resolution = self.arena.get(axis, (0, 0, 1))
+        return int((maximum - minimum) / resolution) + 1
+
+    def get_image_size(self):
+        '''
+        Returns the image size for the current profile and arena as the real API reports it:
+        (X, Y, Z) in Cartesian coordinates or (phi, R, theta) in spherical coordinates.
+        '''
+
+        if self.profile == self.PROF_SHORT_RANGE_IMAGING:
+            return self.get_axis_size('X'), self.get_axis_size('Y'), self.get_axis_size('Z')
+        return self.get_axis_size('Phi'), self.get_axis_size('R'), self.get_axis_size('Theta')
+
+    def generate_signals(self):
+        '''Generates one trigger's worth of raw signals: an echo per pair on top of seeded noise.'''
+
+        random = np.random.RandomState(self.seed + self.trigger_count)
+        samples = np.arange(self.num_samples)
+        pair_index = np.arange(len(self.antenna_pairs))[:, np.newaxis]
+        delay = self.num_samples * (0.3 + 0.02 * pair_index + 0.01 * np.sin(self.trigger_count / 10.0))
+        envelope = np.exp(-((samples - delay) / 60.0) ** 2)
+        signals = envelope * np.cos(0.3 * samples) + 0.01 * random.standard_normal((len(self.antenna_pairs), self.num_samples))
+        return signals.tolist()
+
+    def generate_image(self, size_x, size_y, size_z):
+        '''Generates an image with a single target drifting through the arena. Values are 0 to 255.'''
+
+        phase = self.trigger_count / 20.0
+        centre = (size_x * (0.5 + 0.3 * np.sin(phase)), size_y * (0.5 + 0.3 * np.cos(phase)), size_z / 2.0)
+        width = max(size_x, size_y, size_z) / 6.0 + 1
+        x, y, z = np.ogrid[:size_x, :size_y, :size_z]
+        distance = (x - centre[0]) ** 2 + (y - centre[1]) ** 2 + (z - centre[2]) ** 2
+        image = 255 * np.exp(-distance / (2 * width ** 2))
+        return image.astype(np.int64)
@@ -0,0 +1,662 @@
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from os.path import exists, getsize
+import json
+import struct
+import numpy as np
+from walabot_codec import encode_frames, decode_frames, CODEC_NAME
+from walabot_image_store import ImageStoreReader, image_store_file_names
+from walabot_metrics import metrics
+
+# Capture types (raw signals, 2D image, 3D image, plus what is computed from the raw signals as
+# they are saved: the signals after a software filter, and their range profiles)
+SIGNALS = 'signals'
+IMAGE_SLICE = 'im_2d'
+IMAGE = 'im_3d'
+SIGNALS_FILTERED = 'signals_filtered'
+RANGE_PROFILES = 'range_profiles'
+TABLE_CAPTURE_TYPES = (SIGNALS, SIGNALS_FILTERED, RANGE_PROFILES)  # Stored as DataFrames with column labels
+
+# ----- Binary session format ----- #
+# A session file starts with SESSION_MAGIC followed by any number of records. Every record is
+# a fixed-size header (record kind, metadata length, payload length), a UTF-8 JSON metadata
+# block and a raw payload. Records are only ever appended, so a session can grow over a whole
+# day of recording and a record cut short by a crash is simply ignored by the reader.
+SESSION_EXTENSION = '.wbs'
+SESSION_MAGIC = b'WBSESS01'
+RECORD_HEADER = struct.Struct('<4sIQ')
+RECORD_FRAME = b'FRAM'  # One capture (signals, 2D image or 3D image)
+RECORD_CHUNK = b'CHNK'  # Several captures of one type, compressed together (see walabot_codec)
+RECORD_AXES = b'AXES'   # Arena axes in effect for the frames that follow
+RECORD_TIME = b'TIME'   # Sample times shared by the raw signals frames that follow
+# Decoded chunks kept by a reader. Chunks of the capture types and devices of a session are
+# interleaved, so reading one frame of each per capture needs one chunk of each kept.
+CHUNK_CACHE_SIZE = 16
+
+def write_csv_capture(file_name, capture, capture_type):
+    '''
+    Saves a capture matrix to a .csv file.
+
+    Input:
+        file_name: str, name of the CSV file
+        capture: Pandas DataFrame or Numpy array containing the raw signals or image
+        capture_type: signals, filtered signals, range profiles, raw image slice, or raw image
+    '''
+
+    with metrics.timer('save.csv.' + capture_type):
+        # Pandas DataFrames have column labels by default.
+        # We only want this when we save raw signals and not if we are saving an image.
+        if capture_type in TABLE_CAPTURE_TYPES:
+            capture.to_csv(file_name, index=False)
+        elif capture_type == IMAGE_SLICE:
+            np.savetxt(file_name, capture, fmt='%.f', comments='', delimiter=',')
+        elif capture_type == IMAGE:
+            # https://stackoverflow.com/questions/3685265/how-to-write-a-multidimensional-array-to-a-text-file
+            with open(file_name, 'w') as outfile:
+                outfile.write('# Array shape (rows x columns x depth): {}x{}x{}\n'.format(capture.shape[1],
+                                                                                          capture.shape[2],
+                                                                                          capture.shape[0]))
+                for data_slice in capture:
+                    np.savetxt(outfile, data_slice, fmt='%.f', comments='', delimiter=',')
+                    outfile.write('# New slice\n')
+
+    if metrics.enabled:
+        metrics.count_bytes('save.csv.' + capture_type, getsize(file_name))
+
+def write_csv_axes(file_name, names, axes):
+    '''
+    Saves the axis vectors to a CSV file with each axis corresponding to a column.
+    Axes of different lengths are padded with empty cells.
+
+    Inputs:
+        file_name: str, name of the CSV file
+        names: list of axis names (e.g. ['X', 'Y', 'Z'])
+        axes: list of 1D Numpy arrays or lists, one per name
+    '''
+
+    num_rows = max(len(axis) for axis in axes)
+    with open(file_name, 'w') as outfile:
+        outfile.write(','.join(names) + '\n')
+        for row in range(num_rows):
+            outfile.write(','.join(repr(float(axis[row])) if row < len(axis) else '' for axis in axes) + '\n')
+
+def load_csv_capture(file_name, capture_type):
+    '''
+    Loads a capture saved by write_csv_capture().
+
+    Inputs:
+        file_name: str, CSV file
+        capture_type: signals, filtered signals, range profiles, raw image slice, or raw image
+
+    Output:
+        capture: Pandas DataFrame (raw signals) or Numpy array (images)
+    '''
+
+    if capture_type in TABLE_CAPTURE_TYPES:
+        import pandas as pd
+
+        return pd.read_csv(file_name)
+
+    if capture_type == IMAGE_SLICE:
+        return np.loadtxt(file_name, delimiter=',', ndmin=2)
+
+    # 3D images start with '# Array shape (rows x columns x depth): RxCxD' and
+    # separate the slices with '# New slice' comment lines.
+    with open(file_name) as infile:
+        rows, columns, depth = (int(size) for size in infile.readline().split(':')[1].strip().split('x'))
+    image = np.loadtxt(file_name, delimiter=',', comments='#', ndmin=2)
+
+    return image.reshape(depth, rows, columns)
+
+def load_csv_axes(file_name):
+    '''
+    Loads an axes file saved by write_csv_axes() (or by earlier versions using Pandas).
+
+    Outputs:
+        names: list of axis names
+        axes: list of 1D Numpy arrays
+    '''
+
+    with open(file_name) as infile:
+        names = infile.readline().strip().split(',')
+        columns = [[] for _ in names]
+        for line in infile:
+            for column, value in zip(columns, line.rstrip('\n').split(',')):
+                if value.strip():
+                    column.append(float(value))
+
+    return names, [np.array(column) for column in columns]
+
+def parse_signals_header(header):
+    '''
+    Returns the antenna pair of a raw signals column label.
+
+    Input:
+        header: str, column label of the form 'tx=<n> rx=<m>' (as written by Walabot.get_signals_headers())
+
+    Output:
+        antenna_pair: (tx, rx) tuple of ints
+    '''
+
+    tx, rx = header.split()
+    return int(tx[len('tx='):]), int(rx[len('rx='):])
+
+def session_file_name(prefix):
+    '''Returns the name of the binary session file for 'prefix'.'''
+
+    return prefix + SESSION_EXTENSION
+
+def frame_payload(capture):
+    '''
+    Splits a capture into what a session stores of it.
+
+    Input:
+        capture: Pandas DataFrame (raw signals) or Numpy array
+
+    Outputs:
+        payload: contiguous Numpy array, the frame's data as written to the session
+        columns: list of the DataFrame's column labels, or None for a Numpy array
+        sample_times: Numpy array of the raw signals' sample times, or None. The sample times are the same
+                      for every raw signals frame of a configuration, so they are written once in a time
+                      record and the frame only holds the pair amplitudes.
+    '''
+
+    columns = None
+    sample_times = None
+    if hasattr(capture, 'columns'):
+        columns = [str(column) for column in capture.columns]
+        capture = capture.to_numpy()
+        if columns[0] == 'time' and capture.ndim == 2:
+            sample_times = capture[:, 0]
+            capture = capture[:, 1:]
+
+    return np.ascontiguousarray(capture), columns, sample_times
+
+class SessionWriter():
+    '''
+    Appends frames and axes to a binary session file. Opening an existing session
+    continues it, so captures from several runs with the same prefix end up in one file.
+
+    With a chunk size set, frames are compressed losslessly: every 'chunk_size' frames of
+    a capture type are delta-coded and compressed together into one chunk record. Chunks are
+    compressed on a pool of threads and written in order as they finish. Frames waiting for
+    their chunk to fill up are only in memory, so they are lost if the program crashes.
+    '''
+
+    def __init__(self, file_name, chunk_size=0, compression_level=1, num_threads=2):
+        '''
+        Inputs:
+            file_name: str, session file to create or append to
+            chunk_size: int, number of frames compressed together. 0 stores frames uncompressed.
+            compression_level: int, zlib compression level (1 is fastest, 9 compresses most)
+            num_threads: int, number of compression threads
+        '''
+
+        self.file_name = file_name
+        self.captures = {}     # (capture_no, capture_type, device) -> payload offset of every frame in the file
+        self.axes = None       # Last axes written, used to avoid writing them for every frame
+        self.time_vector = None  # Last signals time vector written, likewise
+        self.on_frame_written = None  # Called with (capture_no, capture_type, device, payload offset) for every frame written
+
+        self.chunk_size = chunk_size
+        self.compression_level = compression_level
+        self.max_encoding = 2 * num_threads
+        self.chunks = {}          # (capture type, device) -> (record, list of frame metadata, list of arrays) being filled
+        self.encoding = deque()   # (record, future) of chunks being compressed, in the order they are written
+        self.compressor = ThreadPoolExecutor(max_workers=num_threads) if chunk_size else None
+
+        if exists(file_name) and getsize(file_name) > 0:
+            reader = SessionReader(file_name)
+            self.captures = {(record['capture_no'], record['capture_type'], record.get('device')): record['offset']
+                             for record in reader.frames}
+            if reader.axes_records:
+                self.axes = reader.read_axes(len(reader.axes_records) - 1)
+            if reader.time_records:
+                self.time_vector = reader.read_time(len(reader.time_records) - 1)
+            valid_size = reader.end_offset
+            reader.close()
+            self.file = open(file_name, 'r+b')
+            self.file.truncate(valid_size)  # Drop a partially written record, if any
+            self.file.seek(valid_size)
+        else:
+            self.file = open(file_name, 'wb')
+            self.file.write(SESSION_MAGIC)
+
+    def write_record(self, kind, metadata, payload):
+        '''
+        Appends a raw record to the session file.
+
+        Output:
+            payload_offset: int, offset of the payload within the session file
+        '''
+
+        with metrics.timer('save.session'):
+            metadata_bytes = json.dumps(metadata).encode('utf-8')
+            payload_offset = self.file.tell() + RECORD_HEADER.size + len(metadata_bytes)
+            self.file.write(RECORD_HEADER.pack(kind, len(metadata_bytes), len(payload)))
+            self.file.write(metadata_bytes)
+            self.file.write(payload)
+        metrics.count_bytes('save.session', RECORD_HEADER.size + len(metadata_bytes) + len(payload))
+
+        return payload_offset
+
+    def has_capture(self, capture_no, capture_type, device=None):
+        '''Returns True if the session already holds 'capture_type' for 'capture_no' (from 'device', if given).'''
+
+        return (capture_no, capture_type, device) in self.captures
+
+    def write_frame(self, capture_no, capture_type, capture, metadata=None):
+        '''
+        Appends one capture to the session.
+
+        Inputs:
+            capture_no: int, capture number
+            capture_type: signals, raw image slice, or raw image
+            capture: Pandas DataFrame (raw signals) or Numpy array
+            metadata: dict of extra JSON-serialisable per-frame information (timestamp, arena settings, etc.).
+                      Sessions recorded from several Walabots name the one each frame came from in 'device'.
+
+        Output:
+            payload_offset: int, offset of the frame's data within the session file
+        '''
+
+        record = dict(metadata or {})
+        capture, columns, sample_times = frame_payload(capture)
+        if columns is not None:
+            # Keep the DataFrame's column labels so that the reader can rebuild it
+            record['columns'] = columns
+        if sample_times is not None:
+            self.write_time(sample_times)
+            record['shared_time'] = True
+        record.update({
+            'capture_no': capture_no,
+            'capture_type': capture_type,
+            'dtype': capture.dtype.str,
+            'shape': list(capture.shape)
+        })
+
+        if self.chunk_size:
+            self.add_to_chunk(record, capture)
+            return None
+
+        payload_offset = self.write_record(RECORD_FRAME, record, capture.tobytes())
+        self.captures[(capture_no, capture_type, record.get('device'))] = payload_offset
+        if self.on_frame_written is not None:
+            self.on_frame_written(capture_no, capture_type, record.get('device'), payload_offset)
+
+        return payload_offset
+
+    def add_to_chunk(self, record, capture):
+        '''
+        Adds a frame to the chunk of its capture type. Full chunks are handed to the compression
+        threads, and chunks that have finished compressing are written.
+        '''
+
+        # Only the capture number, timestamp and the like differ between the frames of a chunk.
+        # Each device gets its own chunks, since frames are only similar to those of the same device.
+        common = {key: record[key] for key in ('capture_type', 'device', 'dtype', 'shape', 'columns', 'shared_time')
+                  if key in record}
+        frame_metadata = {key: value for key, value in record.items() if key not in common}
+
+        chunk_key = (record['capture_type'], record.get('device'))
+        chunk = self.chunks.get(chunk_key)
+        if chunk is not None and chunk[0] != common:
+            # A different arena or data layout, start a new chunk
+            self.encode_chunk(chunk_key)
+            chunk = None
+        if chunk is None:
+            chunk = self.chunks[chunk_key] = (common, [], [])
+
+        chunk[1].append(frame_metadata)
+        chunk[2].append(capture)
+        self.captures[(record['capture_no'],) + chunk_key] = None  # Offset known once the chunk is written
+
+        if len(chunk[2]) >= self.chunk_size:
+            self.encode_chunk(chunk_key)
+        self.write_encoded_chunks(wait=len(self.encoding) > self.max_encoding)
+
+    def encode_chunk(self, chunk_key):
+        '''Hands the (possibly partly filled) chunk of a (capture type, device) to the compression threads.'''
+
+        common, frames_metadata, frames = self.chunks.pop(chunk_key)
+        record = dict(common)
+        record.update({'codec': CODEC_NAME, 'count': len(frames), 'frames': frames_metadata})
+        self.encoding.append((record, self.compressor.submit(encode_frames, frames, self.compression_level)))
+
+    def write_encoded_chunks(self, wait=False):
+        '''
+        Writes the chunks that have finished compressing, keeping the order they were submitted in.
+
+        Input:
+            wait: bool, wait for the oldest chunk to finish if it has not yet
+        '''
+
+        while self.encoding and (wait or self.encoding[0][1].done()):
+            record, future = self.encoding.popleft()
+            payload_offset = self.write_record(RECORD_CHUNK, record, future.result())
+            for frame_metadata in record['frames']:
+                self.captures[(frame_metadata['capture_no'], record['capture_type'], record.get('device'))] = payload_offset
+                if self.on_frame_written is not None:
+                    self.on_frame_written(frame_metadata['capture_no'], record['capture_type'], record.get('device'),
+                                          payload_offset)
+            wait = False
+
+    def finish_chunks(self):
+        '''Compresses and writes every frame still held in memory, including partly filled chunks.'''
+
+        for chunk_key in list(self.chunks):
+            self.encode_chunk(chunk_key)
+        while self.encoding:
+            self.write_encoded_chunks(wait=True)
+
+    def write_axes(self, names, axes):
+        '''
+        Stores the arena axes for the frames that follow. Nothing is written if they have not
+        changed since the last call, so the axes end up in the session once per arena configuration.
+
+        Inputs:
+            names: list of axis names (e.g. ['X', 'Y', 'Z'])
+            axes: list of 1D Numpy arrays or lists, one per name
+        '''
+
+        axes = [np.asarray(axis, dtype=np.float64) for axis in axes]
+        if self.axes is not None:
+            last_names, last_axes = self.axes
+            if last_names == list(names) and len(last_axes) == len(axes) and \
+               all(np.array_equal(a, b) for a, b in zip(last_axes, axes)):
+                return
+
+        # Frames still waiting in chunks belong to the previous axes
+        self.finish_chunks()
+
+        record = {'names': list(names), 'lengths': [len(axis) for axis in axes]}
+        self.write_record(RECORD_AXES, record, b''.join(axis.tobytes() for axis in axes))
+        self.axes = (list(names), axes)
+
+    def write_time(self, time_vector):
+        '''
+        Stores the sample times of the raw signals frames that follow. Nothing is written if they
+        have not changed since the last call, so they end up in the session once per configuration.
+
+        Input:
+            time_vector: 1D Numpy array of sample times [s]
+        '''
+
+        time_vector = np.asarray(time_vector, dtype=np.float64)
+        if self.time_vector is not None and np.array_equal(self.time_vector, time_vector):
+            return
+
+        # Frames still waiting in chunks belong to the previous time vector
+        self.finish_chunks()
+
+        self.write_record(RECORD_TIME, {'length': len(time_vector)}, time_vector.tobytes())
+        self.time_vector = time_vector.copy()
+
+    def flush(self):
+        '''
+        Flushes buffered records to disk. Chunks that are still being filled or compressed are
+        not forced out, so that flushing after every capture does not defeat compression.
+        '''
+
+        self.write_encoded_chunks()
+        self.file.flush()
+
+    def close(self):
+        '''Writes any frames still held for compression and closes the session file.'''
+
+        if not self.file.closed:
+            self.finish_chunks()
+            self.file.close()
+        if self.compressor is not None:
+            self.compressor.shutdown()
+
+class SessionReader():
+    '''
+    Reads a binary session file. Only the record headers and metadata are read when the
+    session is opened; frame payloads are read on demand.
+    '''
+
+    def __init__(self, file_name):
+        '''
+        Input:
+            file_name: str, session file to read
+        '''
+
+        self.file_name = file_name
+        self.file = open(file_name, 'rb')
+        if self.file.read(len(SESSION_MAGIC)) != SESSION_MAGIC:
+            self.file.close()
+            raise ValueError('{} is not a Walabot session file'.format(file_name))
+
+        self.frames = []        # Frame metadata, each with 'offset', 'nbytes' and 'axes_index' added
+        self.axes_records = []  # Axes metadata, each with 'offset' added
+        self.time_records = []  # Signals time vector metadata, each with 'offset' added
+        self.time_cache = {}    # Time record index -> time vector, as read so far
+        self.chunk_cache = OrderedDict()  # Payload offset -> decoded frames, least recently read first
+        self.end_offset = self.file.tell()  # End of the last complete record
+        self.scan()
+
+    def scan(self):
+        '''Builds the index of records, stopping at the first incomplete one.'''
+
+        file_size = getsize(self.file_name)
+        offset = self.end_offset
+        while offset + RECORD_HEADER.size <= file_size:
+            self.file.seek(offset)
+            kind, metadata_length, payload_length = RECORD_HEADER.unpack(self.file.read(RECORD_HEADER.size))
+            payload_offset = offset + RECORD_HEADER.size + metadata_length
+            if payload_offset + payload_length > file_size:
+                break
+
+            metadata = json.loads(self.file.read(metadata_length).decode('utf-8'))
+            metadata['offset'] = payload_offset
+            metadata['nbytes'] = payload_length
+            if kind == RECORD_FRAME:
+                metadata['axes_index'] = len(self.axes_records) - 1
+                metadata['time_index'] = len(self.time_records) - 1
+                self.frames.append(metadata)
+            elif kind == RECORD_CHUNK:
+                # List every frame of the chunk, with its position within the chunk
+                frames_metadata = metadata.pop('frames')
+                for chunk_index, frame_metadata in enumerate(frames_metadata):
+                    frame_metadata.update(metadata)
+                    frame_metadata['chunk_index'] = chunk_index
+                    frame_metadata['axes_index'] = len(self.axes_records) - 1
+                    frame_metadata['time_index'] = len(self.time_records) - 1
+                    self.frames.append(frame_metadata)
+            elif kind == RECORD_AXES:
+                self.axes_records.append(metadata)
+            elif kind == RECORD_TIME:
+                self.time_records.append(metadata)
+
+            offset = payload_offset + payload_length
+            self.end_offset = offset
+
+    def __len__(self):
+        return len(self.frames)
+
+    def find_frames(self, capture_type=None, capture_no=None, device=None):
+        '''
+        Returns the indices of the frames matching the given capture type, number and/or device.
+        '''
+
+        return [index for index, record in enumerate(self.frames)
+                if (capture_type is None or record['capture_type'] == capture_type) and
+                   (capture_no is None or record['capture_no'] == capture_no) and
+                   (device is None or record.get('device') == device)]
+
+    def get_devices(self):
+        '''Returns the names of the devices recorded in a multi-device session (empty for a single Walabot).'''
+
+        return sorted(set(record['device'] for record in self.frames if 'device' in record))
+
+    def read_frame(self, index):
+        '''
+        Reads a frame from the session.
+
+        Input:
+            index: int, frame index within the session
+
+        Outputs:
+            capture: Numpy array with the frame's original dtype and shape
+            metadata: dict, the frame's metadata
+        '''
+
+        record = self.frames[index]
+        if 'chunk_index' in record:
+            return self.read_chunk(record)[record['chunk_index']], record
+
+        self.file.seek(record['offset'])
+        capture = np.frombuffer(self.file.read(record['nbytes']), dtype=np.dtype(record['dtype']))
+
+        return capture.reshape(record['shape']), record
+
+    def read_chunk(self, record):
+        '''
+        Decompresses the chunk holding a frame. The CHUNK_CACHE_SIZE chunks read most recently
+        are kept, so reading the frames of a chunk only decompresses it once, even when frames
+        of other capture types or devices are read in between.
+
+        Input:
+            record: dict, metadata of any frame in the chunk
+
+        Output:
+            frames: Numpy array with one row per frame of the chunk
+        '''
+
+        offset = record['offset']
+        frames = self.chunk_cache.get(offset)
+        if frames is not None:
+            self.chunk_cache.move_to_end(offset)
+            return frames
+
+        self.file.seek(offset)
+        frames = decode_frames(self.file.read(record['nbytes']), record['dtype'], record['shape'], record['count'])
+        self.chunk_cache[offset] = frames
+        if len(self.chunk_cache) > CHUNK_CACHE_SIZE:
+            self.chunk_cache.popitem(last=False)
+
+        return frames
+
+    def read_signals(self, index):
+        '''
+        Reads a raw signals frame back into a Pandas DataFrame with its original column labels.
+        Frames stored without their time column get it back from the session's time record.
+        '''
+
+        import pandas as pd
+
+        capture, record = self.read_frame(index)
+        if record.get('shared_time'):
+            signals = np.empty((capture.shape[0], capture.shape[1] + 1), dtype=np.result_type(capture.dtype, np.float64))
+            signals[:, 0] = self.read_time(record['time_index'])
+            signals[:, 1:] = capture
+            capture = signals
+
+        return pd.DataFrame(capture, columns=record.get('columns'))
+
+    def read_time(self, time_index):
+        '''
+        Reads the sample times of raw signals frames (see the 'time_index' of a frame's metadata).
+
+        Output:
+            time_vector: 1D Numpy array of sample times [s]
+        '''
+
+        if time_index not in self.time_cache:
+            record = self.time_records[time_index]
+            self.file.seek(record['offset'])
+            self.time_cache[time_index] = np.frombuffer(self.file.read(record['nbytes']), dtype=np.float64)
+
+        return self.time_cache[time_index]
+
+    def read_axes(self, axes_index):
+        '''
+        Reads a set of axes from the session.
+
+        Input:
+            axes_index: int, index of the axes record (see the 'axes_index' of a frame's metadata)
+
+        Outputs:
+            names: list of axis names
+            axes: list of 1D Numpy arrays
+        '''
+
+        record = self.axes_records[axes_index]
+        self.file.seek(record['offset'])
+        values = np.frombuffer(self.file.read(record['nbytes']), dtype=np.float64)
+        boundaries = np.cumsum(record['lengths'])[:-1]
+
+        return record['names'], np.split(values, boundaries)
+
+    def close(self):
+        '''Closes the session file.'''
+
+        self.file.close()
+
+def export_session_csv(session_file, prefix=None):
+    '''
+    Exports a binary session to the original CSV layout: [prefix]_[capture_number]_[capture_type].csv
+    for every frame plus the matching [prefix]_[capture_number]_im_2d_axes.csv/im_3d_axes.csv files.
+    Frames from a multi-device session are exported with [prefix]_[device] as their prefix.
+    3D images kept in the session's image stores ([prefix]_im_3d*.wbi) are exported as well.
+
+    Inputs:
+        session_file: str, binary session file to export
+        prefix: str, prefix of the CSV files. Defaults to the session file name without its extension.
+
+    Output:
+        file_names: list of the CSV files written
+    '''
+
+    session_prefix = session_file[:-len(SESSION_EXTENSION)] if session_file.endswith(SESSION_EXTENSION) else session_file
+    if prefix is None:
+        prefix = session_prefix
+
+    file_names = []
+    reader = SessionReader(session_file)
+    try:
+        for index, record in enumerate(reader.frames):
+            capture_type = record['capture_type']
+            frame_prefix = '{}_{}'.format(prefix, record['device']) if 'device' in record else prefix
+            file_name = '{}_{}_{}.csv'.format(frame_prefix, record['capture_no'], capture_type)
+            if capture_type in TABLE_CAPTURE_TYPES:
+                capture = reader.read_signals(index)
+            else:
+                capture, _ = reader.read_frame(index)
+            write_csv_capture(file_name, capture, capture_type)
+            file_names.append(file_name)
+
+            if capture_type in (IMAGE_SLICE, IMAGE) and record['axes_index'] >= 0:
+                axes_file_name = '{}_{}_{}_axes.csv'.format(frame_prefix, record['capture_no'], capture_type)
+                names, axes = reader.read_axes(record['axes_index'])
+                write_csv_axes(axes_file_name, names, axes)
+                file_names.append(axes_file_name)
+    finally:
+        reader.close()
+
+    for image_store_file in image_store_file_names(session_prefix):
+        image_store = ImageStoreReader(image_store_file)
+        names, axes = image_store.get_axes()
+        for index in range(len(image_store)):
+            capture_no = int(image_store.capture_nos[index])
+            file_name = '{}_{}_{}.csv'.format(prefix, capture_no, IMAGE)
+            write_csv_capture(file_name, image_store[index], IMAGE)
+            file_names.append(file_name)
+            if names:
+                axes_file_name = '{}_{}_{}_axes.csv'.format(prefix, capture_no, IMAGE)
+                write_csv_axes(axes_file_name, names, axes)
+                file_names.append(axes_file_name)
+        image_store.close()
+
+    return file_names
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) != 2:
+        print('Usage: python walabot_storage.py <session{}>'.format(SESSION_EXTENSION))
+        sys.exit(1)
+
+    for exported_file in export_session_csv(sys.argv[1]):
+        print(exported_file)
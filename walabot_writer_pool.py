@@ -0,0 +1,113 @@
+from queue import Queue, Empty
+import threading
+import zlib
+from walabot_metrics import metrics
+
+class WriterPool():
+    '''
+    Runs save jobs on background threads so that writing to disk never holds up triggering.
+
+    Every job is submitted with a key (usually the name of the file it writes to). Jobs with
+    the same key always run on the same worker thread, in the order they were submitted, so
+    appends to one file never interleave. The number of jobs waiting is bounded: once the limit
+    is reached, submit() blocks until a worker catches up.
+
+    The outcome of each job is put in a results queue which the GUI polls on its own thread.
+    '''
+
+    def __init__(self, num_workers=2, max_pending=32):
+        '''
+        Inputs:
+            num_workers: int, number of writer threads
+            max_pending: int, maximum number of jobs waiting across all workers
+        '''
+
+        self.job_queues = [Queue() for _ in range(num_workers)]
+        self.results = Queue()
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.max_pending = max_pending
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+        self.workers = []
+        for index, job_queue in enumerate(self.job_queues):
+            worker = threading.Thread(target=self.run, args=(job_queue,),
+                                      name='walabot-writer-{}'.format(index), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, key, description, function, *args):
+        '''
+        Queues a save job.
+
+        Inputs:
+            key: str, jobs with the same key run in order on the same worker (e.g. the file name)
+            description: str, what the job saves. Reported back with the job's result.
+            function: callable doing the actual writing
+            *args: arguments passed to 'function'
+        '''
+
+        self.slots.acquire()
+        with self.pending_lock:
+            self.pending += 1
+        # crc32 rather than hash() so that the key -> worker mapping is stable between runs
+        job_queue = self.job_queues[zlib.crc32(key.encode('utf-8')) % len(self.job_queues)]
+        job_queue.put((description, function, args))
+
+    def run(self, job_queue):
+        '''Worker loop: runs jobs until a None job is received.'''
+
+        while True:
+            job = job_queue.get()
+            if job is None:
+                job_queue.task_done()
+                break
+
+            description, function, args = job
+            error = None
+            try:
+                with metrics.timer('writer.job'):
+                    function(*args)
+            except Exception as exception:  # Reported to the GUI rather than killing the worker
+                error = '{}: {}'.format(type(exception).__name__, exception)
+
+            with self.pending_lock:
+                self.pending -= 1
+            self.slots.release()
+            self.results.put((description, error))
+            job_queue.task_done()
+
+    def get_queue_depth(self):
+        '''Returns the number of jobs that have been submitted but not finished yet.'''
+
+        with self.pending_lock:
+            return self.pending
+
+    def get_results(self):
+        '''
+        Returns the results of the jobs finished since the last call.
+
+        Output:
+            results: list of (description, error) tuples. error is None if the job succeeded.
+        '''
+
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except Empty:
+                return results
+
+    def flush(self):
+        '''Waits until every job submitted so far has finished.'''
+
+        for job_queue in self.job_queues:
+            job_queue.join()
+
+    def shutdown(self):
+        '''Finishes all queued jobs in order and stops the worker threads.'''
+
+        for job_queue in self.job_queues:
+            job_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []